@@ -0,0 +1,133 @@
+# cloudapp/admission.py
+import asyncio
+import random
+import time
+from collections import deque
+
+# Admission control for slow upstream calls (the AI endpoints). At most
+# `limit` calls run at once and at most `per_user` per user; the rest wait in
+# a FIFO queue of bounded length, each with its own deadline. A waiter whose
+# user is already at their cap is skipped so it can't hold up other users.
+
+
+class Rejected(Exception):
+    """The call wasn't admitted: the queue was full or the deadline passed."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionController:
+
+    def __init__(self, limit, per_user, max_queue, timeout):
+        self.limit = limit
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.active_by_user = {}
+        self.waiters = deque()          # [future, user_id]
+        self._recent_waits = deque(maxlen=200)
+        self._stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_full": 0,
+            "timeouts": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+
+    def _has_room(self, user_id):
+        return self.active < self.limit and self.active_by_user.get(user_id, 0) < self.per_user
+
+    def _admit(self, user_id):
+        self.active += 1
+        self.active_by_user[user_id] = self.active_by_user.get(user_id, 0) + 1
+
+    def _wake(self):
+        for waiter in list(self.waiters):
+            if self.active >= self.limit:
+                return
+            future, user_id = waiter
+            if future.done() or not self._has_room(user_id):
+                continue
+            self.waiters.remove(waiter)
+            self._admit(user_id)
+            future.set_result(None)
+
+    async def acquire(self, user_id):
+        queued = time.monotonic()
+        # release() wakes every waiter that fits, so anyone still queued is
+        # blocked by the global limit or their own cap; a newcomer with room
+        # doesn't jump ahead of anyone who could run.
+        if self._has_room(user_id):
+            self._admit(user_id)
+        else:
+            if len(self.waiters) >= self.max_queue:
+                self._stats["rejected_full"] += 1
+                raise Rejected("queue_full")
+
+            self._stats["queued"] += 1
+            waiter = [asyncio.get_running_loop().create_future(), user_id]
+            self.waiters.append(waiter)
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter[0]), timeout=self.timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter[0].done():
+                    # Admitted just as we gave up; hand the slot on
+                    self.release(user_id)
+                else:
+                    waiter[0].cancel()
+                    self.waiters.remove(waiter)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self._stats["timeouts"] += 1
+                raise Rejected("timeout")
+
+        waited = time.monotonic() - queued
+        self._stats["admitted"] += 1
+        self._stats["wait_total"] += waited
+        self._stats["wait_max"] = max(self._stats["wait_max"], waited)
+        self._recent_waits.append(waited)
+
+    def release(self, user_id):
+        self.active -= 1
+        remaining = self.active_by_user.get(user_id, 1) - 1
+        if remaining:
+            self.active_by_user[user_id] = remaining
+        else:
+            self.active_by_user.pop(user_id, None)
+        self._wake()
+
+    def slot(self, user_id):
+        return _Slot(self, user_id)
+
+    def get_stats(self):
+        waits = sorted(self._recent_waits)
+        return dict(
+            self._stats,
+            active=self.active,
+            queue_depth=len(self.waiters),
+            wait_p50=waits[len(waits) // 2] if waits else 0.0,
+            wait_p95=waits[int(len(waits) * 0.95)] if waits else 0.0,
+        )
+
+
+class _Slot:
+
+    def __init__(self, controller, user_id):
+        self.controller = controller
+        self.user_id = user_id
+
+    async def __aenter__(self):
+        await self.controller.acquire(self.user_id)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.controller.release(self.user_id)
+
+
+def backoff_delay(attempt, base, cap):
+    # Full jitter: spreads retries from many callers instead of syncing them up
+    return random.uniform(0, min(cap, base * 2 ** attempt))
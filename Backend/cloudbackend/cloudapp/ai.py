@@ -0,0 +1,287 @@
+# cloudapp/ai.py
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from django.conf import settings
+from google import genai
+from google.genai import errors, types
+from . import admission
+
+# Gemini code generation shared by the blocking endpoint and the streaming
+# one. GEMINI_BASE_URL points the client at another host (e.g. a local fake
+# model server) instead of Google's API.
+#
+# Clients are long-lived (one per event loop) so upstream connections are
+# reused. Finished generations are cached by a hash of everything
+# that goes into the prompt, so a room repeating the same request gets the
+# answer without another model call; identical requests in flight share one.
+#
+# Upstream calls go through `limiter` (global and per-user caps, bounded
+# queue with deadlines) and are retried with jittered backoff when the model
+# API answers 429/503.
+
+RETRY_STATUSES = (429, 503)
+
+_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()   # loop -> genai.Client
+_responses = OrderedDict()                      # cache key -> (generated_code, expires_at)
+_inflight = {}                                  # (loop, cache key) -> asyncio.Future
+_RETRY = object()                               # flight result: leader cancelled, generate again
+
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "coalesced": 0,
+    "upstream_calls": 0,
+    "retries": 0,
+    "upstream_errors": 0,
+    "evictions": 0,
+}
+
+limiter = admission.AdmissionController(
+    limit=settings.AI_MAX_CONCURRENCY,
+    per_user=settings.AI_PER_USER,
+    max_queue=settings.AI_MAX_QUEUE,
+    timeout=settings.AI_QUEUE_TIMEOUT,
+)
+
+
+def _new_client():
+    http_options = types.HttpOptions(base_url=settings.GEMINI_BASE_URL) if settings.GEMINI_BASE_URL else None
+    return genai.Client(api_key=settings.GEMINI_API_KEY, http_options=http_options)
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = _new_client()
+    return client
+
+
+# --- RESPONSE CACHE ---
+def cache_key(prompt, current_code, language, problem_context, mode="code"):
+    payload = json.dumps(
+        [settings.GEMINI_MODEL, mode, prompt, current_code, language, problem_context],
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cached_response(key):
+    with _lock:
+        entry = _responses.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                _responses.move_to_end(key)
+                _stats["hits"] += 1
+                return entry[0]
+            del _responses[key]
+            _stats["evictions"] += 1
+        _stats["misses"] += 1
+        return None
+
+
+def remember_response(key, generated_code):
+    with _lock:
+        _responses[key] = (generated_code, time.monotonic() + settings.AI_CACHE_TTL)
+        _responses.move_to_end(key)
+        while len(_responses) > settings.AI_CACHE_MAX:
+            _responses.popitem(last=False)
+            _stats["evictions"] += 1
+
+
+def _system_instruction(language, problem_context):
+    system_instruction = f"You are an expert coding assistant. The user is writing code in {language}.\n"
+
+    if problem_context:
+        system_instruction += f"The user is solving this problem: {problem_context}\n\n"
+    return system_instruction
+
+
+def build_prompt(prompt, current_code, language, problem_context):
+    system_instruction = _system_instruction(language, problem_context)
+
+    return f"""
+        {system_instruction}
+        Here is their current code:
+        ```
+        {current_code}
+        ```
+        User Request: "{prompt}"
+
+        Instructions:
+        1. Return ONLY the full, updated code.
+        2. Do not include markdown backticks (```) or language names in the response.
+        3. Do not add conversational text like "Here is the code". Just the code.
+        """
+
+
+def build_edit_prompt(prompt, current_code, language, problem_context):
+    system_instruction = _system_instruction(language, problem_context)
+
+    return f"""
+        {system_instruction}
+        Here is their current code:
+        ```
+        {current_code}
+        ```
+        User Request: "{prompt}"
+
+        Instructions:
+        1. Return ONLY a JSON array of edits, with no markdown and no other text.
+        2. Each edit is {{"find": "...", "replace": "..."}}: "find" is an exact snippet of the
+           current code that occurs exactly once (include neighbouring lines if needed to make
+           it unique) and "replace" is the text that takes its place.
+        3. Do not repeat unchanged code. Return [] if nothing needs to change.
+        """
+
+
+def clean_code(text):
+    # The model sometimes wraps the file in a markdown fence anyway
+    generated_code = text.strip()
+    if generated_code.startswith("```"):
+        generated_code = generated_code.split("\n", 1)[1] # Remove first line
+    if generated_code.endswith("```"):
+        generated_code = generated_code.rsplit("\n", 1)[0] # Remove last line
+    return generated_code
+
+
+async def _with_retries(call):
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except errors.APIError as e:
+            if e.code not in RETRY_STATUSES or attempt >= settings.AI_RETRIES:
+                _stats["upstream_errors"] += 1
+                raise
+            _stats["retries"] += 1
+            await asyncio.sleep(admission.backoff_delay(attempt, settings.AI_RETRY_BASE, settings.AI_RETRY_CAP))
+            attempt += 1
+
+
+async def _generate_upstream(contents, user_id, config=None):
+    async def call():
+        _stats["upstream_calls"] += 1
+        return await get_async_client().aio.models.generate_content(
+            model=settings.GEMINI_MODEL, contents=contents, config=config,
+        )
+
+    async with limiter.slot(user_id):
+        response = await _with_retries(call)
+    return response.text
+
+
+async def _generate_cached(key, contents, user_id, config=None):
+    cached = cached_response(key)
+    if cached is not None:
+        return cached
+
+    flight_key = (asyncio.get_running_loop(), key)
+    future = _inflight.get(flight_key)
+    if future is not None:
+        _stats["coalesced"] += 1
+        generated_code = await asyncio.shield(future)
+        if generated_code is _RETRY:
+            # The leader's request went away; lead with our own request instead
+            return await _generate_cached(key, contents, user_id, config)
+        return generated_code
+
+    future = _inflight[flight_key] = asyncio.get_running_loop().create_future()
+    try:
+        generated_code = clean_code(await _generate_upstream(contents, user_id, config))
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved when nobody else is waiting
+        raise
+    except BaseException:
+        future.set_result(_RETRY)
+        raise
+    else:
+        remember_response(key, generated_code)
+        future.set_result(generated_code)
+        return generated_code
+    finally:
+        _inflight.pop(flight_key, None)
+
+
+async def generate_code(prompt, current_code, language, problem_context, user_id=None):
+    """
+    Full updated file for the request. Raises admission.Rejected when the
+    call can't be admitted and errors.APIError when the model API fails.
+    """
+    key = cache_key(prompt, current_code, language, problem_context)
+    return await _generate_cached(key, build_prompt(prompt, current_code, language, problem_context), user_id)
+
+
+async def generate_edits(prompt, current_code, language, problem_context, user_id=None):
+    """Raw edit-list answer for the request (see build_edit_prompt); same errors as generate_code."""
+    key = cache_key(prompt, current_code, language, problem_context, mode="edits")
+    return await _generate_cached(
+        key, build_edit_prompt(prompt, current_code, language, problem_context), user_id,
+        config=types.GenerateContentConfig(response_mime_type="application/json"),
+    )
+
+
+async def stream_code(prompt, current_code, language, problem_context, user_id=None):
+    """
+    Async generator of raw text chunks as the model produces them. Closing it
+    (or cancelling the task iterating it) closes the upstream stream, which
+    stops the generation. A cached answer comes back as a single chunk.
+    """
+    key = cache_key(prompt, current_code, language, problem_context)
+    cached = cached_response(key)
+    if cached is not None:
+        yield cached
+        return
+
+    async def call():
+        # The SDK's stream is lazy: the request (and any 429/503) only
+        # happens when the first chunk is read
+        _stats["upstream_calls"] += 1
+        stream = await get_async_client().aio.models.generate_content_stream(
+            model=settings.GEMINI_MODEL,
+            contents=build_prompt(prompt, current_code, language, problem_context),
+        )
+        try:
+            return stream, [await stream.__anext__()]
+        except StopAsyncIteration:
+            return stream, []
+        except BaseException:
+            await stream.aclose()
+            raise
+
+    parts = []
+    async with limiter.slot(user_id):
+        # Retries only cover the first chunk, never a half-delivered answer
+        stream, first = await _with_retries(call)
+        try:
+            for chunk in first:
+                if chunk.text:
+                    parts.append(chunk.text)
+                    yield chunk.text
+            async for chunk in stream:
+                if chunk.text:
+                    parts.append(chunk.text)
+                    yield chunk.text
+        finally:
+            await stream.aclose()
+    # Only complete generations are cached
+    remember_response(key, clean_code("".join(parts)))
+
+
+def get_stats():
+    with _lock:
+        size = len(_responses)
+    lookups = _stats["hits"] + _stats["misses"]
+    return dict(
+        _stats,
+        admission=limiter.get_stats(),
+        entries=size,
+        hit_rate=round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+    )
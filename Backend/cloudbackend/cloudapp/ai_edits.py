@@ -0,0 +1,66 @@
+# cloudapp/ai_edits.py
+import json
+from . import ot
+from .ai import clean_code
+
+# Turn the model's edit list ([{"find": ..., "replace": ...}, ...], see
+# ai.build_edit_prompt) into editor ops against the code it was given.
+# Every "find" has to match exactly once and edits may not overlap;
+# anything else is a PatchError and the caller falls back to a full file.
+
+
+class PatchError(Exception):
+    """The model's edits don't apply cleanly to the code."""
+
+
+def parse_edits(text):
+    try:
+        edits = json.loads(clean_code(text))
+    except ValueError as e:
+        raise PatchError(f"not JSON: {e}")
+    if isinstance(edits, dict):
+        edits = edits.get("edits")
+    if not isinstance(edits, list):
+        raise PatchError("expected a list of edits")
+
+    for edit in edits:
+        if not (isinstance(edit, dict) and isinstance(edit.get("find"), str)
+                and isinstance(edit.get("replace"), str)):
+            raise PatchError("each edit needs string find/replace")
+        if not edit["find"]:
+            raise PatchError("empty find")
+    return edits
+
+
+def edits_to_ops(code, edits):
+    """
+    Ops (in ot's format) that turn `code` into the edited text. Only the
+    characters that actually change are deleted/inserted.
+    """
+    located = []
+    for edit in edits:
+        pos = code.find(edit["find"])
+        if pos < 0:
+            raise PatchError(f"snippet not found: {edit['find'][:60]!r}")
+        if code.find(edit["find"], pos + 1) >= 0:
+            raise PatchError(f"snippet is ambiguous: {edit['find'][:60]!r}")
+        located.append((pos, edit["find"], edit["replace"]))
+
+    located.sort(key=lambda item: item[0])
+    for (pos, find, _), (next_pos, _, _) in zip(located, located[1:]):
+        if pos + len(find) > next_pos:
+            raise PatchError("edits overlap")
+
+    # Back to front, so each op's position is still valid in the text
+    # produced by the ops before it
+    ops = []
+    for pos, find, replace in reversed(located):
+        prefix, suffix = ot.common_affixes(find, replace)
+        start = pos + prefix
+        removed = len(find) - prefix - suffix
+        inserted = replace[prefix:len(replace) - suffix]
+        if removed:
+            ops.append({"op": "delete", "pos": start, "length": removed})
+        if inserted:
+            ops.append({"op": "insert", "pos": start, "text": inserted})
+    return ot.normalize_ops(ops)
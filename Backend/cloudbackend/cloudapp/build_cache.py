@@ -0,0 +1,213 @@
+# cloudapp/build_cache.py
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+# Content-addressed cache of compiled programs. The key covers the language,
+# the exact compiler command line and the source, so a resubmission with new
+# stdin reuses the binary/class files instead of recompiling. Entries live in
+# one directory each under the cache root and are evicted least recently used
+# once the root grows past EXECUTION_BUILD_CACHE_MB. Only successful compiles
+# are stored.
+#
+# Cached binaries run for every later submission of the same source, so the
+# root must be private to the server's uid (checked before first use; the
+# cache is skipped otherwise) and each artifact's sha256 is recorded and
+# checked against the copy restored into the job's directory.
+#
+# Everything here is blocking file I/O; the executor calls restore() and
+# store() from worker threads, so the index is only touched under _lock.
+
+META = "build.json"
+
+_index = None           # key -> size in bytes, least recently used first
+_lock = threading.Lock()
+_root_ok = None         # root() checked private to us
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "stores": 0,
+    "evictions": 0,
+    "corrupt": 0,
+    "compile_time_saved": 0.0,
+}
+
+
+def root():
+    return settings.EXECUTION_BUILD_CACHE_DIR or os.path.join(os.path.expanduser("~"), ".cache", "codemate-builds")
+
+
+def _usable():
+    global _root_ok
+    if _root_ok is None:
+        try:
+            os.makedirs(root(), mode=0o700, exist_ok=True)
+            st = os.stat(root())
+            _root_ok = st.st_uid == os.getuid() and not st.st_mode & 0o077
+        except OSError:
+            _root_ok = False
+        if not _root_ok:
+            print(f"Build cache disabled: {root()} must be a directory only this user can access")
+    return _root_ok
+
+
+class _Corrupt(ValueError):
+    """A cached artifact doesn't match the hash recorded when it was stored."""
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def key(language, argv, code):
+    digest = hashlib.sha256()
+    for part in (language, "\0".join(argv), code):
+        digest.update(part.encode())
+        digest.update(b"\0\0")
+    return digest.hexdigest()
+
+
+def _entry_size(path):
+    total = 0
+    for name in os.listdir(path):
+        try:
+            total += os.path.getsize(os.path.join(path, name))
+        except OSError:
+            pass
+    return total
+
+
+def _load_index():
+    # Rebuilt from disk so entries written by other worker processes count too
+    global _index
+    entries = []
+    for name in os.listdir(root()) if _usable() else ():
+        path = os.path.join(root(), name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        try:
+            entries.append((os.path.getmtime(path), name, _entry_size(path)))
+        except OSError:
+            pass  # evicted by another process mid-scan
+    entries.sort()
+    _index = OrderedDict((name, size) for _, name, size in entries)
+    return _index
+
+
+def _get_index():
+    return _index if _index is not None else _load_index()
+
+
+def restore(build_key, workdir):
+    """
+    Copy a cached build into workdir. Returns the original compile result
+    (marked "cached") or None on a miss.
+    """
+    if not _usable():
+        _stats["misses"] += 1
+        return None
+
+    path = os.path.join(root(), build_key)
+    copied = []
+    try:
+        with open(os.path.join(path, META)) as f:
+            meta = json.load(f)
+        # Copies, not hard links: the program may write to its own files
+        for name, sha256 in meta["artifacts"].items():
+            target = os.path.join(workdir, name)
+            shutil.copy2(os.path.join(path, name), target)
+            copied.append(target)
+            if _sha256(target) != sha256:
+                raise _Corrupt(name)
+        os.utime(path)
+    except (OSError, ValueError, KeyError, AttributeError) as e:
+        # Old-format, half-evicted or tampered entry: compile from scratch
+        for target in copied:
+            os.remove(target)
+        if isinstance(e, _Corrupt):
+            _stats["corrupt"] += 1
+            print(f"Dropped build cache entry {build_key}: {e} doesn't match its recorded hash")
+            shutil.rmtree(path, ignore_errors=True)
+            with _lock:
+                _get_index().pop(build_key, None)
+        _stats["misses"] += 1
+        return None
+
+    with _lock:
+        index = _get_index()
+        if build_key in index:
+            index.move_to_end(build_key)
+    _stats["hits"] += 1
+    _stats["compile_time_saved"] += meta["result"].get("time", 0.0)
+    return dict(meta["result"], cached=True)
+
+
+def store(build_key, workdir, patterns, result):
+    """Save the artifacts matching `patterns` from a successful compile in workdir."""
+    artifacts = []
+    for pattern in patterns:
+        artifacts += [os.path.basename(p) for p in glob.glob(os.path.join(workdir, pattern))]
+    if not artifacts or not _usable():
+        return
+
+    final = os.path.join(root(), build_key)
+    staging = tempfile.mkdtemp(prefix=".tmp-", dir=root())
+    try:
+        hashes = {}
+        for name in artifacts:
+            shutil.copy2(os.path.join(workdir, name), os.path.join(staging, name))
+            hashes[name] = _sha256(os.path.join(staging, name))
+        with open(os.path.join(staging, META), "w") as f:
+            json.dump({"artifacts": hashes, "result": result, "created": time.time()}, f)
+        # Atomic publish; if another process stored the same build first, keep theirs
+        os.rename(staging, final)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        return
+
+    size = _entry_size(final)
+    with _lock:
+        index = _get_index()
+        index[build_key] = size
+        _stats["stores"] += 1
+        victims = _evict() if sum(index.values()) > settings.EXECUTION_BUILD_CACHE_MB * 1024 * 1024 else []
+    for name in victims:
+        shutil.rmtree(os.path.join(root(), name), ignore_errors=True)
+
+
+def _evict():
+    """Drop least recently used entries from the index (with _lock held); returns their keys."""
+    index = _load_index()
+    limit = settings.EXECUTION_BUILD_CACHE_MB * 1024 * 1024
+    total = sum(index.values())
+    victims = []
+    while index and total > limit:
+        name, size = index.popitem(last=False)
+        victims.append(name)
+        total -= size
+        _stats["evictions"] += 1
+    return victims
+
+
+def get_stats():
+    with _lock:
+        index = _get_index()
+        entries, size = len(index), sum(index.values())
+    lookups = _stats["hits"] + _stats["misses"]
+    return dict(
+        _stats,
+        hit_rate=round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+        entries=entries,
+        bytes=size,
+    )
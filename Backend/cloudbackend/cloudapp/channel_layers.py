@@ -0,0 +1,539 @@
+# cloudapp/channel_layers.py
+import asyncio
+import bisect
+import copy
+import hashlib
+import time
+from collections import deque
+from urllib.parse import urlparse
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.utils.module_loading import import_string
+
+# Channel layer that spreads room groups over several backend layers
+# ("shards"), usually one RedisChannelLayer per Redis host. Each group name
+# (editor_<room token>) is placed on a shard by a consistent-hash ring, so a
+# hot room keeps all its traffic on one Redis and adding a host only moves
+# about 1/N of the rooms. Every shard is a full layer of its own and keeps
+# its own connection pools.
+#
+# A channel can receive from more than one shard: direct sends go to the
+# shard its own name hashes to, group messages to the shard of each group it
+# has joined. receive() listens on exactly those shards and merges them.
+#
+#     CHANNEL_LAYERS = {"default": {
+#         "BACKEND": "cloudapp.channel_layers.ShardedChannelLayer",
+#         "CONFIG": {"shards": [{"hosts": [url_a]}, {"hosts": [url_b]}]},
+#     }}
+#
+# With "backend": "channels.layers.InMemoryChannelLayer" (and empty shard
+# configs) it runs without Redis.
+#
+# HybridChannelLayer (below) sits in front of either one and keeps traffic
+# between members in the same process off the network.
+
+RATE_WINDOW = 60   # seconds of history behind the per-shard rates
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent-hash ring with `replicas` virtual points per node."""
+
+    def __init__(self, nodes, replicas=64):
+        self.nodes = list(nodes)
+        points = sorted(
+            (_hash(f"{node}#{replica}"), index)
+            for index, node in enumerate(self.nodes)
+            for replica in range(replicas)
+        )
+        self._keys = [point for point, _ in points]
+        self._owners = [index for _, index in points]
+
+    def index(self, key):
+        position = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[position]
+
+
+class _Throughput:
+    """Message counter with a rate over the last RATE_WINDOW seconds."""
+
+    def __init__(self):
+        self.total = 0
+        self._buckets = deque()   # [second, count]
+
+    def add(self, count=1):
+        self.total += count
+        now = int(time.monotonic())
+        if self._buckets and self._buckets[-1][0] == now:
+            self._buckets[-1][1] += count
+        else:
+            self._buckets.append([now, count])
+        self._trim(now)
+
+    def _trim(self, now):
+        while self._buckets and self._buckets[0][0] <= now - RATE_WINDOW:
+            self._buckets.popleft()
+
+    def rate(self):
+        self._trim(int(time.monotonic()))
+        return round(sum(count for _, count in self._buckets) / RATE_WINDOW, 2)
+
+
+class _Shard:
+
+    def __init__(self, index, label, layer):
+        self.index = index
+        self.label = label
+        self.layer = layer
+        self.sends = _Throughput()
+        self.group_sends = _Throughput()
+        self.received = _Throughput()
+        self.errors = 0
+        self.members = {}     # group -> channels added through this process
+
+    def get_stats(self):
+        return {
+            "shard": self.label,
+            "sends": self.sends.total,
+            "group_sends": self.group_sends.total,
+            "received": self.received.total,
+            "send_rate": round(self.sends.rate() + self.group_sends.rate(), 2),
+            "receive_rate": self.received.rate(),
+            "errors": self.errors,
+            "local_groups": len(self.members),
+        }
+
+
+class _Inbox:
+    """Merged receive queue of one local channel plus its per-shard listeners."""
+
+    def __init__(self, capacity):
+        # Bounded, so a consumer that stops reading backs up into the shard
+        # layer and hits its capacity there
+        self.queue = asyncio.Queue(capacity)
+        self.shards = set()     # shard indexes this channel can get messages on
+        self.listeners = {}     # shard index -> task
+
+
+def _label(index, config):
+    # Host name only; Redis URLs carry credentials
+    hosts = config.get("hosts") or []
+    host = hosts[0] if hosts else None
+    if isinstance(host, dict):
+        host = host.get("address")
+    if isinstance(host, str):
+        return f"{index}:{urlparse(host).hostname or host}"
+    return str(index)
+
+
+def url_ring(urls, replicas=64):
+    """The ring a ShardedChannelLayer with one shard per URL in `urls` places names by."""
+    return HashRing([_label(index, {"hosts": [url]}) for index, url in enumerate(urls)], replicas)
+
+
+class ShardedChannelLayer(BaseChannelLayer):
+
+    extensions = ["groups", "flush"]
+
+    def __init__(self, shards=None, backend="channels_redis.core.RedisChannelLayer",
+                 replicas=64, expiry=60, capacity=100, channel_capacity=None, **options):
+        super().__init__(expiry=expiry, capacity=capacity)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        if not shards:
+            raise ValueError("ShardedChannelLayer needs at least one shard")
+
+        layer_class = import_string(backend) if isinstance(backend, str) else backend
+        self.shards = []
+        for index, config in enumerate(shards):
+            layer = layer_class(
+                expiry=expiry, capacity=capacity, channel_capacity=channel_capacity,
+                **{**options, **config},
+            )
+            self.shards.append(_Shard(index, _label(index, config), layer))
+
+        # Redis layers only receive "!" channels carrying their own client
+        # prefix; share one so a channel name is valid on every shard
+        prefix = getattr(self.shards[0].layer, "client_prefix", None)
+        if prefix is not None:
+            for shard in self.shards:
+                shard.layer.client_prefix = prefix
+
+        self.ring = HashRing([shard.label for shard in self.shards], replicas)
+        self._local = set()    # channels created here by new_channel()
+        self._inboxes = {}     # channel -> _Inbox
+
+    def shard_for(self, name):
+        return self.shards[self.ring.index(name)]
+
+    # --- SENDING ---
+    async def send(self, channel, message):
+        shard = self.shard_for(channel)
+        try:
+            await shard.layer.send(channel, message)
+        except Exception:
+            shard.errors += 1
+            raise
+        shard.sends.add()
+
+    async def group_send(self, group, message):
+        shard = self.shard_for(group)
+        try:
+            await shard.layer.group_send(group, message)
+        except Exception:
+            shard.errors += 1
+            raise
+        shard.group_sends.add()
+
+    # --- RECEIVING ---
+    async def new_channel(self, prefix="specific"):
+        channel = await self.shards[0].layer.new_channel(prefix)
+        self._local.add(channel)
+        return channel
+
+    def _listen(self, channel, shard):
+        inbox = self._inboxes.get(channel)
+        if inbox is None:
+            inbox = self._inboxes[channel] = _Inbox(self.get_capacity(channel))
+        inbox.shards.add(shard.index)
+        # Also restarts any listener that stopped on an error
+        for index in inbox.shards - inbox.listeners.keys():
+            inbox.listeners[index] = asyncio.ensure_future(
+                self._forward(channel, self.shards[index], inbox)
+            )
+        return inbox
+
+    async def _forward(self, channel, shard, inbox):
+        while True:
+            try:
+                message = await shard.layer.receive(channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Hand the failure to the receiver; its next receive() restarts us
+                shard.errors += 1
+                inbox.listeners.pop(shard.index, None)
+                await inbox.queue.put(e)
+                return
+            shard.received.add()
+            await inbox.queue.put(message)
+
+    async def receive(self, channel):
+        inbox = self._listen(channel, self.shard_for(channel))
+        try:
+            message = await inbox.queue.get()
+        except asyncio.CancelledError:
+            # Like the Redis layer: a cancelled receive means the consumer is
+            # going away, so stop listening for it
+            self._close_inbox(channel)
+            raise
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    def _close_inbox(self, channel):
+        self._local.discard(channel)
+        inbox = self._inboxes.pop(channel, None)
+        if inbox is not None:
+            for task in inbox.listeners.values():
+                task.cancel()
+
+    # --- GROUPS ---
+    async def group_add(self, group, channel):
+        shard = self.shard_for(group)
+        await shard.layer.group_add(group, channel)
+        shard.members.setdefault(group, set()).add(channel)
+        if channel in self._local or channel in self._inboxes:
+            self._listen(channel, shard)
+
+    async def group_discard(self, group, channel):
+        shard = self.shard_for(group)
+        await shard.layer.group_discard(group, channel)
+        members = shard.members.get(group)
+        if members is not None:
+            members.discard(channel)
+            if not members:
+                del shard.members[group]
+
+    # --- HOUSEKEEPING ---
+    async def flush(self):
+        for channel in list(self._inboxes):
+            self._close_inbox(channel)
+        self._local.clear()
+        for shard in self.shards:
+            shard.members.clear()
+            await shard.layer.flush()
+
+    async def close_pools(self):
+        for shard in self.shards:
+            if hasattr(shard.layer, "close_pools"):
+                await shard.layer.close_pools()
+
+    def get_stats(self):
+        return {
+            "shards": [shard.get_stats() for shard in self.shards],
+            "local_channels": len(self._inboxes),
+        }
+
+
+# --- HYBRID LAYER ---
+# Group messages are handed straight to members in this process (a copy per
+# member, as the in-memory layer does) and only go through the inner layer
+# when another process has members of the group too. On the inner layer a
+# process joins each group once, with a single node channel, instead of once
+# per consumer, and fans what arrives there out to its local members.
+#
+# Processes find out about each other per group: the first local member to
+# join announces the node to the group, nodes already in it answer, and the
+# last member to leave says goodbye. For DISCOVERY_WINDOW seconds after
+# joining, a node publishes everything while the others answer; after that,
+# if none did, it treats itself as alone in the room. A group with no local
+# members is always published, so views and other processes can still
+# reach rooms hosted anywhere.
+#
+# The inner layer drops group members after its group_expiry, so the node
+# re-adds itself to every group it serves each `refresh_interval` seconds.
+
+DISCOVERY_WINDOW = 5   # seconds; covers the round trip of join -> here
+
+class _LocalChannel:
+
+    def __init__(self, capacity):
+        self.queue = asyncio.Queue(capacity)
+        self.forwarder = None   # task for direct sends arriving through the inner layer
+
+
+class HybridChannelLayer(BaseChannelLayer):
+
+    extensions = ["groups", "flush"]
+
+    def __init__(self, inner=None, expiry=60, capacity=100, channel_capacity=None, refresh_interval=3600):
+        super().__init__(expiry=expiry, capacity=capacity)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.refresh_interval = refresh_interval
+        inner = inner or {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+        self.inner = import_string(inner["BACKEND"])(**inner.get("CONFIG", {}))
+        self._channels = {}     # local channel -> _LocalChannel
+        self._groups = {}       # group -> local channels
+        self._remote = {}       # group -> node channels of other processes in it
+        self._discovery = {}    # group -> loop time until which it is published regardless
+        self._node = None       # this process's channel on the inner layer
+        self._node_task = None
+        self._refresh_task = None
+        self._node_loop = None
+        self._stats = {
+            "local_deliveries": 0,
+            "local_only": 0,       # group sends that never left the process
+            "published": 0,
+            "remote_received": 0,
+            "dropped_full": 0,
+            "refreshes": 0,
+        }
+
+    # --- NODE CHANNEL ---
+    async def _ensure_node(self):
+        if self._node is None:
+            node = await self.inner.new_channel("hybrid")
+            if self._node is None:
+                self._node = node
+        loop = asyncio.get_running_loop()
+        if self._node_task is None or self._node_task.done() or self._node_loop is not loop:
+            self._node_loop = loop
+            self._node_task = loop.create_task(self._node_receive())
+            self._refresh_task = loop.create_task(self._refresh())
+
+    async def _node_receive(self):
+        while True:
+            try:
+                message = await self.inner.receive(self._node)
+                await self._node_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Hybrid layer node receive failed: {e}")
+                await asyncio.sleep(1)
+
+    async def _refresh(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            for group in list(self._groups):
+                try:
+                    await self.inner.group_add(group, self._node)
+                    self._stats["refreshes"] += 1
+                except Exception as e:
+                    print(f"Hybrid layer refresh of {group} failed: {e}")
+
+    async def _node_message(self, message):
+        group, node = message["group"], message["node"]
+        if node == self._node:
+            return  # our own publish; local members already have it
+        kind = message["type"]
+        if kind == "hybrid.message":
+            self._stats["remote_received"] += 1
+            self._deliver(group, message["message"])
+        elif group not in self._groups:
+            return
+        elif kind == "hybrid.join":
+            self._remote.setdefault(group, set()).add(node)
+            await self.inner.send(node, {"type": "hybrid.here", "group": group, "node": self._node})
+        elif kind == "hybrid.here":
+            self._remote.setdefault(group, set()).add(node)
+        elif kind == "hybrid.leave":
+            self._remote.get(group, set()).discard(node)
+
+    # --- SENDING ---
+    def _put(self, local, message):
+        local.queue.put_nowait(copy.deepcopy(message))
+        self._stats["local_deliveries"] += 1
+
+    def _deliver(self, group, message):
+        for channel in self._groups.get(group, ()):
+            try:
+                self._put(self._channels[channel], message)
+            except asyncio.QueueFull:
+                # Same as a group send through Redis: a full member is skipped
+                self._stats["dropped_full"] += 1
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        local = self._channels.get(channel)
+        if local is None:
+            await self.inner.send(channel, message)
+            return
+        try:
+            self._put(local, message)
+        except asyncio.QueueFull:
+            self._stats["dropped_full"] += 1
+            raise ChannelFull(channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.require_valid_group_name(group)
+        members = self._groups.get(group)
+        if members:
+            self._deliver(group, message)
+            if not self._remote.get(group) and not self._discovering(group):
+                self._stats["local_only"] += 1
+                return
+        await self.inner.group_send(group, {
+            "type": "hybrid.message", "group": group, "node": self._node, "message": message,
+        })
+        self._stats["published"] += 1
+
+    def _discovering(self, group):
+        until = self._discovery.get(group)
+        if until is None:
+            return False
+        if asyncio.get_running_loop().time() < until:
+            return True
+        del self._discovery[group]
+        return False
+
+    # --- RECEIVING ---
+    async def new_channel(self, prefix="specific"):
+        channel = await self.inner.new_channel(prefix)
+        self._channels[channel] = _LocalChannel(self.get_capacity(channel))
+        return channel
+
+    async def _forward(self, channel, local):
+        while True:
+            try:
+                message = await self.inner.receive(channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Hand the failure to the receiver; its next receive() restarts us
+                await local.queue.put(e)
+                return
+            await local.queue.put(message)
+
+    async def receive(self, channel):
+        local = self._channels.get(channel)
+        if local is None:
+            return await self.inner.receive(channel)
+        if local.forwarder is None or local.forwarder.done():
+            local.forwarder = asyncio.ensure_future(self._forward(channel, local))
+        try:
+            message = await local.queue.get()
+        except asyncio.CancelledError:
+            # The consumer is going away (see ShardedChannelLayer.receive)
+            self._close(channel)
+            raise
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    def _close(self, channel):
+        local = self._channels.pop(channel, None)
+        if local is not None and local.forwarder is not None:
+            local.forwarder.cancel()
+        # Normally the consumer has discarded its groups already
+        for group in [group for group, members in self._groups.items() if channel in members]:
+            self._groups[group].discard(channel)
+            if not self._groups[group]:
+                asyncio.ensure_future(self._leave(group))
+
+    # --- GROUPS ---
+    async def group_add(self, group, channel):
+        assert self.require_valid_group_name(group)
+        if channel not in self._channels:
+            await self.inner.group_add(group, channel)
+            return
+        await self._ensure_node()
+        first = group not in self._groups
+        self._groups.setdefault(group, set()).add(channel)
+        # Every join re-adds the node too; _refresh covers rooms nobody joins for a while
+        await self.inner.group_add(group, self._node)
+        if first:
+            self._remote.setdefault(group, set())
+            self._discovery[group] = asyncio.get_running_loop().time() + DISCOVERY_WINDOW
+            await self.inner.group_send(group, {"type": "hybrid.join", "group": group, "node": self._node})
+
+    async def group_discard(self, group, channel):
+        members = self._groups.get(group)
+        if members is None or channel not in members:
+            await self.inner.group_discard(group, channel)
+            return
+        members.discard(channel)
+        if not members:
+            await self._leave(group)
+
+    async def _leave(self, group):
+        if self._groups.get(group):
+            return  # someone joined again meanwhile
+        self._groups.pop(group, None)
+        self._discovery.pop(group, None)
+        remote = self._remote.pop(group, None)
+        await self.inner.group_discard(group, self._node)
+        if remote:
+            await self.inner.group_send(group, {"type": "hybrid.leave", "group": group, "node": self._node})
+
+    # --- HOUSEKEEPING ---
+    async def flush(self):
+        for local in self._channels.values():
+            if local.forwarder is not None:
+                local.forwarder.cancel()
+        for task in (self._node_task, self._refresh_task):
+            if task is not None:
+                task.cancel()
+        self._channels.clear()
+        self._groups.clear()
+        self._remote.clear()
+        self._discovery.clear()
+        self._node = self._node_task = self._refresh_task = self._node_loop = None
+        await self.inner.flush()
+
+    async def close_pools(self):
+        if hasattr(self.inner, "close_pools"):
+            await self.inner.close_pools()
+
+    def get_stats(self):
+        return dict(
+            self._stats,
+            local_channels=len(self._channels),
+            local_groups=len(self._groups),
+            shared_groups=sum(1 for nodes in self._remote.values() if nodes),
+            inner=self.inner.get_stats() if hasattr(self.inner, "get_stats") else None,
+        )
@@ -0,0 +1,62 @@
+# cloudapp/codec.py
+import json
+import msgpack
+
+# Websocket frame encoding. Uses orjson when it is installed and falls back
+# to the stdlib json module otherwise; both return/accept str.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    def loads(text):
+        return orjson.loads(text)
+else:
+    def dumps(obj):
+        return json.dumps(obj, separators=(",", ":"))
+
+    def loads(text):
+        return json.loads(text)
+
+
+def frame(data, username):
+    """Encode an outbound editor frame once, ready to send as-is."""
+    return dumps({"data": data, "user": {"username": username}})
+
+
+# --- BINARY (MESSAGEPACK) SUBPROTOCOL ---
+# Clients that offer BINARY_SUBPROTOCOL get msgpack frames shaped
+# [user_id, data] instead of {"data": ..., "user": {"username": ...}}.
+# user_id 0 is the server; other ids are announced with a "member" frame
+# before first use. Clients send the bare data map. The server only accepts
+# the subprotocol with settings.EDITOR_BINARY_PROTOCOL on; the bundled
+# editor (cloud-ide) speaks JSON.
+
+BINARY_SUBPROTOCOL = "codemate.msgpack.v1"
+SYSTEM_ID = 0
+
+
+def packb(obj):
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def unpackb(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def binary_frame(user_id, payload):
+    """Wrap already-packed data in a [user_id, data] frame without re-encoding it."""
+    return b"\x92" + packb(user_id) + payload
+
+
+def array_header(count):
+    if count < 16:
+        return bytes([0x90 | count])
+    if count < 0x10000:
+        return b"\xdc" + count.to_bytes(2, "big")
+    return b"\xdd" + count.to_bytes(4, "big")
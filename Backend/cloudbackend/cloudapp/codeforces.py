@@ -0,0 +1,479 @@
+# cloudapp/codeforces.py
+import asyncio
+import re
+import time
+import weakref
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import cloudscraper
+import httpx
+from asgiref.sync import sync_to_async
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from . import problem_store
+
+# Optional C-backed parser; the BeautifulSoup engine is used without it
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# Codeforces problem fetching, parsing and caching.
+# Lookups go memory -> DB (CodeforcesProblem) -> upstream. Fresh entries are
+# served as-is, stale ones are served while a background refresh runs, and
+# concurrent misses on the same problem share a single upstream fetch.
+
+
+class UpstreamError(Exception):
+    """Codeforces answered with something other than 200."""
+
+    def __init__(self, status):
+        super().__init__(f"Codeforces returned status {status}")
+        self.status = status
+
+
+class ParseError(Exception):
+    """The page didn't look like a Codeforces problem statement."""
+
+
+def problem_key(contest_id, problem_index):
+    """Canonical cache key: ('1850', 'A') for ' 1850', 'a' and the like."""
+    return str(contest_id).strip(), str(problem_index).strip().upper()
+
+
+def problem_url(contest_id, problem_index):
+    return f"{settings.CODEFORCES_BASE_URL}/problemset/problem/{contest_id}/{problem_index}"
+
+
+#Upstream Fetch (Cloudflare fallback for fetch_problem_html_async)
+def scrape_problem_html(url):
+    scraper = cloudscraper.create_scraper()
+    response = scraper.get(url, timeout=15)
+    if response.status_code != 200:
+        raise UpstreamError(response.status_code)
+    return response.text
+
+
+#Statement Parser
+IMG_STYLE = 'max-width: 100%; height: auto; display: block; margin: 10px auto;'
+SECTION_TITLE_STYLE = "margin-top: 16px; margin-bottom: 8px; font-weight: bold; font-size: 1.1em; color: #90cdf4;"
+SECTION_CLASSES = ('input-specification', 'output-specification', 'note')
+
+
+def parse_problem(html, url):
+    """Parse a problem page with the engine picked by settings.CODEFORCES_PARSER."""
+    return PARSERS[get_parser_name()](html, url)
+
+
+def get_parser_name():
+    name = settings.CODEFORCES_PARSER
+    if name == "auto":
+        return "lxml" if lxml is not None else "bs4"
+    return name
+
+
+def _absolute_src(src):
+    if src.startswith('//'):
+        return f'https:{src}'
+    if src.startswith('/'):
+        return f'{settings.CODEFORCES_BASE_URL}{src}'
+    return src
+
+
+def parse_problem_bs4(html, url):
+    soup = BeautifulSoup(html, 'html.parser')
+
+    #Codeforces images
+    for img in soup.find_all('img'):
+        src = img.get('src', '')
+        if src.startswith('/'):
+            img['src'] = _absolute_src(src)
+
+        #Add styles to stablize large diagrams
+        img['style'] = IMG_STYLE
+
+    #Extract Title
+    title_element = soup.select_one(".problem-statement .header .title")
+    if not title_element:
+        raise ParseError("Failed to parse problem data.")
+    title = title_element.get_text(strip=True)
+
+    #Extract HTML Statement (Story + Input + Output + Note)
+    statement_html_parts = []
+    problem_node = soup.select_one(".problem-statement")
+
+    if problem_node:
+        #The Story
+        for child in problem_node.children:
+            if child.name == 'div':
+                classes = child.get('class', [])
+                # Skip header and specs sections
+                if any(c in classes for c in ['header', 'input-specification', 'output-specification', 'sample-tests', 'note']):
+                    continue
+
+            if child.name and child.name != 'script':
+                # str(child) preserves HTML tags like <p>, <ul>, and <img>
+                statement_html_parts.append(str(child))
+
+        #formatting sections
+        def add_section(cls_name, title_override=None):
+            section = problem_node.select_one(f".{cls_name}")
+            if section:
+                #codeforces title
+                section_title = section.select_one(".section-title")
+                if section_title:
+                    section_title.name = "h4"
+                    section_title['style'] = SECTION_TITLE_STYLE
+
+                statement_html_parts.append(str(section))
+
+        #Sections
+        for cls_name in SECTION_CLASSES:
+            add_section(cls_name)
+
+    statement_html = "".join(statement_html_parts)
+
+    #Extract Samples testcases
+    samples = []
+    inputs = soup.select(".input pre")
+    outputs = soup.select(".output pre")
+
+    count = min(len(inputs), len(outputs))
+    for i in range(count):
+        input_text = inputs[i].get_text(separator='\n', strip=True)
+        output_text = outputs[i].get_text(separator='\n', strip=True)
+        samples.append({
+            "input": input_text,
+            "output": output_text
+        })
+
+    return {
+        "title": title,
+        "statement": statement_html, # Now sending HTML
+        "url": url,
+        "samples": samples
+    }
+
+
+def _classes(el):
+    return el.get('class', '').split()
+
+
+def _first_with_class(el, cls_name):
+    for node in el.iter():
+        if cls_name in _classes(node):
+            return node
+    return None
+
+
+def _pre_text(pre):
+    # Same as BeautifulSoup's get_text(separator='\n', strip=True)
+    return '\n'.join(s.strip() for s in pre.itertext() if s.strip())
+
+
+def parse_problem_lxml(html, url):
+    """
+    Single pass over the statement's direct children: story parts, spec/note
+    sections and samples are picked out as each child is visited.
+    """
+    root = lxml.html.fromstring(html)
+    statements = root.find_class('problem-statement')
+    if not statements:
+        raise ParseError("Failed to parse problem data.")
+    problem_node = statements[0]
+
+    for img in problem_node.iter('img'):
+        src = img.get('src', '')
+        if src.startswith('/'):
+            img.set('src', _absolute_src(src))
+        img.set('style', IMG_STYLE)
+
+    title = None
+    story_parts = []
+    sections = {}
+    samples = []
+
+    for child in problem_node:
+        if not isinstance(child.tag, str) or child.tag == 'script':
+            continue  # comments / processing instructions / scripts
+        classes = _classes(child) if child.tag == 'div' else []
+
+        if 'header' in classes:
+            title_node = _first_with_class(child, 'title')
+            if title_node is not None:
+                title = ''.join(s.strip() for s in title_node.itertext())
+        elif 'sample-tests' in classes:
+            inputs = [pre for n in child.find_class('input') for pre in n.iter('pre')]
+            outputs = [pre for n in child.find_class('output') for pre in n.iter('pre')]
+            for input_pre, output_pre in zip(inputs, outputs):
+                samples.append({
+                    "input": _pre_text(input_pre),
+                    "output": _pre_text(output_pre),
+                })
+        elif any(c in classes for c in SECTION_CLASSES):
+            cls_name = next(c for c in SECTION_CLASSES if c in classes)
+            section_title = _first_with_class(child, 'section-title')
+            if section_title is not None:
+                section_title.tag = 'h4'
+                section_title.set('style', SECTION_TITLE_STYLE)
+            sections.setdefault(cls_name, child)
+        else:
+            story_parts.append(child)
+
+    if not title:
+        raise ParseError("Failed to parse problem data.")
+
+    parts = story_parts + [sections[c] for c in SECTION_CLASSES if c in sections]
+    statement_html = "".join(
+        lxml.html.tostring(part, encoding='unicode', with_tail=False)
+        for part in parts
+    )
+
+    return {
+        "title": title,
+        "statement": statement_html,
+        "url": url,
+        "samples": samples
+    }
+
+
+PARSERS = {
+    "bs4": parse_problem_bs4,
+    "lxml": parse_problem_lxml,
+}
+
+
+def statement_text(html):
+    # Engines serialize markup slightly differently; compare the visible text
+    return re.sub(r"\s+", " ", re.sub(r"<[^>]+>", " ", html)).strip()
+
+
+# --- CACHE TIERS ---
+# Only touched from the event loop; the DB helpers below run in a thread and
+# leave updating the memory tier to their async callers.
+_memory = OrderedDict()   # (contest_id, problem_index) -> (data, fetched_at epoch)
+
+_stats = {
+    "memory_hits": 0,
+    "db_hits": 0,
+    "stale_served": 0,
+    "upstream_fetches": 0,
+    "coalesced": 0,
+    "scraper_fallbacks": 0,
+}
+
+
+def _remember(key, data, fetched_at):
+    _memory[key] = (data, fetched_at)
+    _memory.move_to_end(key)
+    while len(_memory) > settings.CODEFORCES_CACHE_MAX:
+        _memory.popitem(last=False)
+
+
+def _memory_get(key):
+    entry = _memory.get(key)
+    if entry is not None:
+        _memory.move_to_end(key)
+        _stats["memory_hits"] += 1
+    return entry
+
+
+def _db_get(key):
+    from .models import CodeforcesProblem
+    row = CodeforcesProblem.objects.filter(
+        contest_id=key[0], problem_index=key[1]
+    ).values("data", "fetched_at").first()
+    if row is None:
+        return None
+    return problem_store.unpack_problem(row["data"]), row["fetched_at"].timestamp()
+
+
+def store_problem(key, data):
+    """Write a parsed problem to the DB tier; returns its fetched_at epoch."""
+    from .models import CodeforcesProblem
+    now = timezone.now()
+    CodeforcesProblem.objects.update_or_create(
+        contest_id=key[0], problem_index=key[1],
+        defaults={"data": problem_store.pack_problem(data), "fetched_at": now},
+    )
+    return now.timestamp()
+
+
+# --- ASYNC PATH (ASGI views) ---
+# One pooled httpx client per event loop, and a cap on concurrent requests per
+# upstream host, so slow Codeforces responses wait on the loop instead of
+# holding threadpool workers.
+_clients = weakref.WeakKeyDictionary()   # loop -> httpx.AsyncClient
+_host_limits = {}                        # (loop, host) -> asyncio.Semaphore
+_async_inflight = {}                     # (loop, key) -> asyncio.Future
+_RETRY = object()                        # flight result: leader cancelled, fetch again
+
+
+def _get_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = httpx.AsyncClient(
+            timeout=15,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=settings.CODEFORCES_HOST_CONCURRENCY * 4,
+                max_keepalive_connections=settings.CODEFORCES_HOST_CONCURRENCY,
+            ),
+            headers={"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) CodeMate"},
+        )
+    return client
+
+
+def _host_limit(host):
+    key = (asyncio.get_running_loop(), host)
+    limit = _host_limits.get(key)
+    if limit is None:
+        limit = _host_limits[key] = asyncio.Semaphore(settings.CODEFORCES_HOST_CONCURRENCY)
+    return limit
+
+
+async def fetch_problem_html_async(url):
+    async with _host_limit(urlsplit(url).netloc):
+        response = await _get_client().get(url)
+        if response.status_code in (403, 503):
+            # Cloudflare challenge; let cloudscraper deal with it off the loop
+            _stats["scraper_fallbacks"] += 1
+            return await sync_to_async(scrape_problem_html, thread_sensitive=False)(url)
+    if response.status_code != 200:
+        raise UpstreamError(response.status_code)
+    return response.text
+
+
+async def _fetch_and_store_async(key):
+    url = problem_url(*key)
+    print(f"Attempting to fetch: {url}")
+    _stats["upstream_fetches"] += 1
+    fetcher = import_string(settings.CODEFORCES_ASYNC_FETCHER)
+    html = await fetcher(url)
+    # Parsing is CPU-bound: keep it off the event loop and off the DB thread
+    data = await sync_to_async(parse_problem, thread_sensitive=False)(html, url)
+    _remember(key, data, await sync_to_async(store_problem)(key, data))
+    print("Successfully fetched problem!")
+    return data
+
+
+async def _fetch_coalesced_async(key):
+    flight_key = (asyncio.get_running_loop(), key)
+    future = _async_inflight.get(flight_key)
+    if future is not None:
+        _stats["coalesced"] += 1
+        data = await asyncio.shield(future)
+        if data is _RETRY:
+            # The leader was cancelled; the next caller through leads again
+            return await _fetch_coalesced_async(key)
+        return data
+
+    future = _async_inflight[flight_key] = asyncio.get_running_loop().create_future()
+    try:
+        data = await _fetch_and_store_async(key)
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved when nobody else is waiting
+        raise
+    except BaseException:
+        future.set_result(_RETRY)
+        raise
+    else:
+        future.set_result(data)
+        return data
+    finally:
+        _async_inflight.pop(flight_key, None)
+
+
+async def _revalidate_async(key):
+    try:
+        await _fetch_coalesced_async(key)
+    except Exception as e:
+        print(f"Background refresh of {key} failed: {e}")
+
+
+async def get_problem_async(contest_id, problem_index):
+    """
+    Parsed problem (title, statement HTML, url, samples) for contest/index.
+    Raises UpstreamError / ParseError when nothing is cached and the fetch fails.
+    """
+    key = problem_key(contest_id, problem_index)
+    entry = _memory_get(key)
+    if entry is None:
+        entry = await sync_to_async(_db_get)(key)
+        if entry is not None:
+            _remember(key, *entry)
+            _stats["db_hits"] += 1
+
+    if entry is not None:
+        data, fetched_at = entry
+        age = time.time() - fetched_at
+        if age < settings.CODEFORCES_FRESH_TTL:
+            return data
+        if age < settings.CODEFORCES_STALE_TTL:
+            # Serve what we have; refresh it off the request path
+            _stats["stale_served"] += 1
+            if (asyncio.get_running_loop(), key) not in _async_inflight:
+                asyncio.ensure_future(_revalidate_async(key))
+            return data
+
+    return await _fetch_coalesced_async(key)
+
+
+# --- BULK PREFETCH ---
+PROBLEM_CODE = re.compile(r"^\s*(\d+)\s*/?\s*([A-Za-z]\d*)\s*$")
+
+
+def parse_problem_code(code):
+    """'1850A' / '1850/A' -> ('1850', 'A'). Raises ValueError."""
+    match = PROBLEM_CODE.match(str(code))
+    if not match:
+        raise ValueError(f"Not a problem code: {code!r}")
+    return problem_key(match.group(1), match.group(2))
+
+
+async def contest_problem_keys(contest_id):
+    """(contest_id, index) for every problem in a contest, from the Codeforces API."""
+    url = f"{settings.CODEFORCES_BASE_URL}/api/contest.standings"
+    async with _host_limit(urlsplit(url).netloc):
+        response = await _get_client().get(
+            url, params={"contestId": contest_id, "from": 1, "count": 1}
+        )
+    if response.status_code != 200:
+        raise UpstreamError(response.status_code)
+
+    payload = response.json()
+    if payload.get("status") != "OK":
+        raise ParseError(payload.get("comment", "Codeforces API error"))
+    return [problem_key(contest_id, problem["index"]) for problem in payload["result"]["problems"]]
+
+
+async def prefetch_problems(keys, concurrency=None, refresh=False):
+    """
+    Fetch, parse and store problems ahead of time, at most `concurrency` at a
+    time. Problems already cached and fresh are skipped unless `refresh`.
+    Returns one result dict per key; failures don't stop the rest.
+    """
+    limit = asyncio.Semaphore(concurrency or settings.CODEFORCES_HOST_CONCURRENCY)
+
+    async def prefetch(key):
+        result = {"contest_id": key[0], "problem_index": key[1]}
+        async with limit:
+            try:
+                if refresh:
+                    data = await _fetch_coalesced_async(key)
+                else:
+                    data = await get_problem_async(*key)
+                result.update(status="ok", title=data["title"])
+            except Exception as e:
+                result.update(status="error", error=str(e))
+        return result
+
+    return await asyncio.gather(*(prefetch(problem_key(*key)) for key in keys))
+
+
+def get_stats():
+    return dict(_stats, memory_entries=len(_memory))
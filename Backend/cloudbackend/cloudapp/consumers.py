@@ -1,59 +1,79 @@
-import json
+import asyncio
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from urllib.parse import parse_qs
-
-@database_sync_to_async
-def get_user_from_token(token_str):
-    """
-    Asynchronously get a user from a JWT token string.
-    """
-    from rest_framework_simplejwt.tokens import UntypedToken
-    from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-    from rest_framework_simplejwt.authentication import JWTAuthentication
-    from django.contrib.auth.models import AnonymousUser
-    from django.contrib.auth import get_user_model
-
-    User = get_user_model()
-
-    try:
-        # Validate token
-        UntypedToken(token_str)
-
-        # Authenticate and get user
-        jwt_auth = JWTAuthentication()
-        validated_token = jwt_auth.get_validated_token(token_str)
-        user = jwt_auth.get_user(validated_token)
-        return user
-    except (InvalidToken, TokenError, User.DoesNotExist):
-        return AnonymousUser()
-    except Exception as e:
-        print(f"Error getting user from token: {e}")
-        return AnonymousUser()
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from . import codec, edit_log, executor, ot, outbound, presence, problem_store, room_runs, room_sync, session_buffer
+from .jwt_auth import get_user_from_token
+from .room_cache import room_states
 
 # --- NEW DB HELPERS FOR SESSION STATE ---
 @database_sync_to_async
-def get_session_db(token):
+def get_session_state_db(token):
     from .models import CollaborationSession
     try:
-        return CollaborationSession.objects.get(token=token)
-    except CollaborationSession.DoesNotExist:
+        state = CollaborationSession.objects.filter(token=token).values(
+            "code", "language", "problem_data", "revision"
+        ).first()
+    except ValidationError:
+        # Not a UUID, so no such session
         return None
+    if state is not None:
+        state["problem_data"] = problem_store.unpack_problem(state["problem_data"])
+    return state
 
-@database_sync_to_async
-def update_session_db(token, code=None, language=None, problem_data=None):
-    from .models import CollaborationSession
-    try:
-        session = CollaborationSession.objects.get(token=token)
-        if code is not None:
-            session.code = code
-        if language is not None:
-            session.language = language
-        if problem_data is not None:
-            session.problem_data = problem_data
-        session.save()
-    except CollaborationSession.DoesNotExist:
-        pass
+async def load_session_state(token):
+    # DB row with any not-yet-flushed writes from the buffer laid over it
+    state = await get_session_state_db(token)
+    if state is not None:
+        state.update(session_buffer.pending_fields(token))
+    return state
+
+def save_room_fields(token, **fields):
+    # Keep the snapshot cache current, then hand the write to the buffer
+    fields = {k: v for k, v in fields.items() if v is not None}
+    room_states.update(token, **fields)
+    session_buffer.queue_update(token, **fields)
+
+# Frames a later room_state supersedes; a lagging socket may skip them
+DOCUMENT_FRAMES = ("code_ops",)
+
+def _state_fields(data):
+    # Cached room columns a broadcast changes, for members on other nodes
+    if data.get("type") == "language_change":
+        return {"language": data.get("language")}
+    if data.get("type") == "problem_loaded":
+        return {"problem_data": data.get("problem")}
+    return None
+
+def broadcast_event(data, username, sender_channel=None):
+    # Encode once here; every JSON member just forwards the frame. The msgpack
+    # payload is only made if a binary member receives it (binary_payload),
+    # so the event carries the frame alone rather than the data twice.
+    return {
+        "type": "broadcast_message",
+        "frame": codec.frame(data, username),
+        "sender": username,
+        "sender_channel": sender_channel,
+        "rev": data.get("rev") if data.get("type") in DOCUMENT_FRAMES else None,
+        "state": _state_fields(data),
+    }
+
+# Last (frame, msgpack payload): every binary member of a room gets the same
+# broadcast right after each other, so one pack serves them all
+_packed = [None, None]
+
+def binary_payload(event):
+    frame = event["frame"]
+    if _packed[0] is not frame and _packed[0] != frame:
+        _packed[0], _packed[1] = frame, codec.packb(codec.loads(frame)["data"])
+    return _packed[1]
+
+async def send_to_room(token, data, username):
+    # Broadcast from outside a consumer (HTTP views) to every member of a room
+    from channels.layers import get_channel_layer
+    await get_channel_layer().group_send(f"editor_{token}", broadcast_event(data, username))
 # ----------------------------------------
 
 class CollaborativeEditorConsumer(AsyncWebsocketConsumer):
@@ -87,21 +107,78 @@ class CollaborativeEditorConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        await self.accept()
+        # Speak msgpack frames to clients that offer the binary subprotocol,
+        # when it is enabled (EDITOR_BINARY_PROTOCOL); JSON otherwise
+        self.binary = (
+            settings.EDITOR_BINARY_PROTOCOL
+            and codec.BINARY_SUBPROTOCOL in self.scope.get("subprotocols", [])
+        )
+        self.announced_ids = set()
+        await self.accept(subprotocol=codec.BINARY_SUBPROTOCOL if self.binary else None)
+        # Everything to this socket goes through its send queue from here on
+        self.outbound = outbound.OutboundQueue(self.send, self.room_snapshot, self.close)
+        self.outbound.start()
         print(f"User {self.user.username} connected to room {self.room_group_name}")
 
         # --- LATE JOINER FIX: SEND CURRENT STATE UPON CONNECTION ---
-        session = await get_session_db(self.room_name)
-        if session:
-            await self.send(text_data=json.dumps({
-                "user": {"username": "System"},
-                "data": {
-                    "type": "room_state",
-                    "code": session.code,
-                    "language": session.language,
-                    "problem": session.problem_data
-                }
-            }))
+        # One DB read per room; concurrent joiners share it via the cache
+        state = await room_states.get(self.room_name, load_session_state)
+        if state:
+            # Live document wins over the DB row if the room is already open here
+            self.document = ot.join_room(self.room_name, state["code"], state.get("revision") or 0)
+            # Edits made through other processes since the DB row was written
+            await room_sync.catch_up(self.room_name, self.document)
+            await self.send_room_state(state["language"], state["problem_data"])
+
+    def room_state(self, language, problem):
+        # Snapshot of the document at its current revision
+        return {
+            "type": "room_state",
+            "code": self.document.code,
+            "rev": self.document.revision,
+            "language": language,
+            "problem": problem
+        }
+
+    async def send_room_state(self, language, problem):
+        await self.send_system(self.room_state(language, problem))
+
+    async def room_snapshot(self):
+        # Fresh room_state for the send queue when it drops a lagging socket's edits
+        state = await room_states.get(self.room_name, load_session_state) or {}
+        await room_sync.catch_up(self.room_name, self.document)
+        data = self.room_state(state.get("language"), state.get("problem_data"))
+        return data["rev"], self.system_frame(data)
+
+    def system_frame(self, data):
+        if self.binary:
+            return {"bytes_data": codec.binary_frame(codec.SYSTEM_ID, codec.packb(data))}
+        return {"text_data": codec.frame(data, "System")}
+
+    async def send_system(self, data):
+        # Server-originated frame to this socket only
+        self.outbound.put(**self.system_frame(data))
+
+    async def member_ids(self, usernames):
+        # Binary clients learn each member's id once, before it is first used
+        ids = {}
+        for username in usernames:
+            user_id = presence.member_id(self.room_group_name, username)
+            if user_id not in self.announced_ids:
+                self.announced_ids.add(user_id)
+                await self.send_system({"type": "member", "id": user_id, "username": username})
+            ids[username] = user_id
+        return ids
+
+    async def resync(self):
+        # Client fell out of step with the revision history; send a fresh snapshot
+        state = await room_states.get(self.room_name, load_session_state)
+        if state:
+            await room_sync.catch_up(self.room_name, self.document)
+            await self.send_room_state(state["language"], state["problem_data"])
+
+    def save_session(self, **fields):
+        save_room_fields(self.room_name, **fields)
 
     async def disconnect(self, close_code):
         if hasattr(self, "room_group_name"):
@@ -109,31 +186,82 @@ class CollaborativeEditorConsumer(AsyncWebsocketConsumer):
                 self.room_group_name,
                 self.channel_name
             )
+            presence.remove(self.room_group_name, self.channel_name)
+            # Peers drop this member's cursor/selection
+            await self.broadcast({"type": "user_left"})
+            run_task = getattr(self, "run_task", None)
+            if run_task is not None and not run_task.done():
+                run_task.cancel()
+            if hasattr(self, "outbound"):
+                await self.outbound.stop()
+            if hasattr(self, "document") and ot.leave_room(self.room_name):
+                # Last local member gone: write the room's state out now
+                await session_buffer.flush(self.room_name)
+                await edit_log.flush(self.room_name)
+                room_states.forget(self.room_name)
+                edit_log.forget(self.room_name)
+                room_sync.forget(self.room_name)
+                presence.forget_room(self.room_group_name)
             print(f"User {self.user.username} disconnected.")
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            if not self.binary:
+                return   # binary frames only on the negotiated subprotocol
+            data = codec.unpackb(bytes_data)
+        else:
+            data = codec.loads(text_data)
         msg_type = data.get("type")
 
-        # Handle typing event separately
+        # Presence goes through the per-room aggregator, one frame per tick
         if msg_type == "typing":
-            await self.channel_layer.group_send(
-                
-                self.room_group_name,
-                {
-                    "type": "typing_event",
-                    "user": self.user.username,
-                }
+            presence.update(
+                self.room_group_name, self.channel_name, self.user.username,
+                typing=True
             )
             return
 
-        # --- LATE JOINER FIX: SAVE CHANGES TO DATABASE ---
+        if msg_type == "selection_update":
+            presence.update(
+                self.room_group_name, self.channel_name, self.user.username,
+                position=data.get("position"), selection=data.get("selection")
+            )
+            return
+
+        # Delta edits: rebase onto the room's revision and fan out only the ops
+        if msg_type == "code_ops":
+            await self.handle_code_ops(data)
+            return
+
+        # How far the client has applied; paces its send queue (see outbound.py)
+        if msg_type == "applied":
+            self.outbound.applied(data.get("rev"))
+            return
+
+        # Reconnecting client asks for the ops it missed instead of the full text
+        if msg_type == "sync":
+            await self.handle_sync(data)
+            return
+
+        # Run the room's code; output streams to every member as it's produced
+        if msg_type == "run_request":
+            await self.handle_run_request(data)
+            return
+
+        if msg_type == "run_cancel":
+            room_runs.cancel(self.room_name)
+            return
+
+        # Legacy full-text edits: diffed against the room and sent on as ops
         if msg_type == "code_change":
-            await update_session_db(self.room_name, code=data.get("code"))
-        elif msg_type == "language_change":
-            await update_session_db(self.room_name, language=data.get("language"))
+            await self.handle_code_change(data)
+            return
+
+        # --- LATE JOINER FIX: SAVE CHANGES TO DATABASE ---
+        if msg_type == "language_change":
+            self.save_session(language=data.get("language"))
         elif msg_type == "problem_loaded":
-            await update_session_db(self.room_name, problem_data=data.get("problem"))
+            self.save_session(problem_data=data.get("problem"))
         elif msg_type == "input_change":
             pass
         elif msg_type=="terminate_session":
@@ -145,42 +273,180 @@ class CollaborativeEditorConsumer(AsyncWebsocketConsumer):
             )
             return
         # Broadcast normal updates to everyone else
+        await self.broadcast(data)
+
+    async def broadcast(self, data, include_self=False):
         await self.channel_layer.group_send(
             self.room_group_name,
-            {
-                "type": "broadcast_message",
-                "data": data,
-                "sender_username": self.user.username,
-            }
+            broadcast_event(data, self.user.username, None if include_self else self.channel_name)
+        )
+
+    async def handle_code_ops(self, data):
+        if not hasattr(self, "document"):
+            return
+
+        try:
+            ops = ot.normalize_ops(data.get("ops"))
+            base_rev = data.get("rev")
+            if not isinstance(base_rev, int):
+                raise ValueError("rev must be an integer")
+            rev, ops = await room_sync.commit(self.room_name, self.document, base_rev, ops)
+        except (ValueError, ot.StaleRevision, room_sync.Unavailable) as e:
+            print(f"Rejected ops from {self.user.username}: {e!r}")
+            await self.resync()
+            return
+
+        # Before anything awaits: the document may move on after that
+        self.log_edit(rev)
+        self.save_session(code=self.document.code, revision=rev)
+
+        await self.send_system({"type": "ops_ack", "rev": rev})
+
+        await self.broadcast({"type": "code_ops", "rev": rev, "ops": ops})
+
+    async def handle_code_change(self, data):
+        if not hasattr(self, "document"):
+            return
+
+        try:
+            rev, ops = await room_sync.replace(self.room_name, self.document, data.get("code"))
+        except room_sync.Unavailable as e:
+            print(f"Dropped code_change from {self.user.username}: {e}")
+            await self.resync()
+            return
+
+        self.log_edit(rev)
+        self.save_session(code=self.document.code, revision=rev)
+
+        await self.broadcast({"type": "code_ops", "rev": rev, "ops": ops})
+
+    async def handle_run_request(self, data):
+        if not hasattr(self, "document"):
+            return
+
+        language = data.get("language")
+        if not language:
+            state = await room_states.get(self.room_name, load_session_state)
+            language = state["language"] if state else None
+        stdin = data.get("stdin")
+        if not isinstance(stdin, str):
+            stdin = ""
+
+        await room_sync.catch_up(self.room_name, self.document)
+        run_id = room_runs.new_run_id()
+        task = room_runs.start(
+            self.room_name, self.run_code(run_id, language, self.document.code, stdin)
+        )
+        if task is None:
+            await self.send_system({"type": "run_busy"})
+            return
+        self.run_task = task
+
+    async def run_code(self, run_id, language, code, stdin):
+        async def send(data):
+            await self.broadcast(dict(data, run_id=run_id), include_self=True)
+
+        await send({"type": "run_started", "language": language})
+        relay = room_runs.OutputRelay(send)
+        finished = {"type": "run_finished"}
+        try:
+            response = await executor.execute(
+                language, code, stdin, user_id=self.user.pk, on_output=relay.write
+            )
+            # Output already went out as run_output frames; just the outcome here
+            compiled = response.get("compile")
+            if compiled is not None and compiled["code"] != 0:
+                stage, result = "compile", compiled
+            else:
+                stage, result = "run", response["run"]
+            finished.update(
+                {key: result[key] for key in ("code", "signal", "time", "timed_out", "truncated")},
+                stage=stage,
+            )
+        except executor.ExecutionError as e:
+            finished["error"] = str(e)
+        except executor.QueueTimeout:
+            finished["error"] = "Too many runs in progress, try again shortly."
+        except asyncio.CancelledError:
+            finished["error"] = "Run cancelled"
+        except Exception as e:
+            print(f"Run failed in {self.room_group_name}: {e}")
+            finished["error"] = "Execution failed"
+
+        await relay.close()
+        await send(finished)
+
+    def log_edit(self, rev):
+        # Persist the ops that produced rev (the last entry in the history)
+        edit_log.record(
+            self.room_name, rev, self.document.history[-1][1], self.document.code, self.user.username
         )
 
+    async def handle_sync(self, data):
+        if not hasattr(self, "document"):
+            return
+
+        await room_sync.catch_up(self.room_name, self.document)
+        try:
+            entries = self.document.ops_since(data.get("rev"))
+        except ot.StaleRevision:
+            # Older than the in-memory history; the persistent log may still have it
+            entries = await database_sync_to_async(edit_log.ops_since)(
+                self.room_name, data["rev"], self.document.revision
+            )
+            if entries is None:
+                await self.resync()
+                return
+        except (TypeError, ValueError):
+            await self.resync()
+            return
+
+        await self.send_system({
+            "type": "ops_since",
+            "rev": self.document.revision,
+            "entries": entries
+        })
+
     async def broadcast_message(self, event):
-        # Don't send message back to the sender
-        if self.user.username == event["sender_username"]:
+        # Don't send message back to the sending socket (other tabs still get it)
+        if self.channel_name == event["sender_channel"]:
             return
 
-        await self.send(text_data=json.dumps({
-            "data": event["data"],
-            "user": {"username": event["sender_username"]},
-        }))
+        if event.get("state"):
+            # Possibly written on another node; keep this process's snapshot in step
+            room_states.update(self.room_name, **{k: v for k, v in event["state"].items() if v is not None})
+        if event.get("rev") is not None and hasattr(self, "document") and event["rev"] > self.document.revision:
+            # Committed through another process; only then is the frame decoded
+            await room_sync.apply_remote(
+                self.room_name, self.document, event["rev"], codec.loads(event["frame"])["data"]["ops"]
+            )
+
+        if self.binary:
+            ids = await self.member_ids([event["sender"]])
+            self.outbound.put(bytes_data=codec.binary_frame(ids[event["sender"]], binary_payload(event)), rev=event.get("rev"))
+        else:
+            self.outbound.put(text_data=event["frame"], rev=event.get("rev"))
     
     async def force_evict_all(self, event):
-        await self.send(text_data=json.dumps({
-            "user": {"username": "System"},
-            "data": {
-                "type": "session_terminated"
-            }
-        }))
+        await self.send_system({"type": "session_terminated"})
+        await self.outbound.drain(settings.OUTBOUND_CLOSE_GRACE)
         # Disconnect the socket on the backend
         await self.close()
 
-    # Handle typing event
-    async def typing_event(self, event):
-        # Send a small payload to all except sender
-        if self.user.username == event["user"]:
+    # Handle aggregated presence (cursors, selections, typing)
+    async def presence_event(self, event):
+        # Everyone's entries except our own
+        if self.binary:
+            binary_entries = event["binary_entries"]
+            ids = await self.member_ids(
+                username for sender, (username, _) in binary_entries.items()
+                if sender != self.channel_name
+            )
+            frame = presence.binary_presence_frame(binary_entries, self.channel_name, ids)
+            if frame:
+                self.outbound.put(bytes_data=frame)
             return
 
-        await self.send(text_data=json.dumps({
-            "data": {"type": "typing"},
-            "user": {"username": event["user"]},
-        }))
\ No newline at end of file
+        frame = presence.presence_frame(event["entries"], self.channel_name)
+        if frame:
+            self.outbound.put(text_data=frame)
\ No newline at end of file
@@ -0,0 +1,178 @@
+# cloudapp/edit_log.py
+import asyncio
+import atexit
+from channels.db import database_sync_to_async
+from django.conf import settings
+from . import ot
+
+# Persistent revision history for sessions: every applied edit is appended
+# to SessionEdit, and every EDIT_SNAPSHOT_EVERY revisions the full code goes
+# to SessionSnapshot. Any revision can be rebuilt from the nearest snapshot
+# at or below it plus the edits after that snapshot, and a reconnecting
+# client that is too far behind the in-memory history can still be sent
+# the ops it missed.
+#
+# Like session_buffer, writes are buffered per room and go out in one
+# bulk insert per flush interval.
+
+_pending = {}       # token -> [(revision, ops, username, snapshot_code or None)]
+_timers = {}        # token -> asyncio.TimerHandle
+_session_ids = {}   # token -> CollaborationSession pk
+_seen = set()       # tokens that have logged an edit in this process
+
+_stats = {
+    "edits": 0,
+    "snapshots": 0,
+    "flushes": 0,
+    "failed": 0,
+    "rebuilds": 0,
+}
+
+
+def record(token, revision, ops, code, username=""):
+    """Log the ops that produced `revision`; `code` is the text after them."""
+    # First edit this process logs for the room, or a periodic checkpoint
+    snapshot = revision % settings.EDIT_SNAPSHOT_EVERY == 0 or token not in _seen
+    _seen.add(token)
+    _pending.setdefault(token, []).append((revision, ops, username, code if snapshot else None))
+    _stats["edits"] += 1
+    _schedule(token)
+
+
+def _schedule(token):
+    if token not in _timers:
+        loop = asyncio.get_running_loop()
+        _timers[token] = loop.call_later(
+            settings.SESSION_FLUSH_INTERVAL,
+            lambda: asyncio.ensure_future(flush(token)),
+        )
+
+
+def _session_id(token):
+    from .models import CollaborationSession
+    session_id = _session_ids.get(token)
+    if session_id is None:
+        session_id = CollaborationSession.objects.filter(token=token).values_list("id", flat=True).first()
+        if session_id is not None:
+            _session_ids[token] = session_id
+    return session_id
+
+
+def _write(token, entries):
+    from .models import SessionEdit, SessionSnapshot
+    session_id = _session_id(token)
+    if session_id is None:
+        return  # session deleted meanwhile
+
+    # room_sync hands each revision to one process, so a conflict means this
+    # batch is a retry of one that landed, or the room's Redis log was lost
+    # and restarted (the first write wins then)
+    SessionEdit.objects.bulk_create(
+        [
+            SessionEdit(session_id=session_id, revision=revision, ops=ops, username=username)
+            for revision, ops, username, _ in entries
+        ],
+        ignore_conflicts=True,
+    )
+    snapshots = [
+        SessionSnapshot(session_id=session_id, revision=revision, code=code)
+        for revision, _, _, code in entries if code is not None
+    ]
+    if snapshots:
+        SessionSnapshot.objects.bulk_create(snapshots, ignore_conflicts=True)
+        _stats["snapshots"] += len(snapshots)
+
+
+async def flush(token):
+    timer = _timers.pop(token, None)
+    if timer is not None:
+        timer.cancel()
+
+    entries = _pending.pop(token, None)
+    if not entries:
+        return
+
+    try:
+        await database_sync_to_async(_write)(token, entries)
+        _stats["flushes"] += 1
+    except Exception as e:
+        print(f"Edit log flush failed for {token}: {e}")
+        _stats["failed"] += 1
+        # Keep order: the failed batch goes in front of anything newer
+        _pending[token] = entries + _pending.get(token, [])
+        _schedule(token)
+
+
+def forget(token):
+    _seen.discard(token)
+    _session_ids.pop(token, None)
+
+
+# --- READING HISTORY (sync, DB) ---
+def _pending_since(token, revision):
+    return [
+        {"rev": rev, "ops": ops}
+        for rev, ops, _, _ in _pending.get(token, [])
+        if rev > revision
+    ]
+
+
+def ops_since(token, revision, current_revision):
+    """
+    {"rev", "ops"} entries from revision + 1 up to current_revision, or None
+    if the log has a gap in that range.
+    """
+    from .models import SessionEdit
+    entries = list(
+        SessionEdit.objects.filter(session__token=token, revision__gt=revision, revision__lte=current_revision)
+        .order_by("revision").values_list("revision", "ops")
+    )
+    entries = [{"rev": rev, "ops": ops} for rev, ops in entries]
+    logged = {entry["rev"] for entry in entries}
+    entries += [entry for entry in _pending_since(token, revision) if entry["rev"] not in logged]
+    entries.sort(key=lambda entry: entry["rev"])
+    entries = [entry for entry in entries if entry["rev"] <= current_revision]
+
+    if [entry["rev"] for entry in entries] != list(range(revision + 1, current_revision + 1)):
+        return None
+    return entries
+
+
+def rebuild(token, revision):
+    """Code of the session at `revision`, or None if history can't reach it."""
+    from .models import SessionSnapshot
+    _stats["rebuilds"] += 1
+    snapshot = (
+        SessionSnapshot.objects.filter(session__token=token, revision__lte=revision)
+        .order_by("-revision").values("revision", "code").first()
+    )
+    # A snapshot still waiting in the buffer may be closer
+    for rev, _, _, code in _pending.get(token, []):
+        if code is not None and rev <= revision and (snapshot is None or rev > snapshot["revision"]):
+            snapshot = {"revision": rev, "code": code}
+    if snapshot is None:
+        return None
+
+    entries = ops_since(token, snapshot["revision"], revision)
+    if entries is None:
+        return None
+    code = snapshot["code"]
+    for entry in entries:
+        code = ot.apply_ops(code, entry["ops"])
+    return code
+
+
+def get_stats():
+    return dict(_stats, pending_rooms=len(_pending))
+
+
+@atexit.register
+def _flush_on_exit():
+    # The event loop is gone by now, so write synchronously
+    for token in list(_pending):
+        entries = _pending.pop(token)
+        try:
+            _write(token, entries)
+            _stats["flushes"] += 1
+        except Exception as e:
+            print(f"Edit log flush failed for {token} at shutdown: {e}")
@@ -0,0 +1,537 @@
+# cloudapp/executor.py
+import asyncio
+import codecs
+import contextlib
+import json
+import math
+import os
+import re
+import secrets
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from collections import deque
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from . import build_cache
+
+# Local code execution. Every compile/run step executes in a sandbox worker
+# (cloudapp/sandbox_launcher.py): own namespaces and read-only root, no
+# network, a dedicated uid with rlimits and a seccomp filter, and a throwaway
+# working directory. Workers are started ahead of time per language so a run
+# only pays for exec. Nothing runs if the launcher can't set that up.
+# Results use Piston's shape ({"run": {"stdout", "stderr", "output", "code",
+# "signal"}}) so the frontend can switch over without changes.
+
+LAUNCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_launcher.py")
+
+LANGUAGES = {
+    "python": {
+        "source": "main.py",
+        "compile": None,
+        "run": ["python3", "-I", "main.py"],
+    },
+    "cpp": {
+        "source": "main.cpp",
+        "compile": ["g++", "-O2", "-std=c++17", "-o", "main", "main.cpp"],
+        "run": ["./main"],
+        "artifacts": ["main"],
+    },
+    "java": {
+        # The JVM reserves far more address space than it uses, so Java is
+        # capped with -Xmx instead of RLIMIT_AS.
+        "source": "{main_class}.java",
+        "compile": ["javac", "-J-Xmx512m", "{main_class}.java"],
+        "run": ["java", "-Xmx{memory_mb}m", "-Xss64m", "-cp", ".", "{main_class}"],
+        "artifacts": ["*.class"],
+        "address_limit": False,
+    },
+}
+
+COMPILE_CPU = 15
+COMPILE_MEMORY_MB = 1024
+
+JAVA_MAIN_CLASS = re.compile(r"public\s+(?:final\s+)?class\s+([A-Za-z_$][\w$]*)")
+
+
+class ExecutionError(Exception):
+    """Bad request for the executor (unknown language etc.)."""
+
+
+class QueueTimeout(Exception):
+    """The run couldn't get an execution slot before its deadline."""
+
+
+class SandboxUnavailable(ExecutionError):
+    """The launcher couldn't isolate programs here, so nothing is run."""
+
+
+_stats = {
+    "runs": 0,
+    "compiles": 0,
+    "compile_time_total": 0.0,
+    "warm_starts": 0,
+    "cold_starts": 0,
+    "timeouts": 0,
+    "queue_timeouts": 0,
+    "queue_wait_total": 0.0,
+    "queue_wait_max": 0.0,
+}
+_recent_waits = deque(maxlen=200)
+
+
+# --- WARM WORKER POOLS ---
+class WarmPool:
+    """A few launcher processes per language, already started and waiting for a job."""
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = []
+        self._refilling = False
+
+    async def _spawn(self):
+        await check_sandbox()
+        return await _start_launcher()
+
+    async def take(self):
+        while self._idle:
+            proc = self._idle.pop()
+            if proc.returncode is None:
+                _stats["warm_starts"] += 1
+                self._schedule_refill()
+                return proc
+        _stats["cold_starts"] += 1
+        self._schedule_refill()
+        return await self._spawn()
+
+    def _schedule_refill(self):
+        if not self._refilling and len(self._idle) < self.size:
+            self._refilling = True
+            asyncio.ensure_future(self._refill())
+
+    async def _refill(self):
+        try:
+            while len(self._idle) < self.size:
+                self._idle.append(await self._spawn())
+        except Exception as e:
+            print(f"Sandbox pool refill failed: {e}")
+        finally:
+            self._refilling = False
+
+    async def warm(self):
+        await self._refill()
+
+    async def close(self):
+        while self._idle:
+            proc = self._idle.pop()
+            if proc.returncode is None:
+                proc.stdin.close()
+                await proc.wait()
+
+
+_pools = {}          # language -> WarmPool
+_pools_loop = None
+_slots = None        # global concurrency limit
+_user_slots = {}     # user id -> [Semaphore, runs holding or waiting for it]
+
+
+def _loop_state():
+    # Pools, semaphores and locks belong to one event loop; start over if it changed
+    global _pools_loop, _slots, _sandbox_lock
+    loop = asyncio.get_running_loop()
+    if _pools_loop is not loop:
+        _pools.clear()
+        _user_slots.clear()
+        _slots = asyncio.Semaphore(settings.EXECUTION_MAX_CONCURRENCY)
+        _sandbox_lock = asyncio.Lock()
+        _pools_loop = loop
+    return _slots
+
+
+def get_pool(language):
+    _loop_state()
+    pool = _pools.get(language)
+    if pool is None:
+        pool = _pools[language] = WarmPool(settings.EXECUTION_POOL_SIZE)
+    return pool
+
+
+# --- RUNNING ONE STEP IN A SANDBOX ---
+_sandbox_error = None    # why isolation failed, once checked
+_sandbox_checked = False
+_sandbox_lock = None     # one probe at a time; the rest wait for its answer
+
+
+async def _start_launcher():
+    return await asyncio.create_subprocess_exec(
+        *settings.EXECUTION_LAUNCHER_PREFIX, sys.executable, "-I", "-S", LAUNCHER,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+
+async def check_sandbox():
+    """
+    Run `true` through the launcher once per process before trusting it with
+    anything else. Raises SandboxUnavailable if isolation can't be set up.
+    """
+    global _sandbox_error, _sandbox_checked
+    if not _sandbox_checked:
+        _loop_state()
+        async with _sandbox_lock:
+            if not _sandbox_checked:
+                # Only marked checked once the probe has answered, so a
+                # cancelled probe is simply run again by the next caller
+                _sandbox_error = await _probe_sandbox()
+                _sandbox_checked = True
+                if _sandbox_error:
+                    print(f"Sandbox unavailable, code execution disabled: {_sandbox_error}")
+    if _sandbox_error:
+        raise SandboxUnavailable("Code execution is unavailable on this server.")
+
+
+async def _probe_sandbox():
+    """Why `true` couldn't run through the launcher, or None if it could."""
+    with scratch_dir() as workdir:
+        try:
+            proc = await _start_launcher()
+            spec = dict(_spec(["true"], workdir), cpu=1)
+            try:
+                _, stderr = await asyncio.wait_for(
+                    proc.communicate(json.dumps(spec).encode() + b"\n"), timeout=10
+                )
+            except BaseException:
+                _kill(proc)
+                raise
+            if proc.returncode != 0:
+                return stderr.decode(errors="replace").strip() or f"exit {proc.returncode}"
+        except (OSError, asyncio.TimeoutError) as e:
+            return str(e) or type(e).__name__
+    return None
+
+
+def _spec(argv, cwd, cpu=None, memory_mb=None):
+    return {
+        "argv": argv,
+        "cwd": cwd,
+        "cpu": cpu,
+        "memory": int(memory_mb * 1024 * 1024) if memory_mb else None,
+        "fsize": 16 * 1024 * 1024,
+        "nofile": 64,
+        "nproc": settings.EXECUTION_SANDBOX_NPROC,
+        "uid": settings.EXECUTION_SANDBOX_UID,
+        "gid": settings.EXECUTION_SANDBOX_GID,
+        "owner": [os.getuid(), os.getgid()],
+        "binds": settings.EXECUTION_SANDBOX_BINDS,
+    }
+
+async def run_in_sandbox(language, argv, cwd, stdin="", cpu=None, memory_mb=None,
+                         timeout=None, output_limit=None, on_output=None):
+    """
+    Run argv inside a sandbox worker and collect its output.
+    `on_output(stream, text)` is awaited for every chunk as it arrives.
+    """
+    cpu = cpu or settings.EXECUTION_TIME_LIMIT
+    timeout = timeout or cpu * 2 + 1
+    output_limit = output_limit or settings.EXECUTION_OUTPUT_LIMIT
+
+    proc = await get_pool(language).take()
+    # RLIMIT_CPU is whole seconds; the wall clock uses the exact value
+    spec = _spec(argv, cwd, cpu=math.ceil(cpu), memory_mb=memory_mb)
+    # The launcher writes the program's CPU and wall time here afterwards
+    spec["report"] = f".usage-{secrets.token_hex(8)}"
+
+    chunks = {"stdout": [], "stderr": [], "output": []}
+    size = 0
+    truncated = False
+
+    async def feed():
+        try:
+            proc.stdin.write(json.dumps(spec).encode() + b"\n" + (stdin or "").encode())
+            await proc.stdin.drain()
+            proc.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # program exited without reading all of its input
+
+    async def pump(stream, name):
+        nonlocal size, truncated
+        # Reads can end inside a multi-byte character; the decoder carries the
+        # partial bytes over to the next read instead of replacing them
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        async def emit(text):
+            if text:
+                chunks[name].append(text)
+                chunks["output"].append(text)
+                if on_output is not None:
+                    await on_output(name, text)
+
+        while True:
+            data = await stream.read(4096)
+            if not data:
+                if not truncated:
+                    await emit(decoder.decode(b"", final=True))
+                return
+            if truncated:
+                continue  # keep draining so the program isn't blocked on a full pipe
+            if size + len(data) > output_limit:
+                data = data[:output_limit - size]
+                truncated = True
+                _kill(proc)
+            size += len(data)
+            await emit(decoder.decode(data, final=truncated))
+
+    started = time.monotonic()
+    timed_out = False
+    tasks = [
+        asyncio.ensure_future(feed()),
+        asyncio.ensure_future(pump(proc.stdout, "stdout")),
+        asyncio.ensure_future(pump(proc.stderr, "stderr")),
+    ]
+    try:
+        await asyncio.wait_for(proc.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        _stats["timeouts"] += 1
+        _kill(proc)
+        await proc.wait()
+    except asyncio.CancelledError:
+        # Caller gave up (client disconnected, judge stopped early)
+        _kill(proc)
+        for task in tasks:
+            task.cancel()
+        raise
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    code = proc.returncode
+    result = {
+        "stdout": "".join(chunks["stdout"]),
+        "stderr": "".join(chunks["stderr"]),
+        "output": "".join(chunks["output"]),
+        "code": code if code >= 0 else None,
+        "signal": signal.Signals(-code).name if code < 0 else None,
+        "time": round(time.monotonic() - started, 3),
+    }
+    result.update(_read_usage(os.path.join(cwd, spec["report"])))
+    if timed_out:
+        result["stderr"] += "\nTime limit exceeded"
+        result["signal"] = "SIGKILL"
+    if truncated:
+        result["stderr"] += "\nOutput limit exceeded"
+    result["timed_out"] = timed_out
+    result["truncated"] = truncated
+    return result
+
+
+def _read_usage(path):
+    """cpu_time / wall_time the launcher measured for the program (None if it didn't get that far)."""
+    try:
+        with open(path) as f:
+            usage = json.load(f)
+        os.remove(path)
+        return {"cpu_time": float(usage["cpu"]), "wall_time": float(usage["wall"])}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {"cpu_time": None, "wall_time": None}
+
+
+def _kill(proc):
+    # The launcher runs as root (maybe behind sudo), so it can't always be
+    # signalled directly; SIGTERM makes it tear the namespace down itself.
+    try:
+        proc.send_signal(signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+# --- SCHEDULING ---
+async def _acquire(semaphore, deadline):
+    remaining = deadline - time.monotonic()
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout=max(remaining, 0))
+    except asyncio.TimeoutError:
+        _stats["queue_timeouts"] += 1
+        raise QueueTimeout()
+
+
+class slot:
+    """
+    Async context manager: one global execution slot + one of the user's slots.
+    Without a user_id only the global slot is taken; with run=False only the
+    user's (for a job that takes global slots per step, like the judge).
+    """
+
+    def __init__(self, user_id=None, run=True):
+        self.user_id = user_id
+        self.run = run
+
+    async def __aenter__(self):
+        slots = _loop_state()
+        user_slots = None
+        if self.user_id is not None:
+            entry = _user_slots.get(self.user_id)
+            if entry is None:
+                entry = _user_slots[self.user_id] = [asyncio.Semaphore(settings.EXECUTION_PER_USER), 0]
+            entry[1] += 1
+            user_slots = entry[0]
+        self.user_slots = user_slots
+        self.slots = slots if self.run else None
+
+        queued = time.monotonic()
+        deadline = queued + settings.EXECUTION_QUEUE_TIMEOUT
+        try:
+            if self.user_slots is not None:
+                await _acquire(self.user_slots, deadline)
+        except BaseException:
+            self._leave()
+            raise
+        if self.slots is not None:
+            try:
+                await _acquire(self.slots, deadline)
+            except BaseException:
+                self._release_user()
+                raise
+
+        waited = time.monotonic() - queued
+        _stats["queue_wait_total"] += waited
+        _stats["queue_wait_max"] = max(_stats["queue_wait_max"], waited)
+        _recent_waits.append(waited)
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.slots is not None:
+            self.slots.release()
+        self._release_user()
+
+    def _release_user(self):
+        if self.user_slots is not None:
+            self.user_slots.release()
+            self._leave()
+
+    def _leave(self):
+        # Drop the user's semaphore once nobody holds or waits for it, so
+        # the table only has users with runs in flight
+        entry = _user_slots.get(self.user_id)
+        if entry is not None and entry[0] is self.user_slots:
+            entry[1] -= 1
+            if not entry[1]:
+                del _user_slots[self.user_id]
+
+
+# --- PUBLIC API ---
+@contextlib.contextmanager
+def scratch_dir():
+    workdir = tempfile.mkdtemp(prefix="run-", dir=settings.EXECUTION_ROOT)
+    try:
+        yield workdir
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def copy_files(source, target):
+    """Copy workdir `source`'s files (source code, build artifacts) into `target`."""
+    for name in os.listdir(source):
+        path = os.path.join(source, name)
+        if not name.startswith(".") and os.path.isfile(path) and not os.path.islink(path):
+            shutil.copy2(path, os.path.join(target, name))
+
+
+def prepare(language, code, workdir):
+    """Write the source into workdir; returns the template values for argv."""
+    config = LANGUAGES.get(language)
+    if config is None:
+        raise ExecutionError(f"Unsupported language: {language}")
+
+    values = {"memory_mb": settings.EXECUTION_MEMORY_MB, "main_class": "Main"}
+    if language == "java":
+        match = JAVA_MAIN_CLASS.search(code)
+        if match:
+            values["main_class"] = match.group(1)
+
+    with open(os.path.join(workdir, config["source"].format(**values)), "w") as f:
+        f.write(code)
+    return config, values
+
+
+def _argv(template, values):
+    return [part.format(**values) for part in template]
+
+
+async def compile_in(language, config, values, workdir, on_output=None):
+    _stats["compiles"] += 1
+    result = await run_in_sandbox(
+        language, _argv(config["compile"], values), workdir,
+        cpu=COMPILE_CPU, memory_mb=COMPILE_MEMORY_MB, on_output=on_output,
+    )
+    _stats["compile_time_total"] += result["time"]
+    return result
+
+
+async def build(language, code, config, values, workdir, on_output=None):
+    """compile_in(), served from the build cache when this exact source was built before."""
+    build_key = build_cache.key(language, _argv(config["compile"], values), code)
+    # Copying and hashing artifacts is file I/O; keep it off the event loop
+    cached = await sync_to_async(build_cache.restore, thread_sensitive=False)(build_key, workdir)
+    if cached is not None:
+        if on_output is not None and cached["stderr"]:
+            await on_output("stderr", cached["stderr"])  # replay compiler warnings
+        return cached
+
+    result = await compile_in(language, config, values, workdir, on_output)
+    if result["code"] == 0 and not result["truncated"]:
+        await sync_to_async(build_cache.store, thread_sensitive=False)(build_key, workdir, config["artifacts"], result)
+    return result
+
+
+async def run_compiled(language, config, values, workdir, stdin, on_output=None,
+                       cpu=None, memory_mb=None):
+    _stats["runs"] += 1
+    if memory_mb is not None:
+        values = dict(values, memory_mb=math.ceil(memory_mb))
+    if not config.get("address_limit", True):
+        memory_mb = None
+    elif memory_mb is None:
+        memory_mb = settings.EXECUTION_MEMORY_MB
+    return await run_in_sandbox(
+        language, _argv(config["run"], values), workdir, stdin=stdin,
+        cpu=cpu, memory_mb=memory_mb, on_output=on_output,
+    )
+
+
+async def execute(language, code, stdin="", user_id=None, on_output=None):
+    """
+    Compile (if needed) and run code for a user, respecting the global and
+    per-user concurrency caps. Returns a Piston-shaped result.
+    Raises ExecutionError / QueueTimeout.
+    """
+    if language not in LANGUAGES:
+        raise ExecutionError(f"Unsupported language: {language}")
+
+    async with slot(user_id):
+        with scratch_dir() as workdir:
+            config, values = prepare(language, code, workdir)
+            response = {"language": language, "version": "local"}
+
+            if config["compile"]:
+                compiled = await build(language, code, config, values, workdir, on_output)
+                response["compile"] = compiled
+                if compiled["code"] != 0:
+                    # Surface compiler errors where the editor shows run errors
+                    response["run"] = dict(compiled, stdout="")
+                    return response
+
+            response["run"] = await run_compiled(language, config, values, workdir, stdin, on_output)
+            return response
+
+
+def get_stats():
+    waits = sorted(_recent_waits)
+    return dict(
+        _stats,
+        compile_time_avg=round(_stats["compile_time_total"] / _stats["compiles"], 3) if _stats["compiles"] else 0.0,
+        queue_wait_p50=waits[len(waits) // 2] if waits else 0.0,
+        queue_wait_p95=waits[int(len(waits) * 0.95)] if waits else 0.0,
+        queued_users=len(_user_slots),
+    )
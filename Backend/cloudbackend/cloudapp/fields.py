@@ -0,0 +1,105 @@
+# cloudapp/fields.py
+import base64
+import json
+import zlib
+from django.conf import settings
+from django.db import models
+
+# Optional faster/denser codec; zlib is used without it
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_DECODE_ERRORS = (ValueError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+# Transparent compression for large text/JSON columns. Values at or above
+# STORAGE_COMPRESS_MIN_BYTES are stored as a marker + base64 of the
+# compressed bytes, so the column types don't change and rows written before
+# this (plain text/JSON) still read back as they are. Everything below the
+# threshold is stored untouched, except text that itself starts with the
+# marker byte, which gets RAW_MARKER in front so it can't pass for a
+# compressed value.
+
+MARKER_BYTE = "\x01"
+ZLIB_MARKER = "\x01zlib\x01"
+ZSTD_MARKER = "\x01zstd\x01"
+RAW_MARKER = "\x01raw\x01"
+
+_stats = {"compressed": 0, "raw_bytes": 0, "stored_bytes": 0}
+
+
+def _escape(text):
+    return RAW_MARKER + text if text.startswith(MARKER_BYTE) else text
+
+
+def compress_text(text):
+    if text is None:
+        return text
+    raw = text.encode()
+    if len(raw) < settings.STORAGE_COMPRESS_MIN_BYTES:
+        return _escape(text)
+
+    if zstandard is not None:
+        stored = ZSTD_MARKER + base64.b64encode(zstandard.ZstdCompressor(level=6).compress(raw)).decode()
+    else:
+        stored = ZLIB_MARKER + base64.b64encode(zlib.compress(raw, 6)).decode()
+    if len(stored) >= len(raw):
+        return _escape(text)  # incompressible (already dense); not worth the decode cost
+
+    _stats["compressed"] += 1
+    _stats["raw_bytes"] += len(raw)
+    _stats["stored_bytes"] += len(stored)
+    return stored
+
+
+def decompress_text(value):
+    if not isinstance(value, str) or not value.startswith(MARKER_BYTE):
+        return value
+    if value.startswith(RAW_MARKER):
+        return value[len(RAW_MARKER):]
+    if value.startswith(ZSTD_MARKER) and zstandard is None:
+        raise RuntimeError("zstandard is required to read this value")
+    try:
+        if value.startswith(ZLIB_MARKER):
+            return zlib.decompress(base64.b64decode(value[len(ZLIB_MARKER):])).decode()
+        if value.startswith(ZSTD_MARKER):
+            return zstandard.ZstdDecompressor().decompress(base64.b64decode(value[len(ZSTD_MARKER):])).decode()
+    except _DECODE_ERRORS:
+        pass  # plain text from before RAW_MARKER that happened to start with a marker
+    return value
+
+
+class CompressedTextField(models.TextField):
+
+    def get_prep_value(self, value):
+        return compress_text(super().get_prep_value(value))
+
+    def from_db_value(self, value, expression, connection):
+        return decompress_text(value)
+
+
+class CompressedJSONField(models.JSONField):
+    """JSONField that stores large documents as a compressed JSON string."""
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None:
+            return value
+        text = json.dumps(value, cls=self.encoder)
+        stored = compress_text(text)
+        if stored is not text:
+            return stored
+        if isinstance(value, str) and value.startswith(MARKER_BYTE):
+            return RAW_MARKER + text  # a bare string that would read back as a marker
+        return value
+
+    def from_db_value(self, value, expression, connection):
+        value = super().from_db_value(value, expression, connection)
+        text = decompress_text(value)
+        return value if text is value else json.loads(text, cls=self.decoder)
+
+
+def get_stats():
+    ratio = _stats["stored_bytes"] / _stats["raw_bytes"] if _stats["raw_bytes"] else 0.0
+    return dict(_stats, ratio=round(ratio, 3))
@@ -0,0 +1,116 @@
+# cloudapp/judge.py
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from . import executor
+
+# "Run against all samples": compile once, run every sample in parallel on
+# the executor's sandbox workers and report a verdict per test as soon as it
+# finishes. Verdicts: AC, WA, TLE, RE, plus CE when the build fails.
+#
+# Each test runs in its own copy of the compiled workdir: the sandbox hands
+# its /work back to the server when its run ends, which would cut off any
+# other test still reading files there (a script's source, lazily loaded
+# Java classes).
+
+_stats = {"jobs": 0, "tests": 0, "AC": 0, "WA": 0, "TLE": 0, "RE": 0, "CE": 0}
+
+
+def tokens_match(expected, actual):
+    # Whitespace-tolerant: compare the outputs as token sequences
+    return expected.split() == actual.split()
+
+
+def verdict(result, expected, time_limit=None):
+    if result["timed_out"]:
+        return "TLE"
+    if time_limit is not None and any(
+        (result.get(measured) or 0) > time_limit for measured in ("cpu_time", "wall_time")
+    ):
+        return "TLE"  # RLIMIT_CPU only counts whole seconds; fractional limits are checked here
+    if result["signal"] in ("SIGXCPU", "SIGKILL") and not result["truncated"]:
+        return "TLE"  # CPU rlimit: SIGXCPU at the soft limit, SIGKILL at the hard one
+    if result["code"] != 0 or result["signal"]:
+        return "RE"
+    if not result["truncated"] and tokens_match(expected, result["stdout"]):
+        return "AC"
+    return "WA"
+
+
+def _stdin(text):
+    return text if text.endswith("\n") else text + "\n"
+
+
+async def judge(language, code, samples, user_id=None, time_limit=None, memory_mb=None):
+    """
+    Async generator of events for one judge job:
+      {"event": "compile", ...}            (compiled languages only)
+      {"event": "test", "index": i, ...}   per sample, in completion order
+      {"event": "done", "verdict": ..., "passed": n, "total": m}
+    Raises executor.ExecutionError / executor.QueueTimeout.
+    """
+    _stats["jobs"] += 1
+    time_limit = min(time_limit or settings.EXECUTION_TIME_LIMIT, settings.EXECUTION_TIME_LIMIT)
+    memory_mb = min(memory_mb or settings.EXECUTION_MEMORY_MB, settings.EXECUTION_MEMORY_MB)
+
+    # The job counts once against the user's cap; each step takes a global slot
+    async with executor.slot(user_id, run=False):
+        with executor.scratch_dir() as workdir:
+            config, values = executor.prepare(language, code, workdir)
+
+            if config["compile"]:
+                async with executor.slot():
+                    compiled = await executor.build(language, code, config, values, workdir)
+                yield {"event": "compile", **compiled}
+                if compiled["code"] != 0:
+                    _stats["CE"] += 1
+                    yield {"event": "done", "verdict": "CE", "passed": 0, "total": len(samples)}
+                    return
+
+            async def run_test(index, sample):
+                async with executor.slot():
+                    with executor.scratch_dir() as testdir:
+                        await sync_to_async(executor.copy_files, thread_sensitive=False)(workdir, testdir)
+                        result = await executor.run_compiled(
+                            language, config, values, testdir, _stdin(sample["input"]),
+                            cpu=time_limit, memory_mb=memory_mb,
+                        )
+                return index, sample, result
+
+            verdicts = {}
+            tasks = [asyncio.ensure_future(run_test(i, s)) for i, s in enumerate(samples)]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    index, sample, result = await next_done
+                    outcome = verdict(result, sample["output"], time_limit)
+                    verdicts[index] = outcome
+                    _stats["tests"] += 1
+                    _stats[outcome] += 1
+                    yield {
+                        "event": "test",
+                        "index": index,
+                        "verdict": outcome,
+                        "time": result["time"],
+                        "cpu_time": result.get("cpu_time"),
+                        "input": sample["input"],
+                        "expected": sample["output"],
+                        "stdout": result["stdout"],
+                        "stderr": result["stderr"],
+                    }
+            finally:
+                # Client went away or a test failed to get a slot: stop the rest
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    failed = [verdicts[i] for i in sorted(verdicts) if verdicts[i] != "AC"]
+    yield {
+        "event": "done",
+        "verdict": failed[0] if failed else "AC",
+        "passed": len(samples) - len(failed),
+        "total": len(samples),
+    }
+
+
+def get_stats():
+    return dict(_stats)
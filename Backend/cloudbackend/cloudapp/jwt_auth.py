@@ -0,0 +1,98 @@
+# cloudapp/jwt_auth.py
+import functools
+import json
+import time
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+
+# user id -> (user, expires_at). Short-lived so reconnect storms don't hit
+# auth_user every time; never outlives the token that populated it.
+_user_cache = {}
+
+
+@database_sync_to_async
+def get_user_db(jwt_auth, validated_token):
+    return jwt_auth.get_user(validated_token)
+
+
+async def get_user_from_token(token_str):
+    """
+    Asynchronously get a user from a JWT token string.
+    The token is verified once, in the event loop; the DB is only hit on a cache miss.
+    """
+    from rest_framework_simplejwt.exceptions import InvalidToken, TokenError, AuthenticationFailed
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.settings import api_settings
+    from django.contrib.auth.models import AnonymousUser
+
+    try:
+        # Signature + expiry check (no DB access)
+        jwt_auth = JWTAuthentication()
+        validated_token = jwt_auth.get_validated_token(token_str)
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+    except (InvalidToken, TokenError, KeyError):
+        return AnonymousUser()
+
+    now = time.time()
+    cached = _user_cache.get(user_id)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    try:
+        user = await get_user_db(jwt_auth, validated_token)
+    except (InvalidToken, AuthenticationFailed):
+        return AnonymousUser()
+    except Exception as e:
+        print(f"Error getting user from token: {e}")
+        return AnonymousUser()
+
+    if len(_user_cache) >= settings.WS_USER_CACHE_MAX:
+        for key in [k for k, (_, expires_at) in _user_cache.items() if expires_at <= now]:
+            del _user_cache[key]
+    if len(_user_cache) < settings.WS_USER_CACHE_MAX:
+        expires_at = min(now + settings.WS_USER_CACHE_TTL, validated_token.get("exp", now))
+        _user_cache[user_id] = (user, expires_at)
+    return user
+
+
+async def get_user_from_request(request):
+    """Async equivalent of DRF's JWTAuthentication for plain Django async views."""
+    from django.contrib.auth.models import AnonymousUser
+
+    header = request.headers.get("Authorization", "")
+    parts = header.split()
+    if len(parts) != 2 or parts[0] != "Bearer":
+        return AnonymousUser()
+    return await get_user_from_token(parts[1])
+
+
+def json_post(staff_only=False):
+    """
+    For plain async views taking a JSON object by POST: answers 405 / 401 /
+    403 / 400 itself and calls `view(request, user, body, ...)` otherwise.
+    """
+    def decorate(view):
+        @csrf_exempt
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != "POST":
+                return JsonResponse({"error": "Method not allowed"}, status=405)
+
+            user = await get_user_from_request(request)
+            if not user.is_authenticated:
+                return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+            if staff_only and not user.is_staff:
+                return JsonResponse({"detail": "You do not have permission to perform this action."}, status=403)
+
+            try:
+                body = json.loads(request.body or b"{}")
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+            return await view(request, user, body, *args, **kwargs)
+        return wrapper
+    return decorate
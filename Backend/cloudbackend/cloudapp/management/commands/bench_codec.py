@@ -0,0 +1,70 @@
+# cloudapp/management/commands/bench_codec.py
+import timeit
+from django.core.management.base import BaseCommand
+from cloudapp import codec
+
+
+def sample_frames():
+    code = "\n".join(f"    int x{i} = solve(a[{i}], b[{i}]);" for i in range(2000))
+    return {
+        "code_ops": {
+            "type": "code_ops",
+            "rev": 1842,
+            "ops": [{"op": "insert", "pos": 51234, "text": "a"}],
+        },
+        "presence": {
+            "type": "presence",
+            "members": [
+                {
+                    "username": f"student_{i}",
+                    "position": {"lineNumber": 120 + i, "column": 17},
+                    "selection": {
+                        "startLineNumber": 120 + i, "startColumn": 4,
+                        "endLineNumber": 121 + i, "endColumn": 9,
+                    },
+                }
+                for i in range(5)
+            ],
+        },
+        "room_state": {
+            "type": "room_state",
+            "code": code,
+            "rev": 1842,
+            "language": "cpp",
+            "problem": None,
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare JSON and msgpack websocket frame encodings (size and encode/decode time)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--number", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        number = options["number"]
+        json_backend = "orjson" if codec.orjson is not None else "json"
+        self.stdout.write(f"JSON backend: {json_backend}, {number} iterations per case\n")
+        self.stdout.write(
+            f"{'frame':<12}{'encoding':<10}{'bytes':>10}{'encode us':>12}{'decode us':>12}"
+        )
+
+        for name, data in sample_frames().items():
+            text = codec.frame(data, "student_0")
+            binary = codec.binary_frame(1, codec.packb(data))
+
+            cases = [
+                ("json", len(text.encode()),
+                 lambda: codec.frame(data, "student_0"),
+                 lambda: codec.loads(text)),
+                ("msgpack", len(binary),
+                 lambda: codec.binary_frame(1, codec.packb(data)),
+                 lambda: codec.unpackb(binary)),
+            ]
+            for encoding, size, encode, decode in cases:
+                encode_us = timeit.timeit(encode, number=number) / number * 1e6
+                decode_us = timeit.timeit(decode, number=number) / number * 1e6
+                self.stdout.write(
+                    f"{name:<12}{encoding:<10}{size:>10}{encode_us:>12.2f}{decode_us:>12.2f}"
+                )
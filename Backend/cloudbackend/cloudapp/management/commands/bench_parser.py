@@ -0,0 +1,52 @@
+# cloudapp/management/commands/bench_parser.py
+import timeit
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from cloudapp import codeforces
+
+
+class Command(BaseCommand):
+    help = (
+        "Time every available statement parser on saved Codeforces pages and "
+        "check each one against the BeautifulSoup reference output."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("pages", nargs="+", help="Saved problem pages (.html files or directories of them)")
+        parser.add_argument("--number", type=int, default=50)
+
+    def handle(self, *args, **options):
+        files = []
+        for page in options["pages"]:
+            path = Path(page)
+            files.extend(sorted(path.glob("*.html")) if path.is_dir() else [path])
+        if not files:
+            raise CommandError("No pages found.")
+
+        engines = [name for name in codeforces.PARSERS if name != "lxml" or codeforces.lxml is not None]
+        number = options["number"]
+        mismatches = 0
+
+        self.stdout.write(f"{'page':<32}{'engine':<8}{'ms/parse':>10}  result")
+        for path in files:
+            html = path.read_text(encoding="utf-8")
+            url = f"file://{path}"
+            reference = codeforces.parse_problem_bs4(html, url)
+
+            for name in engines:
+                parse = codeforces.PARSERS[name]
+                result = parse(html, url)
+                ms = timeit.timeit(lambda: parse(html, url), number=number) / number * 1000
+
+                same = (
+                    result["title"] == reference["title"]
+                    and result["samples"] == reference["samples"]
+                    and codeforces.statement_text(result["statement"]) == codeforces.statement_text(reference["statement"])
+                )
+                mismatches += not same
+                self.stdout.write(
+                    f"{path.name[:31]:<32}{name:<8}{ms:>10.3f}  {'ok' if same else 'MISMATCH'}"
+                )
+
+        if mismatches:
+            raise CommandError(f"{mismatches} parser result(s) differ from the bs4 reference.")
@@ -0,0 +1,51 @@
+# cloudapp/management/commands/prefetch_problems.py
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+from cloudapp import codeforces
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch Codeforces problems ahead of a contest and store them in the local "
+        "problem table, e.g. 'prefetch_problems --contest 1850' or "
+        "'prefetch_problems 1850A 1850B'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("problems", nargs="*", help="Problem codes like 1850A or 1850/B")
+        parser.add_argument("--contest", action="append", default=[], help="Prefetch every problem of this contest")
+        parser.add_argument("--concurrency", type=int, default=None)
+        parser.add_argument("--refresh", action="store_true", help="Refetch problems that are already stored")
+
+    def handle(self, *args, **options):
+        try:
+            keys = [codeforces.parse_problem_code(code) for code in options["problems"]]
+        except ValueError as e:
+            raise CommandError(str(e))
+        if not keys and not options["contest"]:
+            raise CommandError("Give problem codes and/or --contest.")
+
+        try:
+            results = asyncio.run(self.prefetch(keys, options))
+        except (codeforces.UpstreamError, codeforces.ParseError) as e:
+            raise CommandError(f"Couldn't list contest problems: {e}")
+
+        failed = 0
+        for result in results:
+            code = f"{result['contest_id']}{result['problem_index']}"
+            if result["status"] == "ok":
+                self.stdout.write(f"{code:<10} ok     {result['title']}")
+            else:
+                failed += 1
+                self.stdout.write(f"{code:<10} FAILED {result['error']}")
+
+        self.stdout.write(f"{len(results) - failed}/{len(results)} problems stored.")
+        if failed:
+            raise CommandError(f"{failed} problem(s) failed.")
+
+    async def prefetch(self, keys, options):
+        for contest_id in options["contest"]:
+            keys += await codeforces.contest_problem_keys(contest_id)
+        return await codeforces.prefetch_problems(
+            keys, concurrency=options["concurrency"], refresh=options["refresh"]
+        )
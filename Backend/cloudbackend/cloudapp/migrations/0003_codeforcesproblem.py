@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudapp', '0002_collaborationsession_problem_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeforcesProblem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contest_id', models.CharField(max_length=20)),
+                ('problem_index', models.CharField(max_length=10)),
+                ('data', models.JSONField()),
+                ('fetched_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('contest_id', 'problem_index')},
+            },
+        ),
+    ]
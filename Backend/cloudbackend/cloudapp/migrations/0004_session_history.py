@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudapp', '0003_codeforcesproblem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collaborationsession',
+            name='revision',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='SessionEdit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision', models.IntegerField()),
+                ('ops', models.JSONField()),
+                ('username', models.CharField(blank=True, max_length=150)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='edits', to='cloudapp.collaborationsession')),
+            ],
+            options={
+                'unique_together': {('session', 'revision')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SessionSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision', models.IntegerField()),
+                ('code', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='cloudapp.collaborationsession')),
+            ],
+            options={
+                'unique_together': {('session', 'revision')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:17
+
+import cloudapp.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudapp', '0004_session_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProblemStatement',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('html', cloudapp.fields.CompressedTextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='collaborationsession',
+            name='code',
+            field=cloudapp.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='collaborationsession',
+            name='problem_data',
+            field=cloudapp.fields.CompressedJSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:47
+
+import cloudapp.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudapp', '0005_compressed_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sessionedit',
+            name='ops',
+            field=cloudapp.fields.CompressedJSONField(),
+        ),
+        migrations.AlterField(
+            model_name='sessionsnapshot',
+            name='code',
+            field=cloudapp.fields.CompressedTextField(),
+        ),
+    ]
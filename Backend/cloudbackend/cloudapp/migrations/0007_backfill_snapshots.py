@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def backfill_snapshots(apps, schema_editor):
+    # Sessions created before the edit log have no snapshot, so history
+    # couldn't be rebuilt for any revision they were at before their next
+    # edit. Their stored code is the code at their current revision.
+    CollaborationSession = apps.get_model('cloudapp', 'CollaborationSession')
+    SessionSnapshot = apps.get_model('cloudapp', 'SessionSnapshot')
+    sessions = (
+        CollaborationSession.objects.filter(snapshots__isnull=True)
+        .values_list('id', 'revision', 'code').iterator(chunk_size=500)
+    )
+    batch = []
+    for session_id, revision, code in sessions:
+        batch.append(SessionSnapshot(session_id=session_id, revision=revision, code=code))
+        if len(batch) == 500:
+            SessionSnapshot.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    SessionSnapshot.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cloudapp', '0006_compressed_history'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_snapshots, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,66 @@
 import uuid
 from django.db import models
 from django.conf import settings
+from .fields import CompressedJSONField, CompressedTextField
 
 class CollaborationSession(models.Model):
     language = models.CharField(max_length=50)
-    code = models.TextField()
+    code = CompressedTextField()
     created_by = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sessions'
     )
     created_at = models.DateTimeField(auto_now_add=True)
     token = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
-    problem_data = models.JSONField(null=True, blank=True)
+    problem_data = CompressedJSONField(null=True, blank=True)  # statement stored in ProblemStatement
+    revision = models.IntegerField(default=0)  # revision `code` is at (see SessionEdit)
     def __str__(self):
         return f"Session {self.id} ({self.language})"
+
+class SessionEdit(models.Model):
+    # Append-only log: the ops that took the session from revision - 1 to revision
+    session = models.ForeignKey(CollaborationSession, on_delete=models.CASCADE, related_name='edits')
+    revision = models.IntegerField()
+    ops = CompressedJSONField()
+    username = models.CharField(max_length=150, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('session', 'revision')
+
+    def __str__(self):
+        return f"Edit {self.session_id}@{self.revision}"
+
+class SessionSnapshot(models.Model):
+    # Full code at a revision; history is rebuilt from the nearest one
+    session = models.ForeignKey(CollaborationSession, on_delete=models.CASCADE, related_name='snapshots')
+    revision = models.IntegerField()
+    code = CompressedTextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('session', 'revision')
+
+    def __str__(self):
+        return f"Snapshot {self.session_id}@{self.revision}"
+
+class ProblemStatement(models.Model):
+    # Statement HTML shared by every session/problem row that references its hash
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    html = CompressedTextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Statement {self.sha256[:12]}"
+
+class CodeforcesProblem(models.Model):
+    # Parsed problem (title, statement HTML, url, samples), shared by every session
+    contest_id = models.CharField(max_length=20)
+    problem_index = models.CharField(max_length=10)
+    data = models.JSONField()
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('contest_id', 'problem_index')
+
+    def __str__(self):
+        return f"Problem {self.contest_id}{self.problem_index}"
@@ -0,0 +1,280 @@
+# cloudapp/ot.py
+from collections import deque
+
+# Edit ops are plain dicts so they go over the channel layer / websocket as-is:
+#   {"op": "insert", "pos": 10, "text": "abc"}
+#   {"op": "delete", "pos": 10, "length": 3}
+# Positions are character offsets into the document. A list of ops is applied
+# in order, each one against the text produced by the previous op.
+
+# How many revisions each room keeps around for transforming late ops and for
+# "ops since revision N" requests from reconnecting clients.
+HISTORY_LIMIT = 500
+
+
+class StaleRevision(Exception):
+    """The client's base revision is older than the history we still keep."""
+
+
+def _insert(pos, text):
+    return {"op": "insert", "pos": pos, "text": text}
+
+
+def _delete(pos, length):
+    return {"op": "delete", "pos": pos, "length": length}
+
+
+def normalize_ops(ops):
+    """
+    Validate ops coming from a client and return clean copies.
+    Raises ValueError on anything malformed.
+    """
+    if not isinstance(ops, list):
+        raise ValueError("ops must be a list")
+
+    clean = []
+    for op in ops:
+        if not isinstance(op, dict):
+            raise ValueError("op must be an object")
+        pos = op.get("pos")
+        if not isinstance(pos, int) or isinstance(pos, bool) or pos < 0:
+            raise ValueError("op pos must be a non-negative integer")
+
+        if op.get("op") == "insert":
+            text = op.get("text")
+            if not isinstance(text, str):
+                raise ValueError("insert op needs text")
+            if text:
+                clean.append(_insert(pos, text))
+        elif op.get("op") == "delete":
+            length = op.get("length")
+            if not isinstance(length, int) or isinstance(length, bool) or length < 0:
+                raise ValueError("delete op needs a non-negative length")
+            if length:
+                clean.append(_delete(pos, length))
+        else:
+            raise ValueError(f"unknown op {op.get('op')!r}")
+    return clean
+
+
+def common_affixes(a, b):
+    """Lengths of the longest common prefix and (non-overlapping) suffix."""
+    prefix = 0
+    limit = min(len(a), len(b))
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    return prefix, suffix
+
+
+def diff_ops(old, new):
+    """Ops turning `old` into `new`: one delete/insert around the changed middle."""
+    prefix, suffix = common_affixes(old, new)
+    ops = []
+    removed = len(old) - prefix - suffix
+    if removed:
+        ops.append(_delete(prefix, removed))
+    if len(new) - prefix - suffix:
+        ops.append(_insert(prefix, new[prefix:len(new) - suffix]))
+    return ops
+
+
+def apply_ops(text, ops):
+    """Apply a list of ops to text. Raises ValueError if an op is out of range."""
+    for op in ops:
+        pos = op["pos"]
+        if op["op"] == "insert":
+            if pos > len(text):
+                raise ValueError("insert position out of range")
+            text = text[:pos] + op["text"] + text[pos:]
+        else:
+            end = pos + op["length"]
+            if end > len(text):
+                raise ValueError("delete range out of range")
+            text = text[:pos] + text[end:]
+    return text
+
+
+def _shrink_delete(a, b):
+    # Delete a, rewritten to apply after delete b already removed its range
+    a_end = a["pos"] + a["length"]
+    b_end = b["pos"] + b["length"]
+    if a_end <= b["pos"]:
+        return [a]
+    if a["pos"] >= b_end:
+        return [_delete(a["pos"] - b["length"], a["length"])]
+
+    overlap = min(a_end, b_end) - max(a["pos"], b["pos"])
+    remaining = a["length"] - overlap
+    if remaining <= 0:
+        return []
+    return [_delete(min(a["pos"], b["pos"]), remaining)]
+
+
+def _transform_insert_delete(ins, dele):
+    # Returns (ins', dele') for a concurrent insert and delete
+    ins_len = len(ins["text"])
+    del_end = dele["pos"] + dele["length"]
+
+    if ins["pos"] <= dele["pos"]:
+        return [ins], [_delete(dele["pos"] + ins_len, dele["length"])]
+    if ins["pos"] >= del_end:
+        return [_insert(ins["pos"] - dele["length"], ins["text"])], [dele]
+
+    # Insert landed inside the deleted range: keep the inserted text and split
+    # the delete around it.
+    head = ins["pos"] - dele["pos"]
+    return [_insert(dele["pos"], ins["text"])], [
+        _delete(dele["pos"], head),
+        _delete(dele["pos"] + ins_len, dele["length"] - head),
+    ]
+
+
+def _transform_pair(a, b):
+    """
+    Transform two concurrent single ops. Returns (a', b') where a' applies
+    after b and b' applies after a. On an insert tie, b (the op the server
+    already applied) stays first.
+    """
+    if a["op"] == "insert" and b["op"] == "insert":
+        if a["pos"] < b["pos"]:
+            return [a], [_insert(b["pos"] + len(a["text"]), b["text"])]
+        return [_insert(a["pos"] + len(b["text"]), a["text"])], [b]
+
+    if a["op"] == "insert":
+        return _transform_insert_delete(a, b)
+
+    if b["op"] == "insert":
+        b_prime, a_prime = _transform_insert_delete(b, a)
+        return a_prime, b_prime
+
+    return _shrink_delete(a, b), _shrink_delete(b, a)
+
+
+def transform(a_ops, b_ops):
+    """
+    Transform two concurrent op lists that were made against the same text.
+    Returns (a', b'): apply(apply(text, b), a') == apply(apply(text, a), b').
+    """
+    if not a_ops or not b_ops:
+        return a_ops, b_ops
+
+    if len(a_ops) == 1 and len(b_ops) == 1:
+        return _transform_pair(a_ops[0], b_ops[0])
+
+    if len(a_ops) > 1:
+        first, b_prime = transform(a_ops[:1], b_ops)
+        rest, b_prime = transform(a_ops[1:], b_prime)
+        return first + rest, b_prime
+
+    a_prime, first = transform(a_ops, b_ops[:1])
+    a_prime, rest = transform(a_prime, b_ops[1:])
+    return a_prime, first + rest
+
+
+class RoomDocument:
+    """
+    Authoritative text + revision counter for one room, plus the recent ops
+    history used to transform edits that were made against older revisions.
+    """
+
+    def __init__(self, code="", revision=0):
+        self.code = code or ""
+        self.revision = revision
+        self.history = deque(maxlen=HISTORY_LIMIT)  # (revision, ops)
+
+    def rebase(self, base_revision, ops):
+        """
+        Transform ops made against base_revision so they apply to the current
+        text. Doesn't change the document.
+        """
+        if base_revision > self.revision:
+            raise ValueError("revision is ahead of the server")
+
+        oldest = self.history[0][0] - 1 if self.history else self.revision
+        if base_revision < oldest:
+            raise StaleRevision(base_revision)
+
+        for revision, applied in self.history:
+            if revision > base_revision:
+                ops, _ = transform(ops, applied)
+        return ops
+
+    def push(self, revision, ops):
+        """Apply ops against the current text as `revision` (the next one)."""
+        if revision != self.revision + 1:
+            raise ValueError(f"expected revision {self.revision + 1}, got {revision}")
+        self.code = apply_ops(self.code, ops)
+        self.revision = revision
+        self.history.append((revision, ops))
+
+    def apply_client_ops(self, base_revision, ops):
+        """
+        Rebase ops made against base_revision onto the current text, apply
+        them and return (new_revision, transformed_ops).
+        """
+        ops = self.rebase(base_revision, ops)
+        self.push(self.revision + 1, ops)
+        return self.revision, ops
+
+    def replace(self, code):
+        """Full-document replacement (legacy code_change). Returns the new revision."""
+        # Only the changed middle goes into history, so a keystroke logs a
+        # keystroke rather than the whole document twice
+        self.push(self.revision + 1, diff_ops(self.code, code or ""))
+        return self.revision
+
+    def ops_since(self, revision):
+        """
+        Ops needed to bring a client at `revision` up to date, as a list of
+        {"rev", "ops"} entries. Raises StaleRevision if history no longer
+        reaches back that far.
+        """
+        if revision > self.revision:
+            raise ValueError("revision is ahead of the server")
+
+        oldest = self.history[0][0] - 1 if self.history else self.revision
+        if revision < oldest:
+            raise StaleRevision(revision)
+
+        return [
+            {"rev": rev, "ops": ops}
+            for rev, ops in self.history
+            if rev > revision
+        ]
+
+
+# --- PER-PROCESS ROOM REGISTRY ---
+# Each process keeps its own copy of the documents its members edit, seeded
+# from the DB on first join and dropped once the last local member leaves.
+# Revisions are handed out through room_sync, which keeps the copies on
+# different processes in step.
+_documents = {}
+_members = {}
+
+
+def join_room(room, code="", revision=0):
+    """Register a member and return the room's document, creating it if needed."""
+    doc = _documents.get(room)
+    if doc is None:
+        doc = RoomDocument(code, revision)
+        _documents[room] = doc
+    _members[room] = _members.get(room, 0) + 1
+    return doc
+
+
+def get_document(room):
+    return _documents.get(room)
+
+
+def leave_room(room):
+    """Unregister a member. Returns True when this was the last local member."""
+    remaining = _members.get(room, 0) - 1
+    if remaining > 0:
+        _members[room] = remaining
+        return False
+    _members.pop(room, None)
+    _documents.pop(room, None)
+    return True
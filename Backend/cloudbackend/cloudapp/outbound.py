@@ -0,0 +1,192 @@
+# cloudapp/outbound.py
+import asyncio
+import time
+from collections import deque
+from django.conf import settings
+
+# Per-socket send queue. Consumers queue frames here instead of awaiting the
+# websocket, and one writer task per socket drains it. A slow client then
+# shows up as a growing queue instead of a stalled consumer whose channel
+# layer queue overflows and silently drops room messages.
+#
+# Document frames (code_ops, tagged with their revision) are
+# the only ones that can be replaced: once OUTBOUND_HIGH_WATER frames are
+# waiting, all queued document frames are dropped for a single room_state
+# built when it's actually sent. Document frames at or below that snapshot's
+# revision are skipped from then on. A socket that hasn't got back under a
+# quarter of the high-water mark within OUTBOUND_SLOW_TIMEOUT seconds, or
+# has OUTBOUND_MAX_BYTES queued, is closed.
+#
+# send() itself is no measure of a slow client: under Daphne it never
+# waits, Twisted buffers the write and returns at once. So the client
+# reports the revision it has applied ("applied" frames, see DocumentSync
+# in the editor) and the writer holds document frames while it has sent
+# OUTBOUND_WINDOW revisions more than that, and a snapshot while the client
+# hasn't applied the previous one. Held frames stay in the queue, where the
+# limits above apply whatever the server. Clients that never report aren't
+# held.
+
+SLOW_CLOSE_CODE = 4008
+
+_RESYNC = object()   # queue entry: send a fresh snapshot here
+
+_connections = 0
+_stats = {
+    "frames": 0,
+    "collapses": 0,
+    "collapsed_frames": 0,
+    "slow_disconnects": 0,
+    "window_waits": 0,
+    "max_depth": 0,
+}
+
+
+class OutboundQueue:
+
+    def __init__(self, send, snapshot, close):
+        self.send = send            # async send(text_data=..., bytes_data=...)
+        self.snapshot = snapshot    # async () -> (rev, send kwargs) for a room_state
+        self.close = close          # async close(code)
+        self.frames = deque()       # (send kwargs, rev or None, size) or _RESYNC
+        self.size = 0
+        self.resync_pending = False
+        self.synced_rev = -1        # revision of the last snapshot sent
+        self.sent_rev = -1          # highest revision sent, as an edit or a snapshot
+        self.applied_rev = None     # highest revision the client reports applied
+        self.lagging_since = None
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._credit = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writer = None
+
+    def start(self):
+        global _connections
+        _connections += 1
+        self._writer = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        global _connections
+        self.closed = True
+        if self._writer is not None:
+            _connections -= 1
+            self._writer.cancel()
+            self._writer = None
+        self.frames.clear()
+        self.size = 0
+
+    def put(self, text_data=None, bytes_data=None, rev=None):
+        """Queue a frame; `rev` marks a document frame a snapshot can replace."""
+        if self.closed:
+            return
+        if rev is not None and self.resync_pending:
+            # The snapshot waiting in the queue will include this edit
+            _stats["collapsed_frames"] += 1
+            self._check_lag()
+            return
+
+        size = len(text_data if text_data is not None else bytes_data)
+        self.frames.append(({"text_data": text_data, "bytes_data": bytes_data}, rev, size))
+        self.size += size
+        _stats["frames"] += 1
+        _stats["max_depth"] = max(_stats["max_depth"], len(self.frames))
+        self._idle.clear()
+        self._ready.set()
+
+        if len(self.frames) >= settings.OUTBOUND_HIGH_WATER:
+            self._collapse()
+            if self.lagging_since is None:
+                self.lagging_since = time.monotonic()
+        self._check_lag()
+
+    def applied(self, rev):
+        """The client has applied every revision up to `rev`."""
+        if not isinstance(rev, int) or isinstance(rev, bool):
+            return
+        if self.applied_rev is None or rev > self.applied_rev:
+            self.applied_rev = rev
+            self._credit.set()
+
+    def _check_lag(self):
+        if (self.size >= settings.OUTBOUND_MAX_BYTES or (
+                self.lagging_since is not None
+                and time.monotonic() - self.lagging_since >= settings.OUTBOUND_SLOW_TIMEOUT)):
+            self._give_up()
+
+    def _held(self, entry):
+        if self.applied_rev is None:
+            return False
+        if entry is _RESYNC:
+            return self.applied_rev < self.synced_rev
+        rev = entry[1]
+        return (rev is not None and rev > self.synced_rev
+                and self.sent_rev - self.applied_rev >= settings.OUTBOUND_WINDOW)
+
+    def _collapse(self):
+        kept = deque()
+        dropped = 0
+        for entry in self.frames:
+            if entry is not _RESYNC and entry[1] is not None:
+                self.size -= entry[2]
+                dropped += 1
+            else:
+                kept.append(entry)
+        if not dropped:
+            return  # nothing replaceable; the lag timer decides
+        kept.append(_RESYNC)
+        self.frames = kept
+        self.resync_pending = True
+        _stats["collapses"] += 1
+        _stats["collapsed_frames"] += dropped
+
+    def _give_up(self):
+        self.closed = True
+        self.frames.clear()
+        self.size = 0
+        _stats["slow_disconnects"] += 1
+        asyncio.ensure_future(self.close(SLOW_CLOSE_CODE))
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            while self.frames:
+                if self._held(self.frames[0]):
+                    # Lagging until the client catches up; the queue may
+                    # collapse meanwhile, so look at it again after
+                    if self.lagging_since is None:
+                        self.lagging_since = time.monotonic()
+                    _stats["window_waits"] += 1
+                    self._credit.clear()
+                    await self._credit.wait()
+                    continue
+                entry = self.frames.popleft()
+                if entry is _RESYNC:
+                    self.resync_pending = False
+                    self.synced_rev, kwargs = await self.snapshot()
+                    self.sent_rev = max(self.sent_rev, self.synced_rev)
+                else:
+                    kwargs, rev, size = entry
+                    self.size -= size
+                    if rev is not None and rev <= self.synced_rev:
+                        continue  # already part of the snapshot the client has
+                    if rev is not None:
+                        self.sent_rev = max(self.sent_rev, rev)
+                await self.send(**kwargs)
+                if len(self.frames) <= settings.OUTBOUND_HIGH_WATER // 4:
+                    self.lagging_since = None   # back under the low-water mark
+            self.lagging_since = None
+
+            self._ready.clear()
+            self._idle.set()
+
+    async def drain(self, timeout):
+        """Wait (up to `timeout`) until everything queued has been sent."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+def get_stats():
+    return dict(_stats, connections=_connections)
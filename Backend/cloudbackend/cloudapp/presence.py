@@ -0,0 +1,124 @@
+# cloudapp/presence.py
+import asyncio
+from channels.layers import get_channel_layer
+from django.conf import settings
+from . import codec
+
+# Per-room presence aggregator. Cursor/selection/typing updates from local
+# members are merged here and sent to the room group as one presence frame
+# per tick; an update that is overtaken before the tick is simply dropped.
+# A member leaving is announced by the consumer as a "user_left" frame.
+
+_members = {}   # group -> {channel_name: state dict}
+_dirty = {}     # group -> set of channel names changed since the last tick
+_timers = {}    # group -> asyncio.TimerHandle
+_ids = {}       # group -> {username: small int id} for binary clients
+
+_stats = {"updates": 0, "frames": 0}
+
+
+def update(group, channel_name, username, **fields):
+    """Merge a member's latest presence fields and schedule the next tick."""
+    _stats["updates"] += 1
+    state = _members.setdefault(group, {}).setdefault(
+        channel_name, {"username": username}
+    )
+    state.update(fields)
+    _dirty.setdefault(group, set()).add(channel_name)
+
+    if group not in _timers:
+        loop = asyncio.get_running_loop()
+        _timers[group] = loop.call_later(
+            settings.PRESENCE_TICK,
+            lambda: asyncio.ensure_future(_tick(group)),
+        )
+
+
+def remove(group, channel_name):
+    members = _members.get(group)
+    if members is None:
+        return
+    members.pop(channel_name, None)
+    _dirty.get(group, set()).discard(channel_name)
+    if not members:
+        _members.pop(group, None)
+        _dirty.pop(group, None)
+        timer = _timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+
+
+async def _tick(group):
+    _timers.pop(group, None)
+    changed = _dirty.pop(group, set())
+    members = _members.get(group, {})
+
+    # Each entry is encoded once per format; recipients only splice out their own
+    entries = {}
+    binary_entries = {}
+    for channel_name in changed:
+        state = members.get(channel_name)
+        if state is None:
+            continue
+        entries[channel_name] = codec.dumps(state)
+        fields = {k: v for k, v in state.items() if k != "username"}
+        binary_entries[channel_name] = [state["username"], codec.packb(fields)]
+        # Typing is a one-shot signal, cursor/selection persist
+        state.pop("typing", None)
+
+    if not entries:
+        return
+
+    _stats["frames"] += 1
+    await get_channel_layer().group_send(group, {
+        "type": "presence_event",
+        "entries": entries,
+        "binary_entries": binary_entries,
+    })
+
+
+def presence_frame(entries, channel_name):
+    """Presence frame for one recipient, without that recipient's own entry."""
+    parts = [entry for sender, entry in entries.items() if sender != channel_name]
+    if not parts:
+        return None
+    return (
+        '{"data":{"type":"presence","members":[' + ",".join(parts)
+        + ']},"user":{"username":"System"}}'
+    )
+
+
+def binary_presence_frame(binary_entries, channel_name, ids):
+    """
+    Binary presence frame for one recipient: [0, {"type": "presence",
+    "members": [[id, fields], ...]}]. `ids` maps usernames to member ids.
+    """
+    parts = [
+        codec.binary_frame(ids[username], packed)
+        for sender, (username, packed) in binary_entries.items()
+        if sender != channel_name
+    ]
+    if not parts:
+        return None
+    return (
+        codec.binary_frame(codec.SYSTEM_ID, b"\x82")
+        + codec.packb("type") + codec.packb("presence")
+        + codec.packb("members") + codec.array_header(len(parts))
+        + b"".join(parts)
+    )
+
+
+def member_id(group, username):
+    """Small per-room integer id for a username (stable while the room is open here)."""
+    ids = _ids.setdefault(group, {})
+    if username not in ids:
+        ids[username] = len(ids) + 1
+    return ids[username]
+
+
+def forget_room(group):
+    _ids.pop(group, None)
+
+
+def get_stats():
+    return dict(_stats, rooms=len(_members))
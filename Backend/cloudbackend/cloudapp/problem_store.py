@@ -0,0 +1,79 @@
+# cloudapp/problem_store.py
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+# Content-addressed problem statements. Problem dicts are stored with their
+# "statement" HTML swapped for a sha256 reference into ProblemStatement, so
+# every session (and the Codeforces problem table) on the same problem
+# shares one copy. Statements never change once written, so the in-process
+# cache never needs invalidating.
+
+REF_KEY = "statement_sha256"
+
+_lock = threading.Lock()
+_statements = OrderedDict()   # sha256 -> html
+_stats = {"stored": 0, "deduplicated": 0, "cache_hits": 0, "db_reads": 0}
+
+
+def _remember(digest, html):
+    with _lock:
+        _statements[digest] = html
+        _statements.move_to_end(digest)
+        while len(_statements) > settings.STATEMENT_CACHE_MAX:
+            _statements.popitem(last=False)
+
+
+def pack_problem(data):
+    """Problem dict as stored: the statement replaced by its hash (sync, DB)."""
+    from .models import ProblemStatement
+    if not isinstance(data, dict) or not isinstance(data.get("statement"), str):
+        return data
+
+    html = data["statement"]
+    digest = hashlib.sha256(html.encode()).hexdigest()
+    with _lock:
+        known = digest in _statements
+    if known:
+        _stats["deduplicated"] += 1
+    else:
+        _, created = ProblemStatement.objects.get_or_create(sha256=digest, defaults={"html": html})
+        _stats["stored" if created else "deduplicated"] += 1
+        _remember(digest, html)
+
+    packed = {key: value for key, value in data.items() if key != "statement"}
+    packed[REF_KEY] = digest
+    return packed
+
+
+def unpack_problem(data):
+    """Inverse of pack_problem (sync, DB on a cache miss)."""
+    from .models import ProblemStatement
+    if not isinstance(data, dict) or REF_KEY not in data:
+        return data
+
+    digest = data[REF_KEY]
+    with _lock:
+        html = _statements.get(digest)
+        if html is not None:
+            _statements.move_to_end(digest)
+    if html is not None:
+        _stats["cache_hits"] += 1
+    else:
+        _stats["db_reads"] += 1
+        html = ProblemStatement.objects.filter(sha256=digest).values_list("html", flat=True).first()
+        if html is None:
+            html = ""  # statement row gone; keep the rest of the problem usable
+        else:
+            _remember(digest, html)
+
+    unpacked = {key: value for key, value in data.items() if key != REF_KEY}
+    unpacked["statement"] = html
+    return unpacked
+
+
+def get_stats():
+    with _lock:
+        cached = len(_statements)
+    return dict(_stats, cached=cached)
@@ -0,0 +1,114 @@
+# cloudapp/room_cache.py
+import asyncio
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+# Shared room-state cache for websocket snapshots. Entries are loaded once per
+# room (concurrent misses wait on the same load), kept current by the
+# consumer's own writes and evicted by TTL and LRU.
+#
+# The version stamp only counts writes this process has seen. Writes made on
+# other nodes reach it through the room's broadcasts (see
+# CollaborativeEditorConsumer.broadcast_message), and a room's entry is
+# dropped once its last local member leaves, so the next joiner reads the DB.
+
+_RETRY = object()   # the loading call was cancelled; a waiter loads instead
+
+
+class RoomStateCache:
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # token -> [expires_at, version, state]
+        self._loading = {}              # token -> Future for the in-flight load
+        self._late_writes = {}          # token -> fields written during that load
+        self._stats = {"hits": 0, "misses": 0, "waits": 0, "evictions": 0}
+
+    async def get(self, token, loader):
+        """
+        Return a copy of the room's state (with its "version" stamp), calling
+        `await loader(token)` only when nothing usable is cached. The loader
+        returns a dict of columns, or None if the room doesn't exist.
+        """
+        entry = self._entries.get(token)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(token)
+                self._stats["hits"] += 1
+                return dict(entry[2], version=entry[1])
+            del self._entries[token]
+            self._stats["evictions"] += 1
+
+        pending = self._loading.get(token)
+        if pending is not None:
+            self._stats["waits"] += 1
+            state = await asyncio.shield(pending)
+            if state is _RETRY:
+                return await self.get(token, loader)
+            return self._snapshot(token, state)
+
+        self._stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[token] = future
+        self._late_writes[token] = {}
+        try:
+            state = await loader(token)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        except BaseException:
+            # Cancelled (e.g. the joining socket closed); the waiters still want the row
+            future.set_result(_RETRY)
+            raise
+        finally:
+            self._loading.pop(token, None)
+            late = self._late_writes.pop(token, {})
+
+        if state is not None:
+            # Writes that landed while the row was being read are newer than it
+            state.update(late)
+            self._store(token, state)
+        future.set_result(state)
+        return self._snapshot(token, state)
+
+    def update(self, token, **fields):
+        """Apply the consumer's own write so cached snapshots never lag it."""
+        if token in self._late_writes:
+            self._late_writes[token].update(fields)
+
+        entry = self._entries.get(token)
+        if entry is not None:
+            entry[2].update(fields)
+            entry[1] += 1
+
+    def forget(self, token):
+        """Drop a room nobody here is in any more; other nodes may write it next."""
+        if self._entries.pop(token, None) is not None:
+            self._stats["evictions"] += 1
+
+    def _snapshot(self, token, state):
+        if state is None:
+            return None
+        entry = self._entries.get(token)
+        if entry is not None:
+            return dict(entry[2], version=entry[1])
+        return dict(state, version=1)
+
+    def _store(self, token, state):
+        self._entries[token] = [time.monotonic() + self.ttl, 1, state]
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get_stats(self):
+        return dict(self._stats, rooms=len(self._entries))
+
+
+room_states = RoomStateCache(
+    max_entries=settings.ROOM_CACHE_MAX_ROOMS,
+    ttl=settings.ROOM_CACHE_TTL,
+)
@@ -0,0 +1,99 @@
+# cloudapp/room_runs.py
+import asyncio
+import time
+import uuid
+from django.conf import settings
+
+# Runs started from the editor socket ("run_request"). One run per room at a
+# time (per process); its stdout/stderr is relayed to the whole room as
+# "run_output" frames while the program is still going.
+#
+# Output is coalesced: at most one frame per RUN_FLUSH_INTERVAL, or sooner
+# once RUN_CHUNK_BYTES are waiting. The executor awaits each write, so while
+# a frame is being handed to the channel layer the program's pipe fills up
+# and the program blocks - a chatty program can't outrun the room.
+
+_runs = {}          # room -> asyncio.Task
+_stats = {"runs": 0, "busy": 0, "cancelled": 0, "frames": 0, "bytes": 0}
+
+
+class OutputRelay:
+
+    def __init__(self, send):
+        self.send = send            # async callable taking the frame's data
+        self.chunks = []            # [[stream, text], ...], same-stream runs merged
+        self.size = 0
+        self.seq = 0
+        self.last_flush = 0.0
+        self.lock = asyncio.Lock()
+        self.timer = None
+
+    async def write(self, stream, text):
+        if self.chunks and self.chunks[-1][0] == stream:
+            self.chunks[-1][1] += text
+        else:
+            self.chunks.append([stream, text])
+        self.size += len(text)
+
+        wait = self.last_flush + settings.RUN_FLUSH_INTERVAL - time.monotonic()
+        if self.size >= settings.RUN_CHUNK_BYTES or wait <= 0:
+            await self.flush()
+        elif self.timer is None:
+            # Quiet program: don't sit on a partial line until the next write
+            self.timer = asyncio.ensure_future(self._flush_later(wait))
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        self.timer = None
+        await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            if not self.chunks:
+                return
+            chunks, self.chunks, size, self.size = self.chunks, [], self.size, 0
+            self.seq += 1
+            self.last_flush = time.monotonic()
+            _stats["frames"] += 1
+            _stats["bytes"] += size
+            await self.send({"type": "run_output", "seq": self.seq, "chunks": chunks})
+
+    async def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        await self.flush()
+
+
+def new_run_id():
+    return uuid.uuid4().hex[:12]
+
+
+def is_running(room):
+    task = _runs.get(room)
+    return task is not None and not task.done()
+
+
+def start(room, coro):
+    """Run `coro` as the room's current run; returns its task, or None if one is already going."""
+    if is_running(room):
+        _stats["busy"] += 1
+        coro.close()
+        return None
+    _stats["runs"] += 1
+    task = _runs[room] = asyncio.ensure_future(coro)
+    task.add_done_callback(lambda t: _runs.pop(room, None) if _runs.get(room) is t else None)
+    return task
+
+
+def cancel(room):
+    task = _runs.get(room)
+    if task is None or task.done():
+        return False
+    _stats["cancelled"] += 1
+    task.cancel()
+    return True
+
+
+def get_stats():
+    return dict(_stats, active=sum(not task.done() for task in _runs.values()))
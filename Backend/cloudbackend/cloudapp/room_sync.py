@@ -0,0 +1,231 @@
+# cloudapp/room_sync.py
+import asyncio
+import json
+from channels.db import database_sync_to_async
+from django.conf import settings
+from redis import RedisError
+from redis import asyncio as aioredis
+from . import edit_log, ot
+from .channel_layers import url_ring
+
+# Shared revision log for rooms whose members are connected to different
+# processes. Every process keeps its own ot.RoomDocument per room, but a
+# revision number is only handed out by appending the edit to the room's log
+# in Redis, with a compare-and-append on the head revision. If another
+# process appended first, the append fails and returns the entries this
+# process hasn't seen; they are applied to the local document, the edit is
+# transformed over them and the append is retried. So every revision is
+# assigned once cluster-wide and every copy applies the same ops in the
+# same order.
+#
+# Keys, on the Redis host the room's channel group hashes to (they expire
+# ROOM_SYNC_TTL seconds after the room's last edit):
+#   room:<token>:head   latest revision
+#   room:<token>:ops    JSON ops of the last ot.HISTORY_LIMIT revisions, oldest first
+#
+# With ROOM_SYNC_REDIS_URLS empty, each process is the only authority for
+# the rooms it hosts, which is right for a single process only.
+
+# KEYS: head, ops. ARGV: base revision, ops JSON, history limit, ttl.
+# Returns {1, new head} or {0, head, entries after base} ({0, head} when the
+# log no longer reaches back to base).
+_APPEND = """
+local head = tonumber(redis.call('GET', KEYS[1]))
+local base = tonumber(ARGV[1])
+if head == nil or head < base then
+    -- Expired or lost log (Redis restarted): whoever edits next restarts it
+    redis.call('DEL', KEYS[2])
+    head = base
+elseif head > base then
+    local behind = head - base
+    if behind > redis.call('LLEN', KEYS[2]) then
+        return {0, head}
+    end
+    return {0, head, redis.call('LRANGE', KEYS[2], -behind, -1)}
+end
+redis.call('SET', KEYS[1], head + 1, 'EX', ARGV[4])
+redis.call('RPUSH', KEYS[2], ARGV[2])
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[3]), -1)
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return {1, head + 1}
+"""
+
+# KEYS: head, ops. ARGV: base revision. Same shape as a failed append;
+# head is -1 when the room has no log.
+_READ = """
+local head = tonumber(redis.call('GET', KEYS[1]))
+if head == nil then
+    return {0, -1, {}}
+end
+local behind = head - tonumber(ARGV[1])
+if behind <= 0 then
+    return {0, head, {}}
+end
+if behind > redis.call('LLEN', KEYS[2]) then
+    return {0, head}
+end
+return {0, head, redis.call('LRANGE', KEYS[2], -behind, -1)}
+"""
+
+
+class Unavailable(Exception):
+    """The room's log couldn't be reached, so the edit wasn't applied."""
+
+
+_ring = None
+_clients = {}   # url -> Redis client
+_locks = {}     # token -> asyncio.Lock; one commit or catch-up per room at a time
+
+_stats = {
+    "commits": 0,
+    "conflicts": 0,      # appends that lost the race and caught up first
+    "caught_up": 0,      # revisions applied from other processes
+    "gaps": 0,           # catch-ups the Redis log couldn't cover alone
+    "errors": 0,
+}
+
+
+def _client(token):
+    global _ring
+    urls = settings.ROOM_SYNC_REDIS_URLS
+    if not urls:
+        return None
+    if _ring is None:
+        _ring = url_ring(urls)
+    # Same placement as the room's channel group while the URLs match
+    # CHANNEL_REDIS_URLS (the default)
+    url = urls[_ring.index(f"editor_{token}")]
+    client = _clients.get(url)
+    if client is None:
+        client = _clients[url] = aioredis.from_url(url)
+    return client
+
+
+def _keys(token):
+    return [f"room:{token}:head", f"room:{token}:ops"]
+
+
+def _lock(token):
+    lock = _locks.get(token)
+    if lock is None:
+        lock = _locks[token] = asyncio.Lock()
+    return lock
+
+
+async def _call(client, script, token, *args):
+    try:
+        result = await client.eval(script, 2, *_keys(token), *args)
+    except (RedisError, OSError) as e:
+        _stats["errors"] += 1
+        raise Unavailable(str(e)) from e
+    entries = [json.loads(entry) for entry in result[2]] if len(result) > 2 else None
+    return result[0] == 1, int(result[1]), entries
+
+
+async def _apply_missing(token, doc, head, entries):
+    """Bring `doc` up to `head` with the log entries after its revision."""
+    if entries is None:
+        # Further behind than Redis keeps; the DB log may still have it
+        _stats["gaps"] += 1
+        logged = await database_sync_to_async(edit_log.ops_since)(token, doc.revision, head)
+        if logged is None:
+            raise ot.StaleRevision(doc.revision)
+        entries = [entry["ops"] for entry in logged]
+
+    for ops in entries:
+        doc.push(doc.revision + 1, ops)
+    _stats["caught_up"] += len(entries)
+
+
+async def _read_missing(client, token, doc):
+    _, head, entries = await _call(client, _READ, token, doc.revision)
+    if head > doc.revision:
+        await _apply_missing(token, doc, head, entries)
+
+
+async def _commit(token, doc, make_ops, base_revision=None):
+    client = _client(token)
+    if client is None:
+        ops = make_ops()
+        doc.push(doc.revision + 1, ops)
+        _stats["commits"] += 1
+        return doc.revision, ops
+
+    async with _lock(token):
+        if base_revision is not None and base_revision > doc.revision:
+            # The client saw newer revisions in a broadcast from another
+            # process than this copy has applied; catch up before rebasing
+            await _read_missing(client, token, doc)
+        while True:
+            ops = make_ops()
+            ot.apply_ops(doc.code, ops)   # don't log ops that can't apply
+            ok, head, entries = await _call(
+                client, _APPEND, token, doc.revision, json.dumps(ops), ot.HISTORY_LIMIT, settings.ROOM_SYNC_TTL
+            )
+            if ok:
+                doc.push(head, ops)
+                _stats["commits"] += 1
+                return head, ops
+            _stats["conflicts"] += 1
+            await _apply_missing(token, doc, head, entries)
+
+
+async def commit(token, doc, base_revision, ops):
+    """
+    Rebase client ops made against base_revision onto the room and apply them
+    to `doc`. Returns (revision, transformed_ops) like
+    RoomDocument.apply_client_ops; raises ValueError / ot.StaleRevision for
+    ops that don't fit and Unavailable if Redis can't be reached.
+    """
+    return await _commit(token, doc, lambda: doc.rebase(base_revision, ops), base_revision)
+
+
+async def replace(token, doc, code):
+    """
+    Full-document replacement (legacy code_change), applied as the diff
+    against the room's text. Returns (revision, ops) like commit().
+    """
+    return await _commit(token, doc, lambda: ot.diff_ops(doc.code, code or ""))
+
+
+async def apply_remote(token, doc, revision, ops):
+    """
+    Apply a code_ops broadcast another process committed, so `doc` doesn't
+    wait for the next catch-up. Revisions `doc` already has are ignored and a
+    gap is filled from the log. Best effort, like catch_up.
+    """
+    client = _client(token)
+    if client is None or revision <= doc.revision:
+        return
+    async with _lock(token):
+        try:
+            if revision == doc.revision + 1:
+                doc.push(revision, ops)
+                _stats["caught_up"] += 1
+            elif revision > doc.revision:
+                await _read_missing(client, token, doc)
+        except (Unavailable, ValueError, ot.StaleRevision) as e:
+            print(f"Room sync couldn't apply revision {revision} for {token}: {e!r}")
+
+
+async def catch_up(token, doc):
+    """Apply revisions other processes made since `doc` last heard. Best effort."""
+    client = _client(token)
+    if client is None:
+        return
+    async with _lock(token):
+        try:
+            await _read_missing(client, token, doc)
+        except (Unavailable, ValueError, ot.StaleRevision) as e:
+            # The next commit retries through the same path
+            print(f"Room sync catch-up failed for {token}: {e!r}")
+
+
+def forget(token):
+    lock = _locks.get(token)
+    if lock is not None and not lock.locked():
+        del _locks[token]
+
+
+def get_stats():
+    return dict(_stats, enabled=bool(settings.ROOM_SYNC_REDIS_URLS))
@@ -0,0 +1,390 @@
+# cloudapp/sandbox_launcher.py
+#
+# Sandbox worker started ahead of time by cloudapp.executor and parked on its
+# stdin. Namespace setup happens before a job arrives; the job itself only
+# pays for a handful of mounts, setrlimit and exec.
+#
+# Protocol: the first line on stdin is a JSON job spec
+#   {"argv": [...], "cwd": "...", "cpu": seconds, "memory": bytes or null,
+#    "fsize": bytes, "nofile": n, "nproc": n, "uid": n, "gid": n,
+#    "owner": [uid, gid], "binds": ["/usr", ...], "report": name or null}
+# and everything after that line is the program's own stdin. With "report",
+# the launcher writes {"cpu": seconds, "wall": seconds} for the program to
+# that new file in the job's directory once the run is over.
+#
+# Isolation (the launcher must start as root; it refuses to run anything
+# otherwise):
+#   - new mount, pid, network, IPC and UTS namespaces
+#   - a fresh read-only root with only `binds` mounted (read-only), a private
+#     /proc, a minimal /dev, a small /tmp, and the job's cwd at /work as the
+#     only writable host directory
+#   - the program runs as the dedicated `uid`/`gid` with no supplementary
+#     groups, no_new_privs, RLIMIT_NPROC and a seccomp filter that refuses
+#     mount/namespace/ptrace/kernel-module style syscalls
+#
+# Process layout: launcher -> init (pid 1 of the new pid namespace) -> program.
+# When init exits the kernel kills everything left in the namespace, so a
+# program can't leave processes behind. The launcher hands /work back to the
+# server's uid afterwards and exits the way the program did (same code or
+# same signal). SIGTERM to the launcher stops the run.
+#
+# Deliberately stdlib-only and free of Django imports; run with `python -I -S`.
+import ctypes
+import json
+import os
+import resource
+import signal
+import struct
+import time
+
+CLONE_NEWNS = 0x00020000
+CLONE_NEWUTS = 0x04000000
+CLONE_NEWIPC = 0x08000000
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWPID = 0x20000000
+CLONE_NEWNET = 0x40000000
+CLONE_NEWCGROUP = 0x02000000
+CLONE_NEWTIME = 0x00000080
+NAMESPACE_FLAGS = (CLONE_NEWNS | CLONE_NEWUTS | CLONE_NEWIPC | CLONE_NEWUSER
+                   | CLONE_NEWPID | CLONE_NEWNET | CLONE_NEWCGROUP | CLONE_NEWTIME)
+
+MS_RDONLY = 0x1
+MS_NOSUID = 0x2
+MS_NODEV = 0x4
+MS_NOEXEC = 0x8
+MS_REMOUNT = 0x20
+MS_BIND = 0x1000
+MS_REC = 0x4000
+MS_PRIVATE = 0x40000
+MNT_DETACH = 0x2
+
+PR_SET_PDEATHSIG = 1
+PR_SET_NO_NEW_PRIVS = 38
+PR_SET_SECCOMP = 22
+SECCOMP_MODE_FILTER = 2
+
+SAFE_PATH = "/usr/local/bin:/usr/bin:/bin"
+WORKDIR = "/work"
+TMP_SIZE = "size=64m,mode=1777"
+DEVICES = ("null", "zero", "random", "urandom")
+SETUP_FAILED = 126
+
+# Syscalls a judged program has no business making, per architecture:
+# (AUDIT_ARCH, {name: nr}). clone is allowed unless it asks for a namespace;
+# clone3 passes its flags in memory the filter can't read, so it gets ENOSYS
+# and libc falls back to clone.
+SYSCALLS = {
+    "x86_64": (0xC000003E, {
+        "clone": 56, "clone3": 435, "pivot_root": 155,
+        "ptrace": 101, "mount": 165, "umount2": 166, "chroot": 161, "acct": 163,
+        "swapon": 167, "swapoff": 168, "reboot": 169, "sethostname": 170,
+        "setdomainname": 171, "init_module": 175, "delete_module": 176,
+        "quotactl": 179, "kexec_load": 246, "add_key": 248, "request_key": 249,
+        "keyctl": 250, "unshare": 272, "perf_event_open": 298,
+        "name_to_handle_at": 303, "open_by_handle_at": 304, "setns": 308,
+        "process_vm_readv": 310, "process_vm_writev": 311, "kcmp": 312,
+        "finit_module": 313, "kexec_file_load": 320, "bpf": 321,
+        "userfaultfd": 323, "io_uring_setup": 425, "io_uring_enter": 426,
+        "io_uring_register": 427, "open_tree": 428, "move_mount": 429,
+        "fsopen": 430, "fsconfig": 431, "fsmount": 432, "fspick": 433,
+        "mount_setattr": 442,
+    }),
+    "aarch64": (0xC00000B7, {
+        "clone": 220, "clone3": 435, "pivot_root": 41,
+        "ptrace": 117, "mount": 40, "umount2": 39, "chroot": 51, "acct": 89,
+        "swapon": 224, "swapoff": 225, "reboot": 142, "sethostname": 161,
+        "setdomainname": 162, "init_module": 105, "delete_module": 106,
+        "quotactl": 60, "kexec_load": 104, "add_key": 217, "request_key": 218,
+        "keyctl": 219, "unshare": 97, "perf_event_open": 241,
+        "name_to_handle_at": 264, "open_by_handle_at": 265, "setns": 268,
+        "process_vm_readv": 270, "process_vm_writev": 271, "kcmp": 272,
+        "finit_module": 273, "kexec_file_load": 294, "bpf": 280,
+        "userfaultfd": 282, "io_uring_setup": 425, "io_uring_enter": 426,
+        "io_uring_register": 427, "open_tree": 428, "move_mount": 429,
+        "fsopen": 430, "fsconfig": 431, "fsmount": 432, "fspick": 433,
+        "mount_setattr": 442,
+    }),
+}
+
+libc = ctypes.CDLL(None, use_errno=True)
+
+
+class SetupError(Exception):
+    """Isolation couldn't be set up; nothing gets run."""
+
+
+def check(result, what):
+    if result != 0:
+        err = ctypes.get_errno()
+        raise SetupError(f"{what}: {os.strerror(err)}")
+
+
+def mount(source, target, fstype=None, flags=0, data=None):
+    check(libc.mount(
+        source.encode() if source else None, target.encode(),
+        fstype.encode() if fstype else None, ctypes.c_ulong(flags),
+        data.encode() if data else None,
+    ), f"mount {target}")
+
+
+def syscalls():
+    table = SYSCALLS.get(os.uname().machine)
+    if table is None:
+        raise SetupError(f"no seccomp table for {os.uname().machine}")
+    return table
+
+
+# --- NAMESPACES (before the job arrives) ---
+def isolate():
+    if os.geteuid() != 0:
+        raise SetupError("the launcher must start as root to isolate programs")
+    # Own session, away from the server's terminal and process group signals
+    os.setsid()
+    check(libc.unshare(CLONE_NEWNS | CLONE_NEWPID | CLONE_NEWNET | CLONE_NEWIPC | CLONE_NEWUTS),
+          "unshare")
+    # Nothing mounted from here on propagates back to the host
+    mount(None, "/", flags=MS_REC | MS_PRIVATE)
+
+
+def read_spec():
+    # Byte at a time so nothing past the newline is consumed
+    line = bytearray()
+    while True:
+        ch = os.read(0, 1)
+        if not ch:
+            os._exit(0)  # pool shut down before a job arrived
+        if ch == b"\n":
+            return json.loads(line)
+        line += ch
+
+
+# --- FILESYSTEM (init, once the job is known) ---
+def bind(source, target, flags=MS_RDONLY | MS_NOSUID | MS_NODEV):
+    mount(source, target, flags=MS_BIND | MS_REC)
+    # Bind mounts ignore flags on creation; they only apply on a remount
+    mount(None, target, flags=MS_REMOUNT | MS_BIND | flags)
+
+
+def build_root(spec):
+    """Pivot into a fresh tmpfs holding only what the program may see."""
+    mount("tmpfs", "/tmp", "tmpfs", MS_NOSUID | MS_NODEV, "mode=0755")
+    os.mkdir("/tmp/oldroot")
+    os.chdir("/tmp")
+    check(libc.syscall(syscalls()[1]["pivot_root"], b".", b"oldroot"), "pivot_root")
+    os.chdir("/")
+
+    for path in spec["binds"]:
+        source = "/oldroot" + path
+        if os.path.islink(source):
+            os.symlink(os.readlink(source), path)  # e.g. /bin -> usr/bin
+        elif os.path.isdir(source):
+            os.makedirs(path)
+            bind(source, path)
+
+    os.mkdir(WORKDIR)
+    bind("/oldroot" + spec["cwd"], WORKDIR, MS_NOSUID | MS_NODEV)
+
+    os.mkdir("/proc")
+    mount("proc", "/proc", "proc", MS_NOSUID | MS_NODEV | MS_NOEXEC)
+    os.mkdir("/tmp")
+    mount("tmpfs", "/tmp", "tmpfs", MS_NOSUID | MS_NODEV, TMP_SIZE)
+
+    os.mkdir("/dev")
+    for name in DEVICES:
+        open("/dev/" + name, "w").close()
+        bind("/oldroot/dev/" + name, "/dev/" + name, MS_NOSUID | MS_NOEXEC)
+    for name, target in (("fd", "/proc/self/fd"), ("stdin", "/proc/self/fd/0"),
+                         ("stdout", "/proc/self/fd/1"), ("stderr", "/proc/self/fd/2")):
+        os.symlink(target, "/dev/" + name)
+
+    check(libc.umount2(b"/oldroot", MNT_DETACH), "umount /oldroot")
+    os.rmdir("/oldroot")
+    mount(None, "/", flags=MS_REMOUNT | MS_RDONLY | MS_NOSUID | MS_NODEV)
+
+
+def chown_tree(root, uid, gid):
+    # lchown: the program may have left symlinks pointing anywhere
+    os.lchown(root, uid, gid)
+    for parent, dirs, files in os.walk(root):
+        for name in dirs + files:
+            os.lchown(os.path.join(parent, name), uid, gid)
+
+
+# --- PROGRAM (runs as the sandbox uid) ---
+def seccomp_filter():
+    arch, numbers = syscalls()
+    ld, jeq, jset, ret = 0x20, 0x15, 0x45, 0x06
+    allow, kill = 0x7FFF0000, 0x80000000
+    eperm, enosys = 0x00050000 | 1, 0x00050000 | 38
+
+    prog = [
+        (ld, 0, 0, 4),            # seccomp_data.arch
+        (jeq, 1, 0, arch),
+        (ret, 0, 0, kill),
+        (ld, 0, 0, 0),            # seccomp_data.nr
+    ]
+    if arch == SYSCALLS["x86_64"][0]:
+        prog += [(0x35, 0, 1, 0x40000000), (ret, 0, 0, kill)]   # no x32 syscalls
+    prog += [
+        (jeq, 0, 4, numbers["clone"]),
+        (ld, 0, 0, 16),           # clone flags (low word of args[0])
+        (jset, 0, 1, NAMESPACE_FLAGS),
+        (ret, 0, 0, eperm),
+        (ret, 0, 0, allow),
+        (jeq, 0, 1, numbers["clone3"]),
+        (ret, 0, 0, enosys),
+    ]
+    for name, nr in numbers.items():
+        if name not in ("clone", "clone3"):
+            prog += [(jeq, 0, 1, nr), (ret, 0, 0, eperm)]
+    prog.append((ret, 0, 0, allow))
+
+    raw = b"".join(struct.pack("HBBI", *insn) for insn in prog)
+    buf = ctypes.create_string_buffer(raw, len(raw))
+
+    class SockFprog(ctypes.Structure):
+        _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.c_void_p)]
+
+    return SockFprog(len(prog), ctypes.addressof(buf)), buf
+
+
+def limit(which, value, hard=None):
+    if value is not None:
+        resource.setrlimit(which, (value, hard if hard is not None else value))
+
+
+def run_program(spec):
+    cpu = spec.get("cpu")
+    # SIGXCPU at the soft limit, SIGKILL a second later if it's ignored
+    limit(resource.RLIMIT_CPU, cpu, cpu + 1 if cpu is not None else None)
+    limit(resource.RLIMIT_AS, spec.get("memory"))
+    limit(resource.RLIMIT_FSIZE, spec.get("fsize"))
+    limit(resource.RLIMIT_NOFILE, spec.get("nofile"))
+    limit(resource.RLIMIT_NPROC, spec["nproc"])
+    limit(resource.RLIMIT_CORE, 0)
+
+    os.setgroups([])
+    os.setresgid(spec["gid"], spec["gid"], spec["gid"])
+    os.setresuid(spec["uid"], spec["uid"], spec["uid"])
+    prog, _buf = seccomp_filter()
+    check(libc.prctl(PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0), "no_new_privs")
+    check(libc.prctl(PR_SET_SECCOMP, SECCOMP_MODE_FILTER, ctypes.byref(prog), 0, 0), "seccomp")
+
+    os.chdir(WORKDIR)
+    env = {"PATH": SAFE_PATH, "HOME": WORKDIR, "LANG": "C.UTF-8"}
+    try:
+        os.execve(which(spec["argv"][0]), spec["argv"], env)
+    except OSError as e:
+        os.write(2, f"sandbox: cannot run {spec['argv'][0]}: {e.strerror}\n".encode())
+        os._exit(127)
+
+
+def which(name):
+    # os.execvpe would import modules the new root can't see
+    if "/" in name:
+        return name
+    for directory in SAFE_PATH.split(":"):
+        path = os.path.join(directory, name)
+        if os.access(path, os.X_OK):
+            return path
+    return name
+
+
+def init(spec, status_fd):
+    """pid 1 of the namespace: set up the root, run the program, report how it ended."""
+    libc.prctl(PR_SET_PDEATHSIG, signal.SIGKILL, 0, 0, 0)
+    try:
+        build_root(spec)
+        chown_tree(WORKDIR, spec["uid"], spec["gid"])
+    except (SetupError, OSError) as e:
+        os.write(2, f"sandbox: isolation failed: {e}\n".encode())
+        os._exit(SETUP_FAILED)
+    os.write(status_fd, b"R")  # /work is ours now; the launcher hands it back
+
+    started = time.monotonic()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_program(spec)
+        except (SetupError, OSError) as e:
+            os.write(2, f"sandbox: isolation failed: {e}\n".encode())
+        os._exit(SETUP_FAILED)
+
+    # Reap everything (orphans get reparented to us) until the program ends
+    while True:
+        reaped, status = os.waitpid(-1, 0)
+        if reaped == pid:
+            break
+    wall = time.monotonic() - started
+    # Everything reaped so far: the program and whatever it (or we) waited for
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    os.write(status_fd, f"{status} {usage.ru_utime + usage.ru_stime:.3f} {wall:.3f}".encode())
+    os._exit(0)  # the kernel kills whatever the program left running
+
+
+def write_report(spec, usage):
+    # The program could have left anything in /work, so never follow or reuse
+    # an existing name; the executor picks a random one per run
+    name = os.path.basename(spec["report"])
+    try:
+        fd = os.open(os.path.join(WORKDIR, name), os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+    except OSError:
+        return
+    try:
+        os.fchown(fd, *spec["owner"])
+        os.write(fd, json.dumps(usage).encode())
+    finally:
+        os.close(fd)
+
+
+def main():
+    try:
+        isolate()
+    except (SetupError, OSError) as e:
+        os.write(2, f"sandbox: isolation failed: {e}\n".encode())
+        os._exit(SETUP_FAILED)
+    spec = read_spec()
+
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        init(spec, write_end)
+    os.close(write_end)
+
+    # The executor stops a run with SIGTERM (it may not be allowed to signal
+    # root processes directly): take the namespace down, then clean up.
+    stopped = []
+
+    def stop(signum, frame):
+        stopped.append(signum)
+        os.kill(pid, signal.SIGKILL)
+
+    signal.signal(signal.SIGTERM, stop)
+    os.waitpid(pid, 0)
+
+    report = b""
+    while chunk := os.read(read_end, 64):
+        report += chunk
+    if report.startswith(b"R"):
+        # init pivoted our root too, so /work is the job's directory
+        chown_tree(WORKDIR, *spec["owner"])
+    if stopped:
+        os.kill(os.getpid(), signal.SIGKILL)
+    if len(report) < 2:
+        os._exit(SETUP_FAILED)  # init already said why
+
+    status, cpu, wall = report[1:].split()
+    if spec.get("report"):
+        write_report(spec, {"cpu": float(cpu), "wall": float(wall)})
+
+    status = int(status)
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        signal.signal(sig, signal.SIG_DFL)
+        os.kill(os.getpid(), sig)
+    os._exit(os.WEXITSTATUS(status) if os.WIFEXITED(status) else SETUP_FAILED)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# cloudapp/session_buffer.py
+import asyncio
+import atexit
+from channels.db import database_sync_to_async
+from django.conf import settings
+from . import problem_store
+
+# Write-behind buffer for CollaborationSession updates coming off the
+# websocket. Keeps only the latest value per column per room token and
+# writes them with one UPDATE ... WHERE token= after the flush interval, when
+# the last local member leaves, or at process exit.
+
+_pending = {}   # token -> {column: value}
+_timers = {}    # token -> asyncio.TimerHandle
+
+_stats = {
+    "queued": 0,      # updates handed to the buffer
+    "coalesced": 0,   # updates that never hit the DB on their own
+    "flushes": 0,     # UPDATE statements issued
+    "failed": 0,      # flushes that raised and were re-queued
+}
+
+
+def _write(token, fields):
+    from .models import CollaborationSession
+    if "problem_data" in fields:
+        fields = dict(fields, problem_data=problem_store.pack_problem(fields["problem_data"]))
+    rows = CollaborationSession.objects.filter(token=token)
+    if "revision" in fields:
+        # Other processes write the same room; never move the code backwards
+        document = {key: fields.pop(key) for key in ("code", "revision") if key in fields}
+        rows.filter(revision__lte=document["revision"]).update(**document)
+    if fields:
+        rows.update(**fields)
+
+
+def queue_update(token, **fields):
+    """Record the latest values for a session and schedule a flush."""
+    fields = {k: v for k, v in fields.items() if v is not None}
+    if not fields:
+        return
+
+    _stats["queued"] += 1
+    pending = _pending.setdefault(token, {})
+    if pending:
+        _stats["coalesced"] += 1
+    pending.update(fields)
+    _schedule(token)
+
+
+def _schedule(token):
+    if token not in _timers:
+        loop = asyncio.get_running_loop()
+        _timers[token] = loop.call_later(
+            settings.SESSION_FLUSH_INTERVAL,
+            lambda: asyncio.ensure_future(flush(token)),
+        )
+
+
+def pending_fields(token):
+    """Values queued for a session but not yet written."""
+    return dict(_pending.get(token, {}))
+
+
+async def flush(token):
+    timer = _timers.pop(token, None)
+    if timer is not None:
+        timer.cancel()
+
+    fields = _pending.pop(token, None)
+    if not fields:
+        return
+
+    try:
+        await database_sync_to_async(_write)(token, fields)
+        _stats["flushes"] += 1
+    except Exception as e:
+        print(f"Session flush failed for {token}: {e}")
+        _stats["failed"] += 1
+        # Put the values back unless something newer arrived meanwhile
+        pending = _pending.setdefault(token, {})
+        for key, value in fields.items():
+            pending.setdefault(key, value)
+        _schedule(token)
+
+
+def get_stats():
+    return dict(_stats, pending_rooms=len(_pending))
+
+
+@atexit.register
+def _flush_on_exit():
+    # The event loop is gone by now, so write synchronously
+    for token in list(_pending):
+        fields = _pending.pop(token)
+        try:
+            _write(token, fields)
+            _stats["flushes"] += 1
+        except Exception as e:
+            print(f"Session flush failed for {token} at shutdown: {e}")
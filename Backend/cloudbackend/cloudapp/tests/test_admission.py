@@ -0,0 +1,141 @@
+import asyncio
+from unittest import mock
+from django.test import SimpleTestCase
+from cloudapp import admission
+
+
+def controller(limit=2, per_user=1, max_queue=4, timeout=5):
+    return admission.AdmissionController(limit=limit, per_user=per_user, max_queue=max_queue, timeout=timeout)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class AdmissionTests(SimpleTestCase):
+
+    def test_caps_and_fifo_wakeup(self):
+        limiter = controller(limit=2, per_user=2)
+
+        async def run():
+            order = []
+
+            async def call(user_id, name):
+                await limiter.acquire(user_id)
+                order.append(name)
+
+            await limiter.acquire(1)
+            await limiter.acquire(2)
+            tasks = [asyncio.ensure_future(call(3, "first")), asyncio.ensure_future(call(4, "second"))]
+            await settle()
+            self.assertEqual((limiter.active, len(limiter.waiters), order), (2, 2, []))
+
+            limiter.release(1)
+            await settle()
+            self.assertEqual(order, ["first"])
+            limiter.release(2)
+            await asyncio.gather(*tasks)
+            return order
+
+        self.assertEqual(asyncio.run(run()), ["first", "second"])
+        self.assertEqual(limiter.active_by_user, {3: 1, 4: 1})
+
+    def test_waiter_at_their_user_cap_is_skipped(self):
+        limiter = controller(limit=2, per_user=1)
+
+        async def run():
+            await limiter.acquire(1)
+            await limiter.acquire(2)
+            same_user = asyncio.ensure_future(limiter.acquire(1))
+            other_user = asyncio.ensure_future(limiter.acquire(3))
+            await settle()
+            limiter.release(2)   # user 1 still holds their one slot
+            await settle()
+            return same_user.done(), other_user.done()
+
+        self.assertEqual(asyncio.run(run()), (False, True))
+
+    def test_newcomer_with_room_is_admitted_past_a_capped_waiter(self):
+        limiter = controller(limit=2, per_user=1)
+
+        async def run():
+            await limiter.acquire(1)
+            waiting = asyncio.ensure_future(limiter.acquire(1))
+            await settle()
+            await asyncio.wait_for(limiter.acquire(2), timeout=1)
+            waiting.cancel()
+            await asyncio.gather(waiting, return_exceptions=True)
+
+        asyncio.run(run())
+        self.assertEqual(limiter.active_by_user, {1: 1, 2: 1})
+        self.assertEqual(len(limiter.waiters), 0)
+
+    def test_full_queue_rejects(self):
+        limiter = controller(limit=1, max_queue=1)
+
+        async def run():
+            await limiter.acquire(1)
+            waiting = asyncio.ensure_future(limiter.acquire(2))
+            await settle()
+            with self.assertRaises(admission.Rejected) as caught:
+                await limiter.acquire(3)
+            waiting.cancel()
+            await asyncio.gather(waiting, return_exceptions=True)
+            return caught.exception.reason
+
+        self.assertEqual(asyncio.run(run()), "queue_full")
+        self.assertEqual(limiter.get_stats()["rejected_full"], 1)
+
+    def test_deadline_rejects_and_leaves_the_queue(self):
+        limiter = controller(limit=1, timeout=0.01)
+
+        async def run():
+            await limiter.acquire(1)
+            with self.assertRaises(admission.Rejected) as caught:
+                await limiter.acquire(2)
+            return caught.exception.reason
+
+        self.assertEqual(asyncio.run(run()), "timeout")
+        stats = limiter.get_stats()
+        self.assertEqual((stats["timeouts"], stats["queue_depth"], stats["active"]), (1, 0, 1))
+
+    def test_cancelled_after_admission_hands_the_slot_on(self):
+        limiter = controller(limit=1)
+
+        async def run():
+            await limiter.acquire(1)
+            first = asyncio.ensure_future(limiter.acquire(2))
+            second = asyncio.ensure_future(limiter.acquire(3))
+            await settle()
+            # The slot goes to the first waiter, which is cancelled before it runs
+            limiter.release(1)
+            first.cancel()
+            await asyncio.gather(first, return_exceptions=True)
+            if not first.cancelled():
+                # Before 3.12 wait_for() returns the result instead when the
+                # two race; the caller then owns the slot and releases it
+                limiter.release(2)
+            await asyncio.wait_for(second, timeout=1)
+
+        asyncio.run(run())
+        self.assertEqual((limiter.active, limiter.active_by_user), (1, {3: 1}))
+
+    def test_slot_releases_on_error(self):
+        limiter = controller()
+
+        async def run():
+            with self.assertRaises(ValueError):
+                async with limiter.slot(1):
+                    self.assertEqual(limiter.active, 1)
+                    raise ValueError
+
+        asyncio.run(run())
+        self.assertEqual((limiter.active, limiter.active_by_user), (0, {}))
+
+    def test_backoff_delay_is_jittered_under_the_cap(self):
+        with mock.patch.object(admission.random, "uniform", side_effect=lambda low, high: high):
+            delays = [admission.backoff_delay(attempt, 0.5, 4) for attempt in range(6)]
+        self.assertEqual(delays, [0.5, 1, 2, 4, 4, 4])
+        for attempt in range(6):
+            self.assertTrue(0 <= admission.backoff_delay(attempt, 0.5, 4) <= 4)
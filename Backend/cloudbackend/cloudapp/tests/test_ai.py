@@ -0,0 +1,189 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from google.genai import errors
+from cloudapp import admission, ai
+
+
+def api_error(code):
+    return errors.APIError(code, {"error": {"message": "upstream", "status": "UNAVAILABLE"}})
+
+
+class FakeModels:
+    """Stands in for client.aio.models: answers from a script, one entry per call."""
+
+    def __init__(self, answers):
+        self.answers = list(answers)   # text, list of chunks, or an exception
+        self.calls = 0
+        self.gate = None               # asyncio.Event each call waits on, when set
+        self.closed = []
+
+    async def _next(self):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    async def generate_content(self, model, contents, config=None):
+        return SimpleNamespace(text=await self._next())
+
+    async def generate_content_stream(self, model, contents):
+        # Like the SDK: nothing is requested until the stream is iterated
+        return FakeStream(self)
+
+
+class FakeStream:
+
+    def __init__(self, models):
+        self.models = models
+        self._chunks = self._iterate()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._chunks.__anext__()
+
+    async def _iterate(self):
+        for text in await self.models._next():
+            await asyncio.sleep(0)
+            yield SimpleNamespace(text=text)
+
+    async def aclose(self):
+        self.models.closed.append(True)
+        await self._chunks.aclose()
+
+
+@override_settings(AI_RETRIES=2, AI_RETRY_BASE=0.01, AI_RETRY_CAP=0.02)
+class AiTests(SimpleTestCase):
+
+    def setUp(self):
+        self.addCleanup(ai._responses.clear)
+        self.addCleanup(ai._inflight.clear)
+        limiter = admission.AdmissionController(limit=8, per_user=4, max_queue=8, timeout=5)
+        patcher = mock.patch.object(ai, "limiter", limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use(self, *answers):
+        self.models = FakeModels(answers)
+        client = SimpleNamespace(aio=SimpleNamespace(models=self.models))
+        patcher = mock.patch.object(ai, "get_async_client", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return self.models
+
+    def generate(self, prompt="sort it", code="x = 1"):
+        return ai.generate_code(prompt, code, "python", None, user_id=1)
+
+    def test_identical_requests_in_flight_share_one_call(self):
+        models = self.use("x = 2")
+
+        async def run():
+            models.gate = asyncio.Event()
+            tasks = [asyncio.ensure_future(self.generate()) for _ in range(4)]
+            await asyncio.sleep(0.01)
+            models.gate.set()
+            return await asyncio.gather(*tasks)
+
+        self.assertEqual(asyncio.run(run()), ["x = 2"] * 4)
+        self.assertEqual(models.calls, 1)
+
+    def test_cancelled_leader_hands_over_to_a_waiter(self):
+        models = self.use("x = 2")
+
+        async def run():
+            models.gate = asyncio.Event()
+            leader = asyncio.ensure_future(self.generate())
+            await asyncio.sleep(0.01)
+            waiter = asyncio.ensure_future(self.generate())
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            await asyncio.sleep(0.01)
+            models.gate.set()
+            return await waiter
+
+        self.assertEqual(asyncio.run(run()), "x = 2")
+        self.assertEqual(models.calls, 2)   # the waiter made its own call
+
+    def test_retries_on_429_and_503(self):
+        models = self.use(api_error(429), api_error(503), "x = 2")
+        with mock.patch.object(ai.asyncio, "sleep", wraps=asyncio.sleep) as sleep:
+            self.assertEqual(asyncio.run(self.generate()), "x = 2")
+        self.assertEqual(models.calls, 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertTrue(all(0 <= call.args[0] <= 0.02 for call in sleep.call_args_list))
+
+    def test_gives_up_after_the_retry_budget(self):
+        models = self.use(*[api_error(503)] * 3)
+        with self.assertRaises(errors.APIError):
+            asyncio.run(self.generate())
+        self.assertEqual(models.calls, 3)   # first try + AI_RETRIES
+
+    def test_other_errors_are_not_retried(self):
+        models = self.use(api_error(400), "unused")
+        with self.assertRaises(errors.APIError):
+            asyncio.run(self.generate())
+        self.assertEqual(models.calls, 1)
+
+    def test_stream_is_relayed_and_cached_when_complete(self):
+        models = self.use(["```\n", "x = ", "2\n", "```"])
+
+        async def run():
+            chunks = [text async for text in ai.stream_code("p", "c", "python", None)]
+            cached = [text async for text in ai.stream_code("p", "c", "python", None)]
+            return chunks, cached
+
+        chunks, cached = asyncio.run(run())
+        self.assertEqual(chunks, ["```\n", "x = ", "2\n", "```"])
+        self.assertEqual(cached, ["x = 2"])
+        self.assertEqual((models.calls, models.closed), (1, [True]))
+
+    def test_stream_retries_until_the_first_chunk(self):
+        models = self.use(api_error(503), api_error(429), ["x = ", "2"])
+
+        async def run():
+            return [text async for text in ai.stream_code("p", "c", "python", None)]
+
+        self.assertEqual(asyncio.run(run()), ["x = ", "2"])
+        self.assertEqual(models.calls, 3)
+        self.assertEqual(models.closed, [True] * 3)   # the failed attempts' streams too
+
+    def test_stream_gives_up_after_the_retry_budget(self):
+        models = self.use(*[api_error(503)] * 3)
+
+        async def run():
+            return [text async for text in ai.stream_code("p", "c", "python", None)]
+
+        with self.assertRaises(errors.APIError):
+            asyncio.run(run())
+        self.assertEqual(models.calls, 3)
+        self.assertEqual(ai.limiter.active, 0)
+
+    def test_cancelled_stream_closes_upstream_and_isnt_cached(self):
+        models = self.use(["a", "b", "c", "d"])
+
+        async def run():
+            received = []
+
+            async def consume():
+                async for text in ai.stream_code("p", "c", "python", None, user_id=1):
+                    received.append(text)
+                    if len(received) == 2:
+                        await asyncio.sleep(10)   # the requester goes quiet
+
+            task = asyncio.ensure_future(consume())
+            while len(received) < 2:
+                await asyncio.sleep(0)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return received
+
+        self.assertEqual(asyncio.run(run()), ["a", "b"])
+        self.assertEqual(models.closed, [True])
+        self.assertEqual(ai._responses, {})
+        self.assertEqual(ai.limiter.active, 0)   # the admission slot was given back
@@ -0,0 +1,80 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from cloudapp import admission, ai
+from cloudapp.tests.test_ai import FakeModels
+
+
+class ResponseCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.addCleanup(ai._responses.clear)
+        limiter = admission.AdmissionController(limit=8, per_user=4, max_queue=8, timeout=5)
+        patcher = mock.patch.object(ai, "limiter", limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use(self, *answers):
+        models = FakeModels(answers)
+        client = SimpleNamespace(aio=SimpleNamespace(models=models))
+        patcher = mock.patch.object(ai, "get_async_client", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return models
+
+    def generate(self, prompt="sort it", code="x = 1"):
+        return ai.generate_code(prompt, code, "python", None, user_id=1)
+
+    def test_answers_are_cached_per_request(self):
+        models = self.use("```python\nx = 2\n```", "y = 3")
+
+        async def run():
+            first = await self.generate()
+            again = await self.generate()
+            other = await self.generate(code="x = 5")
+            return first, again, other
+
+        self.assertEqual(asyncio.run(run()), ("x = 2", "x = 2", "y = 3"))
+        self.assertEqual(models.calls, 2)
+
+    def test_cached_answer_expires(self):
+        models = self.use("a", "b")
+        asyncio.run(self.generate())
+        with mock.patch.object(ai.time, "monotonic", return_value=ai.time.monotonic() + 3600):
+            self.assertEqual(asyncio.run(self.generate()), "b")
+        self.assertEqual(models.calls, 2)
+
+    @override_settings(AI_CACHE_MAX=2)
+    def test_least_recently_used_answer_is_evicted(self):
+        models = self.use("a", "b", "c", "a again")
+
+        async def run():
+            await self.generate(code="1")
+            await self.generate(code="2")
+            await self.generate(code="1")   # "2" is now the oldest
+            await self.generate(code="3")
+            return await self.generate(code="1"), await self.generate(code="2")
+
+        self.assertEqual(asyncio.run(run()), ("a", "a again"))
+        self.assertEqual(models.calls, 4)
+
+
+class SharedClientTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(ai, "_new_client", side_effect=lambda: object())
+        self.new_client = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_one_client_per_event_loop(self):
+        async def clients():
+            first = ai.get_async_client()
+            await asyncio.sleep(0)
+            return first, ai.get_async_client()
+
+        first, second = asyncio.run(clients())
+        self.assertIs(first, second)
+        other, _ = asyncio.run(clients())
+        self.assertIsNot(other, first)
+        self.assertEqual(self.new_client.call_count, 2)
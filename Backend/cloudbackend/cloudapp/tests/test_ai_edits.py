@@ -0,0 +1,63 @@
+import json
+from django.test import SimpleTestCase
+from cloudapp import ai_edits, ot
+
+CODE = """def add(a, b):
+    return a + b
+
+
+def main():
+    print(add(1, 2))
+"""
+
+
+def edit(find, replace):
+    return {"find": find, "replace": replace}
+
+
+class ParseEditsTests(SimpleTestCase):
+
+    def test_list_object_and_fenced_answers(self):
+        edits = [edit("a + b", "a - b")]
+        self.assertEqual(ai_edits.parse_edits(json.dumps(edits)), edits)
+        self.assertEqual(ai_edits.parse_edits(json.dumps({"edits": edits})), edits)
+        self.assertEqual(ai_edits.parse_edits("```json\n" + json.dumps(edits) + "\n```"), edits)
+        self.assertEqual(ai_edits.parse_edits("[]"), [])
+
+    def test_malformed_answers(self):
+        for answer in ("not json", '{"find": "a"}', '[{"find": "a"}]', '[{"find": 1, "replace": ""}]',
+                       '[{"find": "", "replace": "x"}]', '"text"'):
+            with self.subTest(answer=answer), self.assertRaises(ai_edits.PatchError):
+                ai_edits.parse_edits(answer)
+
+
+class EditsToOpsTests(SimpleTestCase):
+
+    def apply(self, edits):
+        return ot.apply_ops(CODE, ai_edits.edits_to_ops(CODE, edits))
+
+    def test_edits_apply_to_the_code(self):
+        edits = [edit("print(add(1, 2))", "print(add(3, 4))"), edit("a + b", "a - b")]
+        self.assertEqual(self.apply(edits), CODE.replace("a + b", "a - b").replace("1, 2", "3, 4"))
+
+    def test_only_the_changed_characters_are_touched(self):
+        ops = ai_edits.edits_to_ops(CODE, [edit("return a + b", "return a - b")])
+        pos = CODE.index("+")
+        self.assertEqual(ops, [{"op": "delete", "pos": pos, "length": 1},
+                               {"op": "insert", "pos": pos, "text": "-"}])
+
+    def test_pure_insert_and_delete(self):
+        self.assertEqual(self.apply([edit("def main():\n", "def main():\n    # entry\n")]),
+                         CODE.replace("def main():\n", "def main():\n    # entry\n"))
+        self.assertEqual(self.apply([edit("\n\n\ndef main", "\n\ndef main")]), CODE.replace("\n\n\n", "\n\n"))
+        self.assertEqual(ai_edits.edits_to_ops(CODE, [edit("a + b", "a + b")]), [])
+
+    def test_unappliable_edits(self):
+        cases = {
+            "not found": [edit("a * b", "a")],
+            "ambiguous": [edit("add(", "plus(")],
+            "overlap": [edit("return a + b", "pass"), edit("a + b\n", "0\n")],
+        }
+        for name, edits in cases.items():
+            with self.subTest(name), self.assertRaises(ai_edits.PatchError):
+                ai_edits.edits_to_ops(CODE, edits)
@@ -0,0 +1,164 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+from django.test import SimpleTestCase
+from server import codeforces_playwright
+from server.codeforces_playwright import BrowserPool, PoolTimeout
+
+
+class StubBrowser:
+
+    def __init__(self):
+        self.connected = True
+        self.closed = False
+
+    def is_connected(self):
+        return self.connected and not self.closed
+
+    async def close(self):
+        self.closed = True
+
+    async def new_context(self):
+        return StubContext(self)
+
+
+class StubContext:
+
+    def __init__(self, browser):
+        self.browser = browser
+
+    async def new_page(self):
+        return self.browser    # the page fn sees which browser it ran on
+
+    async def close(self):
+        pass
+
+
+class StubPlaywright:
+    """async_playwright().start() result: firefox.launch() hands out StubBrowsers."""
+
+    def __init__(self):
+        self.firefox = self
+        self.browsers = []
+        self.hang = False
+        self.fail = False
+
+    async def launch(self, headless):
+        if self.hang:
+            await asyncio.sleep(10)
+        if self.fail:
+            raise RuntimeError("firefox crashed")
+        browser = StubBrowser()
+        self.browsers.append(browser)
+        return browser
+
+    async def stop(self):
+        pass
+
+
+class BrowserPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.playwright = StubPlaywright()
+        starter = SimpleNamespace(start=mock.AsyncMock(return_value=self.playwright))
+        patcher = mock.patch.object(codeforces_playwright, "async_playwright", return_value=starter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_browsers_are_launched_once_and_reused(self):
+        async def run():
+            pool = BrowserPool(size=2, max_pages=50)
+            await pool.start()
+            used = [await pool.run(lambda page: asyncio.sleep(0, page)) for _ in range(5)]
+            await pool.close()
+            return pool, used
+
+        pool, used = asyncio.run(run())
+        self.assertEqual(pool.stats["launches"], 2)
+        self.assertTrue(set(used) <= set(self.playwright.browsers))
+        self.assertTrue(all(browser.closed for browser in self.playwright.browsers))
+
+    def test_recycled_browser_is_replaced_for_waiting_requests(self):
+        async def run():
+            pool = BrowserPool(size=1, max_pages=1)
+
+            async def job(n):
+                async def use(page):
+                    await asyncio.sleep(0.01)
+                    return n
+                return await pool.run(use, timeout=1)
+
+            results = await asyncio.gather(*(job(n) for n in range(3)))
+            await pool.close()
+            return pool, results
+
+        pool, results = asyncio.run(run())
+        self.assertEqual(results, [0, 1, 2])
+        self.assertEqual((pool.stats["launches"], pool.stats["recycled"]), (3, 3))
+        self.assertTrue(all(browser.closed for browser in self.playwright.browsers))
+
+    def test_unhealthy_browser_is_replaced_on_checkout(self):
+        async def run():
+            pool = BrowserPool(size=1)
+            await pool.start()
+            self.playwright.browsers[0].connected = False
+            used = await pool.run(lambda page: asyncio.sleep(0, page))
+            await pool.close()
+            return pool, used
+
+        pool, used = asyncio.run(run())
+        self.assertEqual(pool.stats["unhealthy"], 1)
+        self.assertIs(used, self.playwright.browsers[1])
+        self.assertTrue(self.playwright.browsers[0].closed)
+
+    def test_failed_relaunch_gives_the_slot_back(self):
+        async def run():
+            pool = BrowserPool(size=1)
+            await pool.start()
+            self.playwright.browsers[0].connected = False
+            self.playwright.fail = True
+            with self.assertRaises(RuntimeError):
+                await pool.run(lambda page: asyncio.sleep(0, page))
+            self.playwright.fail = False
+            await pool.run(lambda page: asyncio.sleep(0, page))
+            await pool.close()
+            return pool
+
+        pool = asyncio.run(run())
+        self.assertEqual(pool.stats["launches"], 3)
+
+    def test_waiting_past_the_deadline(self):
+        async def run():
+            pool = BrowserPool(size=1)
+            gate = asyncio.Event()
+
+            async def hold(page):
+                await gate.wait()
+
+            holder = asyncio.ensure_future(pool.run(hold))
+            await asyncio.sleep(0.01)
+            with self.assertRaises(PoolTimeout):
+                await pool.run(lambda page: asyncio.sleep(0, page), timeout=0.05)
+            gate.set()
+            await holder
+            await pool.close()
+            return pool
+
+        pool = asyncio.run(run())
+        self.assertEqual(pool.stats["timeouts"], 1)
+        self.assertEqual(pool._waiting, 0)
+
+    def test_hung_launch_counts_against_the_deadline(self):
+        async def run():
+            pool = BrowserPool(size=1)
+            self.playwright.hang = True
+            with self.assertRaises(PoolTimeout):
+                await pool.run(lambda page: asyncio.sleep(0, page), timeout=0.05)
+            self.playwright.hang = False
+            used = await pool.run(lambda page: asyncio.sleep(0, page), timeout=1)
+            await pool.close()
+            return pool, used
+
+        pool, used = asyncio.run(run())
+        self.assertEqual(pool.stats["timeouts"], 1)
+        self.assertIs(used, self.playwright.browsers[0])
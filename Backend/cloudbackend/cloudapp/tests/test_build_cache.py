@@ -0,0 +1,112 @@
+import asyncio
+import os
+import tempfile
+import time
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from cloudapp import build_cache, executor
+
+RESULT = {"stdout": "", "stderr": "warning: x", "output": "", "code": 0, "signal": None,
+          "time": 1.5, "timed_out": False, "truncated": False}
+
+
+class BuildCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = os.path.join(tmp.name, "builds")
+        self.tmp = tmp.name
+        settings = override_settings(EXECUTION_BUILD_CACHE_DIR=self.root, EXECUTION_BUILD_CACHE_MB=1)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for name in ("_index", "_root_ok"):
+            patcher = mock.patch.object(build_cache, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def workdir(self, **files):
+        path = tempfile.mkdtemp(dir=self.tmp)
+        for name, content in files.items():
+            with open(os.path.join(path, name), "wb") as f:
+                f.write(content)
+        return path
+
+    def store(self, key, content=b"binary"):
+        build_cache.store(key, self.workdir(main=content, **{"main.cpp": b"src"}), ["main"], RESULT)
+
+    def test_hit_restores_artifacts_and_result(self):
+        self.store("k")
+        workdir = self.workdir()
+        self.assertEqual(build_cache.restore("k", workdir), dict(RESULT, cached=True))
+        with open(os.path.join(workdir, "main"), "rb") as f:
+            self.assertEqual(f.read(), b"binary")
+        self.assertEqual(os.listdir(workdir), ["main"])   # only the artifacts
+
+    def test_miss(self):
+        self.assertIsNone(build_cache.restore("nothing", self.workdir()))
+
+    def test_tampered_artifact_is_dropped(self):
+        self.store("k")
+        with open(os.path.join(self.root, "k", "main"), "wb") as f:
+            f.write(b"evil")
+        corrupt = build_cache.get_stats()["corrupt"]
+
+        workdir = self.workdir()
+        self.assertIsNone(build_cache.restore("k", workdir))
+        self.assertEqual(os.listdir(workdir), [])
+        self.assertFalse(os.path.exists(os.path.join(self.root, "k")))
+        self.assertEqual(build_cache.get_stats()["corrupt"], corrupt + 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        big = b"x" * (400 * 1024)
+        self.store("a", big)
+        self.store("b", big)
+        now = time.time()
+        os.utime(os.path.join(self.root, "a"), (now - 100, now - 100))
+        os.utime(os.path.join(self.root, "b"), (now - 50, now - 50))
+        self.assertIsNotNone(build_cache.restore("a", self.workdir()))   # "b" is now the oldest
+
+        self.store("c", big)
+        self.assertEqual(sorted(os.listdir(self.root)), ["a", "c"])
+        self.assertEqual(build_cache.get_stats()["entries"], 2)
+
+    def test_shared_root_is_not_used(self):
+        os.makedirs(self.root, mode=0o755)
+        os.chmod(self.root, 0o755)
+        self.store("k")
+        self.assertEqual(os.listdir(self.root), [])
+        self.assertIsNone(build_cache.restore("k", self.workdir()))
+
+    def test_executor_build_compiles_once(self):
+        compiles = []
+
+        async def compile_in(language, config, values, workdir, on_output=None):
+            compiles.append(workdir)
+            with open(os.path.join(workdir, "main"), "wb") as f:
+                f.write(b"binary")
+            return dict(RESULT)
+
+        async def build(code, output):
+            workdir = self.workdir()
+            config, values = executor.prepare("cpp", code, workdir)
+
+            async def on_output(stream, text):
+                output.append((stream, text))
+
+            return await executor.build("cpp", code, config, values, workdir, on_output)
+
+        async def go():
+            output = []
+            with mock.patch.object(executor, "compile_in", compile_in):
+                first = await build("int main(){}", [])
+                second = await build("int main(){}", output)
+                other = await build("int main(){return 0;}", [])
+            return first, second, other, output
+
+        first, second, other, output = asyncio.run(go())
+        self.assertEqual(len(compiles), 2)
+        self.assertNotIn("cached", first)
+        self.assertTrue(second["cached"])
+        self.assertNotIn("cached", other)
+        self.assertEqual(output, [("stderr", "warning: x")])   # warnings replayed
@@ -0,0 +1,199 @@
+import asyncio
+from collections import Counter
+from unittest import mock
+from channels.layers import InMemoryChannelLayer
+from django.test import SimpleTestCase, override_settings
+from cloudapp import channel_layers, room_sync
+
+URLS = ["redis://:secret@redis-a:6379/0", "redis://:secret@redis-b:6379/0", "redis://:secret@redis-c:6379/0"]
+
+
+def sharded(count=3):
+    return channel_layers.ShardedChannelLayer(shards=[{}] * count, backend="channels.layers.InMemoryChannelLayer")
+
+
+def redis_sharded():
+    # Never connects; only placement is used
+    return channel_layers.ShardedChannelLayer(shards=[{"hosts": [url]} for url in URLS])
+
+
+class HashRingTests(SimpleTestCase):
+
+    def test_keys_spread_over_every_node(self):
+        ring = channel_layers.HashRing(["a", "b", "c"])
+        counts = Counter(ring.index(f"editor_{n}") for n in range(3000))
+        self.assertEqual(set(counts), {0, 1, 2})
+        self.assertTrue(all(600 < count < 1400 for count in counts.values()), counts)
+
+    def test_adding_a_node_moves_only_its_share(self):
+        before = channel_layers.HashRing(["a", "b", "c"])
+        after = channel_layers.HashRing(["a", "b", "c", "d"])
+        keys = [f"editor_{n}" for n in range(3000)]
+        moved = [key for key in keys if before.index(key) != after.index(key)]
+        self.assertTrue(all(after.index(key) == 3 for key in moved))
+        self.assertLess(len(moved), len(keys) / 2)
+
+    def test_room_log_sits_with_the_room_group(self):
+        layer = redis_sharded()
+        self.assertEqual([shard.label for shard in layer.shards], ["0:redis-a", "1:redis-b", "2:redis-c"])
+        ring = channel_layers.url_ring(URLS)
+        for n in range(200):
+            group = f"editor_{n}"
+            self.assertEqual(ring.index(group), layer.shard_for(group).index)
+
+    @override_settings(ROOM_SYNC_REDIS_URLS=URLS)
+    def test_room_sync_uses_the_layer_placement(self):
+        room_sync._ring = None
+        self.addCleanup(setattr, room_sync, "_ring", None)
+        self.addCleanup(room_sync._clients.clear)
+        layer = redis_sharded()
+        for n in range(50):
+            room_sync._client(f"t{n}")
+            self.assertEqual(room_sync._ring.index(f"editor_t{n}"), layer.shard_for(f"editor_t{n}").index)
+
+
+class ShardedLayerTests(SimpleTestCase):
+
+    def test_group_messages_go_through_the_group_shard_only(self):
+        layer = sharded()
+
+        async def run():
+            channel = await layer.new_channel()
+            await layer.group_add("editor_room", channel)
+            await layer.group_send("editor_room", {"type": "edit", "n": 1})
+            return await asyncio.wait_for(layer.receive(channel), 1)
+
+        self.assertEqual(asyncio.run(run()), {"type": "edit", "n": 1})
+        shard = layer.shard_for("editor_room")
+        stats = {entry["shard"]: entry for entry in layer.get_stats()["shards"]}
+        self.assertEqual(stats[shard.label]["group_sends"], 1)
+        self.assertEqual(stats[shard.label]["local_groups"], 1)
+        self.assertEqual(sum(entry["group_sends"] for entry in stats.values()), 1)
+        self.assertEqual(sum(entry["received"] for entry in stats.values()), 1)
+
+    def test_receive_merges_every_shard_the_channel_listens_on(self):
+        layer = sharded()
+        # One group on each shard
+        groups = {}
+        for n in range(100):
+            groups.setdefault(layer.shard_for(f"editor_{n}").index, f"editor_{n}")
+
+        async def run():
+            channel = await layer.new_channel()
+            for group in groups.values():
+                await layer.group_add(group, channel)
+            await layer.send(channel, {"type": "direct"})
+            for group in groups.values():
+                await layer.group_send(group, {"type": "group", "group": group})
+            received = [await asyncio.wait_for(layer.receive(channel), 1) for _ in range(len(groups) + 1)]
+            inbox = layer._inboxes[channel]
+            return received, set(inbox.listeners)
+
+        received, listening = asyncio.run(run())
+        self.assertEqual(listening, {0, 1, 2})
+        self.assertEqual(Counter(message["type"] for message in received), {"direct": 1, "group": 3})
+        self.assertEqual(layer.get_stats()["local_channels"], 1)
+
+    def test_cancelled_receive_stops_listening(self):
+        layer = sharded()
+
+        async def run():
+            channel = await layer.new_channel()
+            await layer.group_add("editor_room", channel)
+            task = asyncio.ensure_future(layer.receive(channel))
+            await asyncio.sleep(0.01)
+            listeners = list(layer._inboxes[channel].listeners.values())
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await asyncio.sleep(0)
+            return channel, listeners
+
+        channel, listeners = asyncio.run(run())
+        self.assertNotIn(channel, layer._inboxes)
+        self.assertTrue(all(listener.cancelled() for listener in listeners))
+
+    def test_send_errors_are_counted_per_shard(self):
+        layer = sharded(count=2)
+        shard = layer.shard_for("editor_room")
+
+        async def broken(group, message):
+            raise ConnectionError("down")
+
+        shard.layer.group_send = broken
+        with self.assertRaises(ConnectionError):
+            asyncio.run(layer.group_send("editor_room", {"type": "edit"}))
+        self.assertEqual([entry["errors"] for entry in layer.get_stats()["shards"]],
+                         [1 if index == shard.index else 0 for index in range(2)])
+
+
+def hybrid_nodes(count=2, **options):
+    # Processes sharing one inner layer, as they would share Redis
+    inner = InMemoryChannelLayer()
+    nodes = [channel_layers.HybridChannelLayer(**options) for _ in range(count)]
+    for node in nodes:
+        node.inner = inner
+    return nodes
+
+
+class HybridLayerTests(SimpleTestCase):
+
+    def test_alone_in_a_room_after_discovery(self):
+        (layer,) = hybrid_nodes(1)
+
+        async def run():
+            channel = await layer.new_channel()
+            with mock.patch.object(channel_layers, "DISCOVERY_WINDOW", 0):
+                await layer.group_add("editor_room", channel)
+            await layer.group_send("editor_room", {"type": "edit"})
+            message = await asyncio.wait_for(layer.receive(channel), 1)
+            await layer.flush()
+            return message
+
+        self.assertEqual(asyncio.run(run()), {"type": "edit"})
+        stats = layer.get_stats()
+        self.assertEqual((stats["local_only"], stats["published"]), (1, 0))
+
+    def test_publishes_while_discovery_is_pending(self):
+        older, newer = hybrid_nodes()
+        answer = older._node_message
+
+        async def slow_to_answer(message):
+            # The older node's reply to the join is still on its way
+            if message["type"] != "hybrid.join":
+                await answer(message)
+
+        async def run():
+            there = await older.new_channel()
+            with mock.patch.object(channel_layers, "DISCOVERY_WINDOW", 0):
+                await older.group_add("editor_room", there)
+            here = await newer.new_channel()
+            await newer.group_add("editor_room", here)
+            await asyncio.sleep(0.01)
+            await newer.group_send("editor_room", {"type": "edit"})
+            received = await asyncio.wait_for(older.receive(there), 1), await asyncio.wait_for(newer.receive(here), 1)
+            remote = set(newer._remote["editor_room"])
+            for layer in (older, newer):
+                await layer.flush()
+            return received, remote
+
+        with mock.patch.object(older, "_node_message", slow_to_answer):
+            received, remote = asyncio.run(run())
+        self.assertEqual(received, ({"type": "edit"}, {"type": "edit"}))
+        self.assertEqual(remote, set())
+        self.assertEqual(newer.get_stats()["published"], 1)
+
+    def test_node_membership_is_refreshed(self):
+        (layer,) = hybrid_nodes(1, refresh_interval=0.01)
+
+        async def run():
+            channel = await layer.new_channel()
+            await layer.group_add("editor_room", channel)
+            with mock.patch.object(layer.inner, "group_add", wraps=layer.inner.group_add) as group_add:
+                await asyncio.sleep(0.05)
+            await layer.flush()
+            return group_add.call_args_list
+
+        calls = asyncio.run(run())
+        self.assertTrue(calls)
+        self.assertTrue(all(call.args[0] == "editor_room" for call in calls))
+        self.assertGreaterEqual(layer.get_stats()["refreshes"], len(calls))
@@ -0,0 +1,123 @@
+import asyncio
+import time
+from pathlib import Path
+from django.test import TransactionTestCase, override_settings
+from cloudapp import codeforces
+from cloudapp.models import CodeforcesProblem
+
+PAGE = (Path(__file__).parent / "fixtures" / "codeforces" / "theatre_square.html").read_text(encoding="utf-8")
+
+
+class StubFetcher:
+    """Stands in for the upstream fetch (CODEFORCES_ASYNC_FETCHER points at `fetch`)."""
+
+    def __init__(self):
+        self.urls = []
+        self.gate = None     # asyncio.Event the fetch waits on, when set
+        self.status = None   # answer with this UpstreamError status instead
+
+    async def __call__(self, url):
+        self.urls.append(url)
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.status is not None:
+            raise codeforces.UpstreamError(self.status)
+        return PAGE
+
+
+fetch = StubFetcher()
+
+
+@override_settings(
+    CODEFORCES_ASYNC_FETCHER="cloudapp.tests.test_codeforces_cache.fetch",
+    CODEFORCES_BASE_URL="https://cf.test",
+    CODEFORCES_FRESH_TTL=60,
+    CODEFORCES_STALE_TTL=600,
+)
+class ProblemCacheTests(TransactionTestCase):
+    # The DB tier is read and written from a worker thread, so rows must be committed
+
+    def setUp(self):
+        fetch.__init__()
+        codeforces._memory.clear()
+        self.addCleanup(codeforces._memory.clear)
+
+    def get(self, *key):
+        return asyncio.run(codeforces.get_problem_async(*key))
+
+    def test_miss_fetches_once_then_memory_then_db(self):
+        data = self.get(" 1", "a")
+        self.assertEqual(data["title"], "A. Theatre Square")
+        self.assertEqual(fetch.urls, ["https://cf.test/problemset/problem/1/A"])
+        self.assertTrue(CodeforcesProblem.objects.filter(contest_id="1", problem_index="A").exists())
+
+        hits = codeforces.get_stats()
+        self.assertEqual(self.get("1", "A"), data)
+        self.assertEqual(codeforces.get_stats()["memory_hits"], hits["memory_hits"] + 1)
+
+        # Another process: nothing in memory, the DB row is fresh
+        codeforces._memory.clear()
+        self.assertEqual(self.get("1", "A"), data)
+        self.assertEqual(codeforces.get_stats()["db_hits"], hits["db_hits"] + 1)
+        self.assertEqual(len(fetch.urls), 1)
+
+    def test_concurrent_misses_share_one_fetch(self):
+        async def run():
+            fetch.gate = asyncio.Event()
+            tasks = [asyncio.ensure_future(codeforces.get_problem_async("1", "A")) for _ in range(5)]
+            await asyncio.sleep(0.05)
+            fetch.gate.set()
+            return await asyncio.gather(*tasks)
+
+        results = asyncio.run(run())
+        self.assertEqual(len(fetch.urls), 1)
+        self.assertTrue(all(result == results[0] for result in results))
+
+    def test_stale_entry_is_served_while_it_refreshes(self):
+        stale = {"title": "old", "statement": "", "url": "", "samples": []}
+        codeforces._remember(("1", "A"), stale, time.time() - 120)
+
+        async def run():
+            fetch.gate = asyncio.Event()
+            served = await codeforces.get_problem_async("1", "A")
+            await asyncio.sleep(0.01)   # the refresh has started
+            fetch.gate.set()
+            while codeforces._async_inflight:
+                await asyncio.sleep(0.01)
+            return served, await codeforces.get_problem_async("1", "A")
+
+        served, refreshed = asyncio.run(run())
+        self.assertEqual(served, stale)
+        self.assertEqual(refreshed["title"], "A. Theatre Square")
+        self.assertEqual(len(fetch.urls), 1)
+
+    def test_expired_entry_is_refetched_before_answering(self):
+        codeforces._remember(("1", "A"), {"title": "old"}, time.time() - 3600)
+        self.assertEqual(self.get("1", "A")["title"], "A. Theatre Square")
+        self.assertEqual(len(fetch.urls), 1)
+
+    def test_upstream_error_reaches_every_waiter_and_isnt_cached(self):
+        async def run():
+            fetch.gate, fetch.status = asyncio.Event(), 404
+            tasks = [asyncio.ensure_future(codeforces.get_problem_async("1", "A")) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            fetch.gate.set()
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(result, codeforces.UpstreamError) and result.status == 404 for result in results))
+        self.assertEqual(len(fetch.urls), 1)
+        self.assertFalse(CodeforcesProblem.objects.exists())
+
+    def test_prefetch_reports_each_problem(self):
+        codeforces._remember(("1", "B"), {"title": "cached"}, time.time())
+        results = asyncio.run(codeforces.prefetch_problems([("1", "A"), ("1", "b")]))
+        self.assertEqual(results, [
+            {"contest_id": "1", "problem_index": "A", "status": "ok", "title": "A. Theatre Square"},
+            {"contest_id": "1", "problem_index": "B", "status": "ok", "title": "cached"},
+        ])
+        self.assertEqual(len(fetch.urls), 1)
+
+        fetch.status = 503
+        (result,) = asyncio.run(codeforces.prefetch_problems([("1", "B")], refresh=True))
+        self.assertEqual(result["status"], "error")
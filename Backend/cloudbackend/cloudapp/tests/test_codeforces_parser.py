@@ -0,0 +1,58 @@
+import json
+import re
+from pathlib import Path
+from unittest import skipIf
+from django.test import SimpleTestCase, override_settings
+from cloudapp import codeforces
+
+# Saved problem pages next to the output both statement parsers must produce
+# for them. The statement is compared as visible text: the engines serialize
+# markup slightly differently.
+FIXTURES = Path(__file__).parent / "fixtures" / "codeforces"
+
+
+def summarize(problem):
+    return {
+        "title": problem["title"],
+        "statement_text": codeforces.statement_text(problem["statement"]),
+        "images": re.findall(r'src="([^"]+)"', problem["statement"]),
+        "samples": problem["samples"],
+    }
+
+
+@override_settings(CODEFORCES_BASE_URL="https://codeforces.com")
+class ParserGoldenTests(SimpleTestCase):
+
+    def check_engine(self, name):
+        pages = sorted(FIXTURES.glob("*.html"))
+        self.assertTrue(pages)
+        for page in pages:
+            with self.subTest(page=page.name):
+                expected = json.loads(page.with_suffix(".json").read_text(encoding="utf-8"))
+                html = page.read_text(encoding="utf-8")
+                self.assertEqual(summarize(codeforces.PARSERS[name](html, "u")), expected)
+
+    def test_bs4_matches_golden(self):
+        self.check_engine("bs4")
+
+    @skipIf(codeforces.lxml is None, "lxml not installed")
+    def test_lxml_matches_golden(self):
+        self.check_engine("lxml")
+
+    @skipIf(codeforces.lxml is None, "lxml not installed")
+    def test_engines_agree(self):
+        for page in sorted(FIXTURES.glob("*.html")):
+            with self.subTest(page=page.name):
+                html = page.read_text(encoding="utf-8")
+                self.assertEqual(
+                    summarize(codeforces.parse_problem_lxml(html, "u")),
+                    summarize(codeforces.parse_problem_bs4(html, "u")),
+                )
+
+    def test_missing_statement_raises(self):
+        html = "<html><body><p>Just a moment...</p></body></html>"
+        for name, parse in codeforces.PARSERS.items():
+            if name == "lxml" and codeforces.lxml is None:
+                continue
+            with self.subTest(engine=name), self.assertRaises(codeforces.ParseError):
+                parse(html, "u")
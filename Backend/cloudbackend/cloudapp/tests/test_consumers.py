@@ -0,0 +1,30 @@
+from unittest import mock
+from django.test import SimpleTestCase
+from cloudapp import codec, consumers
+
+
+class BroadcastEventTests(SimpleTestCase):
+
+    def setUp(self):
+        consumers._packed[:] = [None, None]
+
+    def test_event_carries_the_frame_only(self):
+        data = {"type": "code_ops", "rev": 3, "ops": [{"op": "insert", "pos": 0, "text": "x"}]}
+        event = consumers.broadcast_event(data, "alice", "chan")
+        self.assertNotIn("data", event)
+        self.assertEqual(codec.loads(event["frame"]), {"data": data, "user": {"username": "alice"}})
+        self.assertEqual(event["rev"], 3)
+
+    def test_binary_payload_is_packed_from_the_frame_once(self):
+        data = {"type": "language_change", "language": "python"}
+        event = consumers.broadcast_event(data, "alice")
+        with mock.patch.object(codec, "packb", wraps=codec.packb) as packb:
+            first = consumers.binary_payload(event)
+            # Every binary member gets the same event (or an equal copy from the layer)
+            second = consumers.binary_payload(dict(event, frame=str(event["frame"])))
+        self.assertIs(first, second)
+        self.assertEqual(packb.call_count, 1)
+        self.assertEqual(codec.unpackb(first), data)
+
+        other = consumers.broadcast_event(dict(data, language="cpp"), "alice")
+        self.assertEqual(codec.unpackb(consumers.binary_payload(other))["language"], "cpp")
@@ -0,0 +1,189 @@
+import asyncio
+import os
+from unittest import SkipTest, mock
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from cloudapp import executor
+
+
+def sandboxed(test_case):
+    """Skip the class where the launcher can't isolate programs (no root, no unshare)."""
+    setup = test_case.setUpClass.__func__
+
+    def setUpClass(cls):
+        setup(cls)
+        try:
+            with override_settings(EXECUTION_POOL_SIZE=0):
+                asyncio.run(executor.check_sandbox())
+        except executor.SandboxUnavailable:
+            raise SkipTest(f"sandbox unavailable: {executor._sandbox_error}")
+
+    test_case.setUpClass = classmethod(setUpClass)
+    return override_settings(EXECUTION_POOL_SIZE=0)(test_case)
+
+
+def run(language, code, stdin="", **limits):
+    async def go():
+        with executor.scratch_dir() as workdir:
+            config, values = executor.prepare(language, code, workdir)
+            if config["compile"]:
+                compiled = await executor.compile_in(language, config, values, workdir)
+                assert compiled["code"] == 0, compiled["stderr"]
+            return await executor.run_in_sandbox(
+                language, executor._argv(config["run"], values), workdir, stdin=stdin, **limits
+            )
+    return asyncio.run(go())
+
+
+@sandboxed
+class RunInSandboxTests(SimpleTestCase):
+
+    def test_exit_code_stdin_and_streams(self):
+        result = run("python", "import sys\nprint(input()[::-1])\nsys.stderr.write('warn')\nsys.exit(3)", "abc\n")
+        self.assertEqual((result["stdout"], result["stderr"], result["code"]), ("cba\n", "warn", 3))
+
+    def test_multibyte_output_split_across_reads(self):
+        # 'a' puts every later 4096-byte read boundary inside a two-byte character
+        result = run("python", "import sys\nsys.stdout.buffer.write(b'a' + 'é'.encode() * 5000)")
+        self.assertEqual(result["stdout"], "a" + "é" * 5000)
+
+    def test_output_limit(self):
+        result = run("python", "while True: print('x' * 1000)", output_limit=10000)
+        self.assertTrue(result["truncated"])
+        self.assertEqual(len(result["stdout"]), 10000)
+        self.assertIn("Output limit exceeded", result["stderr"])
+
+    def test_wall_clock_timeout(self):
+        result = run("python", "import time\ntime.sleep(30)", cpu=1, timeout=0.5)
+        self.assertTrue(result["timed_out"])
+        self.assertEqual(result["signal"], "SIGKILL")
+
+    def test_cpu_limit_signal(self):
+        result = run("python", "while True: pass", cpu=1)
+        self.assertIn(result["signal"], ("SIGXCPU", "SIGKILL"))
+        self.assertIsNone(result["code"])
+
+    def test_compiled_program(self):
+        result = run("cpp", '#include <cstdio>\nint main(){int a,b;scanf("%d %d",&a,&b);printf("%d\\n",a+b);}', "2 3")
+        self.assertEqual(result["stdout"], "5\n")
+
+
+@sandboxed
+class LauncherIsolationTests(SimpleTestCase):
+
+    def check(self, code):
+        result = run("python", code)
+        self.assertEqual(result["code"], 0, result["stderr"])
+        return result["stdout"]
+
+    def test_runs_as_the_sandbox_user(self):
+        out = self.check("import os\nprint(os.getuid(), os.getgid(), os.getgroups())")
+        self.assertEqual(out, f"{settings.EXECUTION_SANDBOX_UID} {settings.EXECUTION_SANDBOX_GID} []\n")
+
+    def test_root_is_read_only_and_work_is_writable(self):
+        out = self.check(
+            "import os\n"
+            "try:\n    open('/usr/x', 'w')\nexcept OSError as e:\n    print(e.errno)\n"
+            "open('/work/out', 'w').write('ok')\nprint(os.getcwd())"
+        )
+        self.assertEqual(out, "30\n/work\n")   # EROFS
+
+    def test_no_network(self):
+        out = self.check(
+            "import socket\n"
+            "try:\n    socket.create_connection(('1.1.1.1', 53), timeout=1)\nexcept OSError as e:\n    print('blocked')"
+        )
+        self.assertEqual(out, "blocked\n")
+
+    def test_namespace_syscalls_are_refused(self):
+        out = self.check(
+            "import ctypes, os\nlibc = ctypes.CDLL(None, use_errno=True)\n"
+            "print(libc.unshare(0x10000000), ctypes.get_errno())\n"
+            "print(os.getpid())"
+        )
+        unshare, pid = out.split("\n")[:2]
+        self.assertEqual(unshare, "-1 1")   # EPERM from the seccomp filter
+        self.assertLess(int(pid), 10)       # own pid namespace
+
+    def test_workdir_is_handed_back(self):
+        async def go():
+            with executor.scratch_dir() as workdir:
+                executor.prepare("python", "open('made', 'w').write('x')", workdir)
+                result = await executor.run_in_sandbox("python", ["python3", "-I", "main.py"], workdir)
+                return result, os.stat(os.path.join(workdir, "made")).st_uid, sorted(os.listdir(workdir))
+
+        result, owner, files = asyncio.run(go())
+        self.assertEqual(owner, os.getuid())
+        # The usage report was read and removed
+        self.assertEqual(files, ["made", "main.py"])
+        self.assertGreater(result["wall_time"], 0)
+        self.assertIsNotNone(result["cpu_time"])
+
+
+class SlotTests(SimpleTestCase):
+
+    def test_user_entries_are_dropped_when_idle(self):
+        async def go():
+            async with executor.slot(7):
+                self.assertIn(7, executor._user_slots)
+            self.assertNotIn(7, executor._user_slots)
+
+        asyncio.run(go())
+
+    @override_settings(EXECUTION_PER_USER=1, EXECUTION_QUEUE_TIMEOUT=0.05)
+    def test_timed_out_waiter_leaves_no_entry(self):
+        async def go():
+            async with executor.slot(7):
+                with self.assertRaises(executor.QueueTimeout):
+                    async with executor.slot(7):
+                        pass
+                self.assertEqual(executor._user_slots[7][1], 1)
+            self.assertNotIn(7, executor._user_slots)
+
+        asyncio.run(go())
+
+
+class SandboxCheckTests(SimpleTestCase):
+
+    def setUp(self):
+        for name, value in (("_sandbox_checked", False), ("_sandbox_error", None)):
+            patcher = mock.patch.object(executor, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_concurrent_callers_share_one_probe(self):
+        calls = []
+
+        async def probe():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "no unshare"
+
+        async def go():
+            with mock.patch.object(executor, "_probe_sandbox", probe):
+                return await asyncio.gather(*(executor.check_sandbox() for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(go())
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(result, executor.SandboxUnavailable) for result in results))
+
+    def test_cancelled_probe_is_run_again(self):
+        calls = []
+
+        async def probe():
+            calls.append(1)
+            if len(calls) == 1:
+                await asyncio.sleep(1)
+            return None
+
+        async def go():
+            with mock.patch.object(executor, "_probe_sandbox", probe):
+                task = asyncio.ensure_future(executor.check_sandbox())
+                await asyncio.sleep(0.01)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                self.assertFalse(executor._sandbox_checked)
+                await executor.check_sandbox()   # doesn't raise: the second probe passed
+
+        asyncio.run(go())
+        self.assertEqual(len(calls), 2)
@@ -0,0 +1,72 @@
+import asyncio
+from django.test import SimpleTestCase
+from cloudapp import judge
+from cloudapp.tests.test_executor import sandboxed
+
+# Burns about `seconds` of CPU, then answers correctly
+BUSY = """import time
+start = time.process_time()
+while time.process_time() - start < {seconds}:
+    pass
+a, b = map(int, input().split())
+print(a + b)
+"""
+
+# Reads its own source after the other sample's run has finished
+READS_LATE = """import time
+n = int(input())
+time.sleep(n * 0.5)
+print(n if open(__file__).read() else -1)
+"""
+
+
+def events(code, samples, **limits):
+    async def go():
+        return [event async for event in judge.judge("python", code, samples, **limits)]
+    return asyncio.run(go())
+
+
+def result(**fields):
+    return dict({"stdout": "3\n", "code": 0, "signal": None, "timed_out": False, "truncated": False,
+                 "cpu_time": 0.1, "wall_time": 0.2}, **fields)
+
+
+class VerdictTests(SimpleTestCase):
+
+    def test_measured_time_over_the_limit_is_tle(self):
+        self.assertEqual(judge.verdict(result(), "3", 0.5), "AC")
+        self.assertEqual(judge.verdict(result(cpu_time=0.6), "3", 0.5), "TLE")
+        self.assertEqual(judge.verdict(result(wall_time=0.6), "3", 0.5), "TLE")
+        # No measurement (the launcher didn't get that far): the other checks decide
+        self.assertEqual(judge.verdict(result(cpu_time=None, wall_time=None), "3", 0.5), "AC")
+
+    def test_other_verdicts(self):
+        self.assertEqual(judge.verdict(result(stdout="4"), "3"), "WA")
+        self.assertEqual(judge.verdict(result(code=1), "3"), "RE")
+        self.assertEqual(judge.verdict(result(signal="SIGXCPU", code=None), "3"), "TLE")
+        self.assertEqual(judge.verdict(result(timed_out=True), "3"), "TLE")
+
+
+@sandboxed
+class JudgeTests(SimpleTestCase):
+
+    def test_fractional_time_limit(self):
+        samples = [{"input": "1 2", "output": "3"}]
+        slow = events(BUSY.format(seconds=0.7), samples, time_limit=0.5)
+        self.assertEqual([event["verdict"] for event in slow if event["event"] == "test"], ["TLE"])
+        self.assertGreater(slow[0]["cpu_time"], 0.5)
+        self.assertEqual(slow[-1], {"event": "done", "verdict": "TLE", "passed": 0, "total": 1})
+
+        fast = events(BUSY.format(seconds=0), samples, time_limit=0.5)
+        self.assertEqual(fast[-1]["verdict"], "AC")
+        self.assertLess(fast[0]["cpu_time"], 0.5)
+
+    def test_verdict_per_sample(self):
+        samples = [{"input": "1 2", "output": "3"}, {"input": "2 2", "output": "5"}]
+        done = events(BUSY.format(seconds=0), samples)[-1]
+        self.assertEqual(done, {"event": "done", "verdict": "WA", "passed": 1, "total": 2})
+
+    def test_samples_dont_share_a_workdir(self):
+        samples = [{"input": "0", "output": "0"}, {"input": "1", "output": "1"}]
+        tests = [event for event in events(READS_LATE, samples) if event["event"] == "test"]
+        self.assertEqual([event["verdict"] for event in sorted(tests, key=lambda e: e["index"])], ["AC", "AC"])
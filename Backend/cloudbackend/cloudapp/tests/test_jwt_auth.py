@@ -0,0 +1,101 @@
+import asyncio
+import json
+from unittest import mock
+from django.contrib.auth.models import AnonymousUser, User
+from django.http import JsonResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from cloudapp import jwt_auth
+
+
+class JwtAuthTests(TransactionTestCase):
+    # The user lookup runs in a worker thread, which must see committed rows
+
+    def setUp(self):
+        self.user = User.objects.create(username="alice")
+        self.token = str(AccessToken.for_user(self.user))
+        self.addCleanup(jwt_auth._user_cache.clear)
+
+    def test_valid_token_resolves_the_user(self):
+        user = asyncio.run(jwt_auth.get_user_from_token(self.token))
+        self.assertEqual(user, self.user)
+
+    def test_bad_tokens_are_anonymous(self):
+        tampered = self.token[:-2] + ("AA" if not self.token.endswith("AA") else "BB")
+        for token in ("", "not-a-jwt", tampered):
+            self.assertIsInstance(asyncio.run(jwt_auth.get_user_from_token(token)), AnonymousUser)
+
+    def test_user_is_cached_until_the_ttl(self):
+        with mock.patch.object(jwt_auth, "get_user_db", wraps=jwt_auth.get_user_db) as lookup:
+            asyncio.run(jwt_auth.get_user_from_token(self.token))
+            asyncio.run(jwt_auth.get_user_from_token(self.token))
+            self.assertEqual(lookup.call_count, 1)
+
+            with mock.patch.object(jwt_auth.time, "time", return_value=jwt_auth.time.time() + 3600):
+                # Past the TTL (and the token's own expiry): looked up again, not cached
+                asyncio.run(jwt_auth.get_user_from_token(self.token))
+            self.assertEqual(lookup.call_count, 2)
+
+    def test_deleted_user_is_anonymous(self):
+        self.user.delete()
+        self.assertIsInstance(asyncio.run(jwt_auth.get_user_from_token(self.token)), AnonymousUser)
+
+    @override_settings(WS_USER_CACHE_MAX=1)
+    def test_cache_stays_bounded(self):
+        other = User.objects.create(username="bob")
+        asyncio.run(jwt_auth.get_user_from_token(self.token))
+        asyncio.run(jwt_auth.get_user_from_token(str(AccessToken.for_user(other))))
+        self.assertEqual(list(jwt_auth._user_cache), [str(self.user.id)])
+
+    def test_request_needs_a_bearer_header(self):
+        factory = RequestFactory()
+        request = factory.get("/", HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        self.assertEqual(asyncio.run(jwt_auth.get_user_from_request(request)), self.user)
+        for header in ("", self.token, f"Token {self.token}"):
+            request = factory.get("/", HTTP_AUTHORIZATION=header)
+            self.assertIsInstance(asyncio.run(jwt_auth.get_user_from_request(request)), AnonymousUser)
+
+
+class JsonPostTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="alice")
+        self.auth = f"Bearer {AccessToken.for_user(self.user)}"
+        self.addCleanup(jwt_auth._user_cache.clear)
+
+        @jwt_auth.json_post()
+        async def view(request, user, body):
+            return JsonResponse({"user": user.username, "body": body})
+
+        @jwt_auth.json_post(staff_only=True)
+        async def staff_view(request, user, body):
+            return JsonResponse({})
+
+        self.view, self.staff_view = view, staff_view
+
+    def call(self, view, method="post", data="{}", auth=None):
+        request = getattr(RequestFactory(), method)(
+            "/", data=data, content_type="application/json", HTTP_AUTHORIZATION=auth or self.auth
+        )
+        response = asyncio.run(view(request))
+        return response.status_code, json.loads(response.content)
+
+    def test_checks_run_before_the_view(self):
+        self.assertEqual(self.call(self.view, method="get", data=None)[0], 405)
+        self.assertEqual(self.call(self.view, auth="Bearer nope")[0], 401)
+        self.assertEqual(self.call(self.view, data="[1]"), (400, {"error": "Invalid JSON"}))
+        self.assertEqual(self.call(self.view, data="{"), (400, {"error": "Invalid JSON"}))
+        self.assertEqual(self.call(self.staff_view)[0], 403)
+
+    def test_view_gets_the_user_and_body(self):
+        self.assertEqual(self.call(self.view, data='{"a": 1}'), (200, {"user": "alice", "body": {"a": 1}}))
+        self.user.is_staff = True
+        self.user.save()
+        jwt_auth._user_cache.clear()
+        self.assertEqual(self.call(self.staff_view)[0], 200)
+
+    def test_wrapped_views_stay_async(self):
+        from cloudapp import views
+        for view in (views.execute_code, views.judge_samples, views.prefetch_codeforces_problems):
+            self.assertTrue(asyncio.iscoroutinefunction(view))
+            self.assertTrue(view.csrf_exempt)
@@ -0,0 +1,138 @@
+import random
+from django.test import SimpleTestCase
+from cloudapp import ot
+
+
+def random_ops(rng, text, count):
+    # Ops applied one after another, each against the text the previous left
+    ops = []
+    for _ in range(count):
+        if text and rng.random() < 0.4:
+            pos = rng.randrange(len(text))
+            length = rng.randint(1, min(4, len(text) - pos))
+            ops.append({"op": "delete", "pos": pos, "length": length})
+        else:
+            pos = rng.randint(0, len(text))
+            ops.append({"op": "insert", "pos": pos, "text": rng.choice(["a", "bc", "def", "\n"])})
+        text = ot.apply_ops(text, ops[-1:])
+    return ops
+
+
+class TransformTests(SimpleTestCase):
+
+    def converge(self, text, a, b):
+        a_prime, b_prime = ot.transform(a, b)
+        left = ot.apply_ops(ot.apply_ops(text, b), a_prime)
+        right = ot.apply_ops(ot.apply_ops(text, a), b_prime)
+        self.assertEqual(left, right)
+        return left
+
+    def test_inserts_at_the_same_position_keep_the_server_op_first(self):
+        self.assertEqual(self.converge("xy", [ot._insert(1, "A")], [ot._insert(1, "B")]), "xBAy")
+
+    def test_insert_before_delete(self):
+        self.assertEqual(self.converge("abcdef", [ot._insert(1, "X")], [ot._delete(2, 2)]), "aXbef")
+
+    def test_insert_inside_deleted_range_survives(self):
+        self.assertEqual(self.converge("abcdef", [ot._insert(3, "X")], [ot._delete(1, 4)]), "aXf")
+
+    def test_overlapping_deletes(self):
+        self.assertEqual(self.converge("abcdef", [ot._delete(1, 3)], [ot._delete(2, 3)]), "af")
+        self.assertEqual(self.converge("abcdef", [ot._delete(1, 4)], [ot._delete(2, 1)]), "af")
+
+    def test_empty_side_passes_through(self):
+        ops = [ot._insert(0, "x")]
+        self.assertEqual(ot.transform(ops, []), (ops, []))
+        self.assertEqual(ot.transform([], ops), ([], ops))
+
+    def test_random_op_lists_converge(self):
+        rng = random.Random(1234)
+        for _ in range(2000):
+            text = "".join(rng.choice("abcdefgh\n") for _ in range(rng.randint(0, 12)))
+            a = random_ops(rng, text, rng.randint(1, 3))
+            b = random_ops(rng, text, rng.randint(1, 3))
+            with self.subTest(text=text, a=a, b=b):
+                self.converge(text, a, b)
+
+
+class OpsTests(SimpleTestCase):
+
+    def test_apply_ops_runs_in_order(self):
+        ops = [ot._insert(5, " world"), ot._delete(0, 1), ot._insert(0, "H")]
+        self.assertEqual(ot.apply_ops("hello", ops), "Hello world")
+
+    def test_apply_ops_rejects_out_of_range(self):
+        with self.assertRaises(ValueError):
+            ot.apply_ops("abc", [ot._insert(4, "x")])
+        with self.assertRaises(ValueError):
+            ot.apply_ops("abc", [ot._delete(2, 2)])
+
+    def test_normalize_ops_drops_no_ops_and_extra_keys(self):
+        ops = [
+            {"op": "insert", "pos": 0, "text": "a", "extra": 1},
+            {"op": "insert", "pos": 1, "text": ""},
+            {"op": "delete", "pos": 0, "length": 0},
+        ]
+        self.assertEqual(ot.normalize_ops(ops), [ot._insert(0, "a")])
+
+    def test_normalize_ops_rejects_malformed(self):
+        for ops in (
+            "not a list",
+            [1],
+            [{"op": "insert", "pos": -1, "text": "a"}],
+            [{"op": "insert", "pos": True, "text": "a"}],
+            [{"op": "insert", "pos": 0}],
+            [{"op": "delete", "pos": 0, "length": -1}],
+            [{"op": "move", "pos": 0}],
+        ):
+            with self.subTest(ops=ops), self.assertRaises(ValueError):
+                ot.normalize_ops(ops)
+
+    def test_diff_ops_touches_only_the_changed_middle(self):
+        self.assertEqual(ot.diff_ops("hello world", "hello, world"), [ot._insert(5, ",")])
+        self.assertEqual(ot.diff_ops("aaa", "aa"), [ot._delete(2, 1)])
+        self.assertEqual(ot.diff_ops("same", "same"), [])
+
+    def test_diff_ops_round_trips(self):
+        rng = random.Random(99)
+        for _ in range(500):
+            old = "".join(rng.choice("ab\n") for _ in range(rng.randint(0, 10)))
+            new = "".join(rng.choice("ab\n") for _ in range(rng.randint(0, 10)))
+            with self.subTest(old=old, new=new):
+                self.assertEqual(ot.apply_ops(old, ot.diff_ops(old, new)), new)
+
+
+class RoomDocumentTests(SimpleTestCase):
+
+    def test_late_ops_are_rebased(self):
+        doc = ot.RoomDocument("abc", 3)
+        self.assertEqual(doc.apply_client_ops(3, [ot._insert(0, "X")]), (4, [ot._insert(0, "X")]))
+        # Made against revision 3, before the X went in
+        rev, ops = doc.apply_client_ops(3, [ot._insert(3, "Y")])
+        self.assertEqual((rev, ops, doc.code), (5, [ot._insert(4, "Y")], "XabcY"))
+
+    def test_ops_since(self):
+        doc = ot.RoomDocument("", 0)
+        doc.apply_client_ops(0, [ot._insert(0, "a")])
+        doc.replace("ab")
+        self.assertEqual(doc.ops_since(1), [{"rev": 2, "ops": [ot._insert(1, "b")]}])
+        self.assertEqual(doc.ops_since(2), [])
+        with self.assertRaises(ValueError):
+            doc.ops_since(3)
+
+    def test_history_limit_makes_old_revisions_stale(self):
+        doc = ot.RoomDocument("", 0)
+        for _ in range(ot.HISTORY_LIMIT + 1):
+            doc.apply_client_ops(doc.revision, [ot._insert(0, "x")])
+        with self.assertRaises(ot.StaleRevision):
+            doc.ops_since(0)
+        with self.assertRaises(ot.StaleRevision):
+            doc.apply_client_ops(0, [ot._insert(0, "y")])
+
+    def test_push_only_takes_the_next_revision(self):
+        doc = ot.RoomDocument("abc", 1)
+        with self.assertRaises(ValueError):
+            doc.push(3, [ot._insert(0, "x")])
+        with self.assertRaises(ValueError):
+            doc.push(2, [ot._delete(2, 5)])
+        self.assertEqual((doc.code, doc.revision), ("abc", 1))
@@ -0,0 +1,115 @@
+import asyncio
+from django.test import SimpleTestCase, override_settings
+from cloudapp import outbound
+
+
+class Socket:
+    """A Daphne-like socket: send() never waits, whatever the client does."""
+
+    def __init__(self, head=0):
+        self.head = head        # room revision a snapshot is taken at
+        self.sent = []          # revs of edits sent, "state@<rev>" for snapshots, text otherwise
+        self.closed = None
+        self.queue = outbound.OutboundQueue(self.send, self.snapshot, self.close)
+
+    async def send(self, text_data=None, bytes_data=None):
+        self.sent.append(int(text_data) if text_data.isdigit() else text_data)
+
+    async def snapshot(self):
+        return self.head, {"text_data": f"state@{self.head}"}
+
+    async def close(self, code):
+        self.closed = code
+
+    def edit(self, rev):
+        self.head = rev
+        self.queue.put(text_data=str(rev), rev=rev)
+
+    def edits(self):
+        return [frame for frame in self.sent if isinstance(frame, int)]
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+@override_settings(OUTBOUND_WINDOW=5, OUTBOUND_HIGH_WATER=10, OUTBOUND_MAX_BYTES=1 << 20, OUTBOUND_SLOW_TIMEOUT=60)
+class OutboundQueueTests(SimpleTestCase):
+
+    def test_client_that_keeps_up_gets_every_edit(self):
+        socket = Socket()
+
+        async def run():
+            socket.queue.start()
+            socket.queue.applied(0)
+            for rev in range(1, 51):
+                socket.edit(rev)
+                await settle()
+                socket.queue.applied(rev)
+            await socket.queue.stop()
+
+        asyncio.run(run())
+        self.assertEqual(socket.edits(), list(range(1, 51)))
+        self.assertIsNone(socket.closed)
+
+    def test_slow_client_is_collapsed_to_a_snapshot(self):
+        socket = Socket()
+
+        async def run():
+            socket.queue.start()
+            socket.queue.applied(0)
+            socket.queue.put(text_data="presence")
+            for rev in range(1, 31):
+                socket.edit(rev)
+                await settle()
+            held = list(socket.sent)
+
+            socket.queue.applied(5)     # the client works through what it got
+            await settle()
+            after_snapshot = list(socket.sent)
+            socket.edit(31)
+            await settle()
+            pending = [entry[1] for entry in socket.queue.frames]
+            await socket.queue.stop()
+            return held, after_snapshot, pending
+
+        held, after_snapshot, pending = asyncio.run(run())
+        # Only a window's worth went out; the rest became one snapshot
+        self.assertEqual(held, ["presence", 1, 2, 3, 4, 5])
+        self.assertEqual(after_snapshot, held + ["state@30"])
+        # And the edit after it waits until the client has applied the snapshot
+        self.assertEqual(socket.sent, after_snapshot)
+        self.assertEqual(pending, [31])
+
+    def test_client_that_stops_reading_is_dropped(self):
+        socket = Socket()
+
+        async def run():
+            socket.queue.start()
+            socket.queue.applied(0)
+            with override_settings(OUTBOUND_SLOW_TIMEOUT=0.05):
+                for rev in range(1, 21):
+                    socket.edit(rev)
+                    await settle()
+                await asyncio.sleep(0.06)
+                socket.edit(21)
+                await settle()
+            await socket.queue.stop()
+
+        asyncio.run(run())
+        self.assertEqual(socket.closed, outbound.SLOW_CLOSE_CODE)
+        self.assertEqual(socket.edits(), [1, 2, 3, 4, 5])
+
+    def test_clients_that_dont_report_are_not_held(self):
+        socket = Socket()
+
+        async def run():
+            socket.queue.start()
+            for rev in range(1, 31):
+                socket.edit(rev)
+                await settle()
+            await socket.queue.stop()
+
+        asyncio.run(run())
+        self.assertEqual(socket.edits(), list(range(1, 31)))
@@ -0,0 +1,80 @@
+import asyncio
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from cloudapp import codec, presence
+
+
+@override_settings(PRESENCE_TICK=0.01)
+class PresenceTests(SimpleTestCase):
+
+    def setUp(self):
+        self.layer = mock.Mock(group_send=mock.AsyncMock())
+        patcher = mock.patch.object(presence, "get_channel_layer", return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for registry in (presence._members, presence._dirty, presence._timers, presence._ids):
+            self.addCleanup(registry.clear)
+
+    def sent(self):
+        return [call.args[1] for call in self.layer.group_send.call_args_list]
+
+    def test_updates_within_a_tick_coalesce_into_one_frame(self):
+        before = presence.get_stats()["updates"]
+
+        async def run():
+            for x in range(5):
+                presence.update("room", "a", "alice", cursor={"line": 1, "column": x})
+            presence.update("room", "a", "alice", typing=True)
+            presence.update("room", "b", "bob", selection=[1, 2])
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        (event,) = self.sent()
+        self.assertEqual(codec.loads(event["entries"]["a"]), {
+            "username": "alice", "cursor": {"line": 1, "column": 4}, "typing": True,
+        })
+        self.assertEqual(set(event["entries"]), {"a", "b"})
+        self.assertEqual(presence.get_stats()["updates"] - before, 7)
+
+    def test_only_changed_members_are_sent_and_typing_is_one_shot(self):
+        async def run():
+            presence.update("room", "a", "alice", cursor=1, typing=True)
+            presence.update("room", "b", "bob", cursor=2)
+            await asyncio.sleep(0.05)
+            presence.update("room", "a", "alice", cursor=3)
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        second = self.sent()[1]
+        self.assertEqual(list(second["entries"]), ["a"])
+        self.assertEqual(codec.loads(second["entries"]["a"]), {"username": "alice", "cursor": 3})
+
+    def test_last_member_leaving_cancels_the_tick(self):
+        async def run():
+            presence.update("room", "a", "alice", cursor=1)
+            presence.remove("room", "a")
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        self.assertEqual(self.sent(), [])
+        self.assertNotIn("room", presence._timers)
+
+    def test_frames_leave_out_the_recipient(self):
+        entries = {"a": codec.dumps({"username": "alice", "cursor": 1}), "b": codec.dumps({"username": "bob"})}
+        frame = codec.loads(presence.presence_frame(entries, "a"))
+        self.assertEqual(frame["data"], {"type": "presence", "members": [{"username": "bob"}]})
+        self.assertIsNone(presence.presence_frame({"a": entries["a"]}, "a"))
+
+        ids = {"alice": presence.member_id("room", "alice"), "bob": presence.member_id("room", "bob")}
+        binary = {"a": ["alice", codec.packb({"cursor": 1})], "b": ["bob", codec.packb({"cursor": 2})]}
+        self.assertEqual(codec.unpackb(presence.binary_presence_frame(binary, "b", ids)), [
+            codec.SYSTEM_ID, {"type": "presence", "members": [[ids["alice"], {"cursor": 1}]]},
+        ])
+
+    def test_member_ids_are_stable_per_room(self):
+        self.assertEqual(presence.member_id("room", "alice"), 1)
+        self.assertEqual(presence.member_id("room", "bob"), 2)
+        self.assertEqual(presence.member_id("room", "alice"), 1)
+        self.assertEqual(presence.member_id("other", "bob"), 1)
+        presence.forget_room("room")
+        self.assertEqual(presence.member_id("room", "bob"), 1)
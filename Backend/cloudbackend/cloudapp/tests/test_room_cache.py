@@ -0,0 +1,138 @@
+import asyncio
+from unittest import mock
+from django.test import SimpleTestCase
+from cloudapp import room_cache
+from cloudapp.room_cache import RoomStateCache
+
+
+class Loader:
+    """Counts loads; each one waits until released so tests can interleave."""
+
+    def __init__(self, state=None):
+        self.state = state if state is not None else {"code": "db", "language": "cpp"}
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, token):
+        self.calls += 1
+        await self.release.wait()
+        return dict(self.state)
+
+
+class RoomStateCacheTests(SimpleTestCase):
+
+    def test_concurrent_misses_share_one_load(self):
+        async def run():
+            cache, loader = RoomStateCache(10, 60), Loader()
+            tasks = [asyncio.ensure_future(cache.get("room", loader)) for _ in range(3)]
+            await asyncio.sleep(0)
+            loader.release.set()
+            return cache, loader, await asyncio.gather(*tasks)
+
+        cache, loader, states = asyncio.run(run())
+        self.assertEqual(loader.calls, 1)
+        self.assertEqual(states, [{"code": "db", "language": "cpp", "version": 1}] * 3)
+        self.assertEqual(cache.get_stats(), {"hits": 0, "misses": 1, "waits": 2, "evictions": 0, "rooms": 1})
+
+    def test_write_during_the_load_wins_over_the_row(self):
+        async def run():
+            cache, loader = RoomStateCache(10, 60), Loader()
+            task = asyncio.ensure_future(cache.get("room", loader))
+            await asyncio.sleep(0)
+            # The row being read predates this write
+            cache.update("room", code="newer")
+            loader.release.set()
+            return cache, await task
+
+        cache, state = asyncio.run(run())
+        self.assertEqual(state["code"], "newer")
+
+        async def hit():
+            return await cache.get("room", Loader())
+
+        self.assertEqual(asyncio.run(hit())["code"], "newer")
+
+    def test_updates_bump_the_version(self):
+        async def run():
+            cache, loader = RoomStateCache(10, 60), Loader()
+            loader.release.set()
+            first = await cache.get("room", loader)
+            cache.update("room", language="python")
+            second = await cache.get("room", loader)
+            return first, second, loader.calls
+
+        first, second, calls = asyncio.run(run())
+        self.assertEqual((first["version"], second["version"]), (1, 2))
+        self.assertEqual((first["language"], second["language"]), ("cpp", "python"))
+        self.assertEqual(calls, 1)
+
+    def test_entries_expire(self):
+        async def run(cache, loader):
+            return await cache.get("room", loader)
+
+        cache, loader = RoomStateCache(10, 60), Loader()
+        loader.release.set()
+        with mock.patch.object(room_cache.time, "monotonic", return_value=100.0):
+            asyncio.run(run(cache, loader))
+            asyncio.run(run(cache, loader))
+        with mock.patch.object(room_cache.time, "monotonic", return_value=161.0):
+            asyncio.run(run(cache, loader))
+        self.assertEqual(loader.calls, 2)
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+
+    def test_least_recently_used_room_is_evicted(self):
+        async def run():
+            cache, loader = RoomStateCache(2, 60), Loader()
+            loader.release.set()
+            await cache.get("a", loader)
+            await cache.get("b", loader)
+            await cache.get("a", loader)   # "b" is now the oldest
+            await cache.get("c", loader)
+            return cache
+
+        cache = asyncio.run(run())
+        self.assertEqual(list(cache._entries), ["a", "c"])
+
+    def test_cancelled_load_hands_over_to_a_waiter(self):
+        async def run():
+            cache, loader = RoomStateCache(10, 60), Loader()
+            first = asyncio.ensure_future(cache.get("room", loader))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(cache.get("room", loader))
+            await asyncio.sleep(0)
+            first.cancel()   # the joining socket closed mid-load
+            await asyncio.sleep(0)
+            loader.release.set()
+            return loader, await second, first.cancelled()
+
+        loader, state, cancelled = asyncio.run(run())
+        self.assertTrue(cancelled)
+        self.assertEqual(state["code"], "db")
+        self.assertEqual(loader.calls, 2)
+
+    def test_failed_load_reaches_every_caller(self):
+        async def failing(token):
+            await asyncio.sleep(0)
+            raise OSError("db down")
+
+        async def run():
+            cache = RoomStateCache(10, 60)
+            return cache, await asyncio.gather(
+                cache.get("room", failing), cache.get("room", failing), return_exceptions=True
+            )
+
+        cache, results = asyncio.run(run())
+        self.assertTrue(all(isinstance(result, OSError) for result in results))
+        self.assertNotIn("room", cache._loading)
+
+    def test_missing_room_is_not_cached(self):
+        async def missing(token):
+            return None
+
+        async def run():
+            cache = RoomStateCache(10, 60)
+            return cache, await cache.get("room", missing)
+
+        cache, state = asyncio.run(run())
+        self.assertIsNone(state)
+        self.assertEqual(cache.get_stats()["rooms"], 0)
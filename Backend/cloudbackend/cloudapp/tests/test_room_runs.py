@@ -0,0 +1,207 @@
+import asyncio
+import json
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from cloudapp import executor, ot, room_runs
+from cloudapp.consumers import CollaborativeEditorConsumer
+
+RESULT = {"stdout": "", "stderr": "", "output": "", "code": 0, "signal": None,
+          "time": 0.25, "timed_out": False, "truncated": False}
+
+
+@override_settings(RUN_FLUSH_INTERVAL=0.05, RUN_CHUNK_BYTES=10)
+class OutputRelayTests(SimpleTestCase):
+
+    def relay(self):
+        self.frames = []
+
+        async def send(data):
+            self.frames.append(data)
+
+        return room_runs.OutputRelay(send)
+
+    def test_output_is_coalesced_per_interval(self):
+        async def run():
+            relay = self.relay()
+            await relay.write("stdout", "a")        # first write goes out at once
+            await relay.write("stdout", "b")
+            await relay.write("stdout", "c")
+            await relay.write("stderr", "!")
+            await relay.write("stdout", "d")
+            self.assertEqual(len(self.frames), 1)
+            await asyncio.sleep(0.08)               # the timer flushes the rest
+            await relay.close()
+
+        asyncio.run(run())
+        self.assertEqual(self.frames, [
+            {"type": "run_output", "seq": 1, "chunks": [["stdout", "a"]]},
+            {"type": "run_output", "seq": 2, "chunks": [["stdout", "bc"], ["stderr", "!"], ["stdout", "d"]]},
+        ])
+
+    def test_a_full_chunk_flushes_early(self):
+        async def run():
+            relay = self.relay()
+            await relay.write("stdout", "a")
+            await relay.write("stdout", "0123456789")
+            await relay.write("stdout", "tail")
+            self.assertEqual(len(self.frames), 2)
+            await relay.close()
+
+        asyncio.run(run())
+        self.assertEqual([frame["chunks"] for frame in self.frames],
+                         [[["stdout", "a"]], [["stdout", "0123456789"]], [["stdout", "tail"]]])
+
+    def test_close_flushes_and_stops_the_timer(self):
+        async def run():
+            relay = self.relay()
+            await relay.write("stdout", "a")
+            await relay.write("stdout", "b")
+            timer = relay.timer
+            await relay.close()
+            await asyncio.sleep(0.08)
+            return timer
+
+        timer = asyncio.run(run())
+        self.assertTrue(timer.cancelled())
+        self.assertEqual([frame["seq"] for frame in self.frames], [1, 2])
+
+
+class RoomRunTests(SimpleTestCase):
+
+    def setUp(self):
+        self.addCleanup(room_runs._runs.clear)
+
+    def test_one_run_per_room(self):
+        async def run():
+            gate = asyncio.Event()
+            first = room_runs.start("room", gate.wait())
+            second_coro = gate.wait()
+            busy = room_runs.start("room", second_coro)
+            other_room = room_runs.start("other", gate.wait())
+            gate.set()
+            await asyncio.gather(first, other_room)
+            await asyncio.sleep(0)
+            again = room_runs.start("room", asyncio.sleep(0))
+            await again
+            return busy, second_coro, room_runs.is_running("room")
+
+        busy, second_coro, running = asyncio.run(run())
+        self.assertIsNone(busy)
+        self.assertIsNone(second_coro.cr_frame)   # closed, not left un-awaited
+        self.assertFalse(running)
+
+    def test_cancel(self):
+        async def run():
+            task = room_runs.start("room", asyncio.sleep(10))
+            self.assertTrue(room_runs.cancel("room"))
+            await asyncio.gather(task, return_exceptions=True)
+            return task, room_runs.cancel("room")
+
+        task, again = asyncio.run(run())
+        self.assertTrue(task.cancelled())
+        self.assertFalse(again)
+        self.assertNotIn("room", room_runs._runs)
+
+
+@override_settings(RUN_FLUSH_INTERVAL=0.01, RUN_CHUNK_BYTES=8192)
+class ConsumerRunTests(SimpleTestCase):
+
+    def setUp(self):
+        self.addCleanup(room_runs._runs.clear)
+        self.addCleanup(ot._documents.clear)
+        self.addCleanup(ot._members.clear)
+        # Everything the run sends to the room or back to this socket
+        for name in ("broadcast", "send_system"):
+            patcher = mock.patch.object(CollaborativeEditorConsumer, name, autospec=True, side_effect=self.record)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("cloudapp.consumers.room_sync.catch_up", mock.AsyncMock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sent = []
+
+    async def record(self, consumer, data, include_self=False):
+        self.sent.append(data)
+
+    def member(self):
+        consumer = CollaborativeEditorConsumer()
+        consumer.room_name = "room"
+        consumer.room_group_name = "editor_room"
+        consumer.channel_name = "chan"
+        consumer.user = mock.Mock(username="alice", pk=7)
+        consumer.document = ot.join_room("room", "print(input())", 0)
+        return consumer
+
+    def types(self):
+        return [data["type"] for data in self.sent]
+
+    def test_output_streams_and_the_outcome_is_reported(self):
+        calls = []
+
+        async def execute(language, code, stdin, user_id=None, on_output=None):
+            calls.append((language, code, stdin, user_id))
+            await on_output("stdout", "hello\n")
+            return {"run": dict(RESULT, stdout="hello\n")}
+
+        async def run():
+            consumer = self.member()
+            with mock.patch.object(executor, "execute", execute):
+                await consumer.handle_run_request({"type": "run_request", "language": "python", "stdin": "hi"})
+                await consumer.run_task
+
+        asyncio.run(run())
+        self.assertEqual(calls, [("python", "print(input())", "hi", 7)])
+        self.assertEqual(self.types(), ["run_started", "run_output", "run_finished"])
+        self.assertEqual(len({data["run_id"] for data in self.sent}), 1)
+        self.assertEqual(self.sent[1]["chunks"], [["stdout", "hello\n"]])
+        finished = dict(self.sent[-1])
+        del finished["run_id"]
+        self.assertEqual(finished, {"type": "run_finished", "stage": "run", "code": 0, "signal": None,
+                                    "time": 0.25, "timed_out": False, "truncated": False})
+
+    def test_compile_errors_are_reported_as_the_compile_stage(self):
+        async def execute(language, code, stdin, user_id=None, on_output=None):
+            return {"compile": dict(RESULT, code=1), "run": None}
+
+        async def run():
+            consumer = self.member()
+            with mock.patch.object(executor, "execute", execute):
+                await consumer.handle_run_request({"type": "run_request", "language": "cpp"})
+                await consumer.run_task
+
+        asyncio.run(run())
+        self.assertEqual((self.sent[-1]["stage"], self.sent[-1]["code"]), ("compile", 1))
+
+    def test_second_run_is_busy_and_run_cancel_stops_the_first(self):
+        async def run():
+            running = asyncio.Event()
+
+            async def execute(language, code, stdin, user_id=None, on_output=None):
+                running.set()
+                await asyncio.sleep(10)
+
+            first, second = self.member(), self.member()
+            with mock.patch.object(executor, "execute", execute):
+                await first.handle_run_request({"type": "run_request", "language": "python"})
+                await running.wait()
+                await second.handle_run_request({"type": "run_request", "language": "python"})
+                await second.receive(text_data=json.dumps({"type": "run_cancel"}))
+                await first.run_task
+
+        asyncio.run(run())
+        self.assertEqual(self.types(), ["run_started", "run_busy", "run_finished"])
+        self.assertEqual(self.sent[-1]["error"], "Run cancelled")
+
+    def test_execution_errors_end_the_run(self):
+        async def execute(language, code, stdin, user_id=None, on_output=None):
+            raise executor.QueueTimeout()
+
+        async def run():
+            consumer = self.member()
+            with mock.patch.object(executor, "execute", execute):
+                await consumer.handle_run_request({"type": "run_request", "language": "python"})
+                await consumer.run_task
+
+        asyncio.run(run())
+        self.assertEqual(self.types(), ["run_started", "run_finished"])
+        self.assertEqual(self.sent[-1]["error"], "Too many runs in progress, try again shortly.")
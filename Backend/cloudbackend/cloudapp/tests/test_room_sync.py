@@ -0,0 +1,132 @@
+import asyncio
+import random
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from cloudapp import ot, room_sync
+
+
+class FakeLog:
+    """Just enough of a Redis client to run room_sync's two scripts in memory."""
+
+    def __init__(self):
+        self.head = None
+        self.entries = []
+
+    async def eval(self, script, numkeys, head_key, ops_key, base, *args):
+        await asyncio.sleep(0)   # a round trip, so other commits can get in
+        if script == room_sync._APPEND:
+            if self.head is None or self.head < base:
+                self.head, self.entries = base, []
+            elif self.head > base:
+                return self.missing(base)
+            self.head += 1
+            self.entries = (self.entries + [args[0]])[-args[1]:]
+            return [1, self.head]
+        if self.head is None:
+            return [0, -1, []]
+        return self.missing(base) if self.head > base else [0, self.head, []]
+
+    def missing(self, base):
+        behind = self.head - base
+        if behind > len(self.entries):
+            return [0, self.head]
+        return [0, self.head, self.entries[-behind:]]
+
+
+@override_settings(ROOM_SYNC_REDIS_URLS=["redis://log"], ROOM_SYNC_TTL=60)
+class RoomSyncTests(SimpleTestCase):
+
+    def setUp(self):
+        self.log = FakeLog()
+        patcher = mock.patch.object(room_sync, "_client", lambda token: self.log)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(room_sync.forget, "room")
+
+    def process(self):
+        # Each process has its own document and its own per-room locks
+        return ot.RoomDocument("start", 0), {}
+
+    async def edit(self, process, rng, count):
+        doc, locks = process
+        for _ in range(count):
+            base, text = doc.revision, doc.code
+            await asyncio.sleep(0)   # the client's view may be a little behind
+            if text and rng.random() < 0.3:
+                ops = [{"op": "delete", "pos": rng.randrange(len(text)), "length": 1}]
+            else:
+                ops = [{"op": "insert", "pos": rng.randint(0, len(text)), "text": rng.choice("xyz")}]
+            with mock.patch.object(room_sync, "_locks", locks):
+                await room_sync.commit("room", doc, base, ops)
+
+    def test_processes_converge(self):
+        rng = random.Random(7)
+        first, second = self.process(), self.process()
+
+        async def run():
+            await asyncio.gather(self.edit(first, rng, 100), self.edit(second, rng, 100))
+            await room_sync.catch_up("room", first[0])
+
+        asyncio.run(run())
+        self.assertEqual(first[0].revision, 200)
+        self.assertEqual((second[0].code, second[0].revision), (first[0].code, first[0].revision))
+
+    def test_replace_after_another_process_edited(self):
+        first, second = self.process(), self.process()
+
+        async def run():
+            await room_sync.commit("room", first[0], 0, [ot._insert(5, "!")])
+            return await room_sync.replace("room", second[0], "start!?")
+
+        self.assertEqual(asyncio.run(run()), (2, [ot._insert(6, "?")]))
+        # Diffed against the text with the other process's edit in it
+        self.assertEqual(second[0].code, "start!?")
+        self.assertEqual(second[0].history[-1], (2, [ot._insert(6, "?")]))
+
+    def test_base_ahead_of_the_local_document(self):
+        # The client saw rev 1 in a broadcast from the other process before
+        # this process's copy applied it
+        first, second = self.process(), self.process()
+
+        async def run():
+            await room_sync.commit("room", first[0], 0, [ot._insert(0, ">")])
+            return await room_sync.commit("room", second[0], 1, [ot._insert(6, "!")])
+
+        self.assertEqual(asyncio.run(run()), (2, [ot._insert(6, "!")]))
+        self.assertEqual((second[0].code, second[0].revision), (">start!", 2))
+
+    def test_base_ahead_of_the_whole_log_is_rejected(self):
+        doc = self.process()[0]
+        with self.assertRaises(ValueError):
+            asyncio.run(room_sync.commit("room", doc, 3, [ot._insert(0, "x")]))
+        self.assertEqual(doc.revision, 0)
+
+    def test_broadcast_ops_keep_other_processes_in_step(self):
+        first, second = self.process(), self.process()
+
+        async def run():
+            rev, ops = await room_sync.commit("room", first[0], 0, [ot._insert(0, ">")])
+            await room_sync.apply_remote("room", second[0], rev, ops)
+            await room_sync.apply_remote("room", second[0], rev, ops)   # already applied
+            # A broadcast that got lost: the next one fills the gap from the log
+            await room_sync.commit("room", first[0], 1, [ot._insert(1, "-")])
+            rev, ops = await room_sync.commit("room", first[0], 2, [ot._insert(2, "+")])
+            await room_sync.apply_remote("room", second[0], rev, ops)
+
+        asyncio.run(run())
+        self.assertEqual((second[0].code, second[0].revision), (">-+start", 3))
+
+    def test_late_joiner_catches_up(self):
+        first = self.process()
+        asyncio.run(room_sync.commit("room", first[0], 0, [ot._insert(0, ">")]))
+        joiner = ot.RoomDocument("start", 0)
+        asyncio.run(room_sync.catch_up("room", joiner))
+        self.assertEqual((joiner.code, joiner.revision), (">start", 1))
+
+    @override_settings(ROOM_SYNC_REDIS_URLS=[])
+    def test_without_redis_the_process_assigns_revisions(self):
+        doc = ot.RoomDocument("ab", 4)
+        with mock.patch.object(room_sync, "_client", return_value=None):
+            rev, ops = asyncio.run(room_sync.commit("room", doc, 4, [ot._insert(1, "-")]))
+        self.assertEqual((rev, ops, doc.code), (5, [ot._insert(1, "-")], "a-b"))
+        self.assertIsNone(self.log.head)
@@ -0,0 +1,103 @@
+import asyncio
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from cloudapp import ot, session_buffer
+from cloudapp.consumers import CollaborativeEditorConsumer
+from cloudapp.models import CollaborationSession
+
+
+@override_settings(SESSION_FLUSH_INTERVAL=0.01)
+class SessionBufferTests(SimpleTestCase):
+
+    def setUp(self):
+        self.writes = []
+        patcher = mock.patch.object(session_buffer, "_write", lambda token, fields: self.writes.append((token, fields)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(session_buffer._pending.clear)
+        self.addCleanup(session_buffer._timers.clear)
+
+    def test_updates_coalesce_into_one_write(self):
+        async def run():
+            session_buffer.queue_update("room", code="a", revision=1)
+            session_buffer.queue_update("room", code="ab", revision=2, language=None)
+            session_buffer.queue_update("room", language="python")
+            self.assertEqual(session_buffer.pending_fields("room"), {"code": "ab", "revision": 2, "language": "python"})
+            self.assertEqual(self.writes, [])
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        self.assertEqual(self.writes, [("room", {"code": "ab", "revision": 2, "language": "python"})])
+        self.assertEqual(session_buffer.pending_fields("room"), {})
+
+    def test_flush_writes_now_and_cancels_the_timer(self):
+        async def run():
+            session_buffer.queue_update("room", code="a")
+            await session_buffer.flush("room")
+            self.assertEqual(self.writes, [("room", {"code": "a"})])
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        self.assertEqual(len(self.writes), 1)
+        self.assertNotIn("room", session_buffer._timers)
+
+    def test_failed_flush_keeps_newer_values(self):
+        attempts = []
+
+        def write(token, fields):
+            attempts.append(dict(fields))
+            if len(attempts) == 1:
+                # Something newer arrives while the first write is failing
+                session_buffer._pending["room"] = {"code": "newer"}
+                raise OSError("db down")
+            self.writes.append((token, fields))
+
+        async def run():
+            session_buffer.queue_update("room", code="old", language="cpp")
+            with mock.patch.object(session_buffer, "_write", write):
+                await session_buffer.flush("room")
+                self.assertEqual(session_buffer.pending_fields("room"), {"code": "newer", "language": "cpp"})
+                await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        self.assertEqual(self.writes, [("room", {"code": "newer", "language": "cpp"})])
+
+    def test_last_local_member_leaving_flushes_the_room(self):
+        def member(channel):
+            consumer = CollaborativeEditorConsumer()
+            consumer.room_name = "room"
+            consumer.room_group_name = "editor_room"
+            consumer.channel_name = channel
+            consumer.channel_layer = mock.AsyncMock()
+            consumer.user = mock.Mock(username=channel)
+            consumer.broadcast = mock.AsyncMock()
+            consumer.document = ot.join_room("room", "start", 0)
+            return consumer
+
+        async def run():
+            first, second = member("first"), member("second")
+            session_buffer.queue_update("room", code="start!", revision=1)
+            with mock.patch("cloudapp.consumers.edit_log.flush", mock.AsyncMock()):
+                await first.disconnect(1000)
+                self.assertEqual(self.writes, [])   # someone is still editing
+                await second.disconnect(1000)
+                self.assertEqual(self.writes, [("room", {"code": "start!", "revision": 1})])
+
+        asyncio.run(run())
+
+
+class SessionWriteTests(TestCase):
+
+    def test_code_never_moves_backwards(self):
+        user = User.objects.create(username="owner")
+        session = CollaborationSession.objects.create(language="cpp", code="newest", revision=5, created_by=user)
+
+        # Another process already wrote revision 5; this one is late with 3
+        session_buffer._write(session.token, {"code": "older", "revision": 3, "language": "python"})
+        session.refresh_from_db()
+        self.assertEqual((session.code, session.revision, session.language), ("newest", 5, "python"))
+
+        session_buffer._write(session.token, {"code": "newer", "revision": 6})
+        session.refresh_from_db()
+        self.assertEqual((session.code, session.revision), ("newer", 6))
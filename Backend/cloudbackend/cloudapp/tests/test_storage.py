@@ -0,0 +1,129 @@
+import base64
+import zlib
+from collections import OrderedDict
+from unittest import mock
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from cloudapp import fields, problem_store
+from cloudapp.models import CollaborationSession, ProblemStatement
+
+BIG = "int main() { return 0; }\n" * 100
+
+
+def raw_column(session, column):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {column} FROM cloudapp_collaborationsession WHERE id = %s", [session.id])
+        return cursor.fetchone()[0]
+
+
+class CompressTextTests(SimpleTestCase):
+
+    def test_round_trips(self):
+        for text in ("", "short", BIG, "\x01starts with the marker", "\x01zlib\x01looks compressed",
+                     "\x01raw\x01already escaped", "\x01" + BIG):
+            with self.subTest(text=text[:30]):
+                self.assertEqual(fields.decompress_text(fields.compress_text(text)), text)
+
+    def test_large_values_are_compressed_small_ones_kept(self):
+        self.assertEqual(fields.compress_text("short"), "short")
+        self.assertLess(len(fields.compress_text(BIG)), len(BIG) // 10)
+        self.assertTrue(fields.compress_text(BIG).startswith(fields.MARKER_BYTE))
+        self.assertIsNone(fields.compress_text(None))
+
+    def test_marker_prefixed_text_is_escaped(self):
+        self.assertEqual(fields.compress_text("\x01zlib\x01x"), fields.RAW_MARKER + "\x01zlib\x01x")
+
+    def test_legacy_rows_read_back_unchanged(self):
+        # Stored before compression (or before RAW_MARKER) existed
+        for legacy in ("plain code", "\x01 control byte first", "\x01zlib\x01not base64 zlib!",
+                       fields.ZLIB_MARKER + base64.b64encode(b"not zlib").decode()):
+            with self.subTest(legacy=legacy):
+                self.assertEqual(fields.decompress_text(legacy), legacy)
+
+    def test_zlib_rows_read_without_zstandard(self):
+        stored = fields.ZLIB_MARKER + base64.b64encode(zlib.compress(BIG.encode())).decode()
+        with mock.patch.object(fields, "zstandard", None):
+            self.assertEqual(fields.decompress_text(stored), BIG)
+            self.assertTrue(fields.compress_text(BIG).startswith(fields.ZLIB_MARKER))
+
+
+class CompressedFieldTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", password="x")
+
+    def session(self, **values):
+        session = CollaborationSession.objects.create(language="cpp", created_by=self.user, **values)
+        return CollaborationSession.objects.get(id=session.id)
+
+    def test_text_field(self):
+        for code in ("x = 1", BIG, "\x01" + "y" * 10):
+            with self.subTest(code=code[:20]):
+                self.assertEqual(self.session(code=code).code, code)
+        self.assertNotEqual(raw_column(self.session(code=BIG), "code"), BIG)
+
+    def test_json_field(self):
+        big = {"title": "A", "samples": [{"input": "1 2", "output": "3"}] * 100}
+        for value in (None, {"title": "A"}, big, ["\x01", 1], "\x01zlib\x01bare string", 7):
+            with self.subTest(value=str(value)[:30]):
+                self.assertEqual(self.session(code="", problem_data=value).problem_data, value)
+
+    def test_legacy_rows(self):
+        session = self.session(code="")
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE cloudapp_collaborationsession SET code = %s, problem_data = %s WHERE id = %s",
+                ["\x01zlib\x01legacy text", '{"title": "old"}', session.id],
+            )
+        session.refresh_from_db()
+        self.assertEqual((session.code, session.problem_data), ("\x01zlib\x01legacy text", {"title": "old"}))
+
+
+@override_settings(STATEMENT_CACHE_MAX=2)
+class ProblemStoreTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(problem_store, "_statements", OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def problem(self, statement="<p>Sum a and b</p>", **extra):
+        return dict({"title": "A. Sum", "statement": statement, "samples": []}, **extra)
+
+    def test_identical_statements_are_stored_once(self):
+        first = problem_store.pack_problem(self.problem())
+        second = problem_store.pack_problem(self.problem(title="A. Sum (mirror)"))
+        problem_store._statements.clear()
+        third = problem_store.pack_problem(self.problem())   # dedupe against the row, not the cache
+
+        self.assertEqual(ProblemStatement.objects.count(), 1)
+        self.assertNotIn("statement", first)
+        self.assertEqual(first[problem_store.REF_KEY], second[problem_store.REF_KEY])
+        self.assertEqual(third, first)
+
+    def test_unpack_round_trip_from_cache_and_db(self):
+        packed = problem_store.pack_problem(self.problem())
+        self.assertEqual(problem_store.unpack_problem(packed), self.problem())
+
+        problem_store._statements.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(problem_store.unpack_problem(packed), self.problem())
+        with self.assertNumQueries(0):
+            problem_store.unpack_problem(packed)
+
+    def test_cache_is_bounded(self):
+        for n in range(3):
+            problem_store.pack_problem(self.problem(statement=f"<p>{n}</p>"))
+        self.assertEqual(list(problem_store._statements.values()), ["<p>1</p>", "<p>2</p>"])
+
+    def test_unpacked_and_foreign_values_pass_through(self):
+        for value in (None, {"title": "no statement"}, ["list"]):
+            self.assertEqual(problem_store.pack_problem(value), value)
+            self.assertEqual(problem_store.unpack_problem(value), value)
+
+    def test_missing_statement_row(self):
+        packed = problem_store.pack_problem(self.problem())
+        ProblemStatement.objects.all().delete()
+        problem_store._statements.clear()
+        self.assertEqual(problem_store.unpack_problem(packed)["statement"], "")
@@ -16,13 +16,25 @@ urlpatterns = [
 
     # Collaboration route
     path('api/sessions/create/', views.create_session, name='create_session'),
+    path('api/sessions/<uuid:token>/history/', views.session_history, name='session_history'),
+    path('api/sessions/<uuid:token>/revisions/<int:revision>/', views.session_revision, name='session_revision'),
 
     # Codeforces route
     # path('api/codeforces/fetch/', create_session_view.fetch_codeforces_problem, name='fetch_codeforces_problem')
     path('api/codeforces/fetch/', views.fetch_codeforces_problem, name='fetch_codeforces_problem'),
+    path('api/codeforces/prefetch/', views.prefetch_codeforces_problems, name='prefetch_codeforces_problems'),
 
     path('api/auth/request-reset-email/', views.RequestPasswordResetEmail.as_view(), name='request-reset-email'),
     path('api/auth/password-reset-complete/', views.SetNewPassword.as_view(), name='password-reset-complete'),
 
     path('api/ai/generate/', views.generate_code_with_ai, name='generate_ai'),
+    path('api/ai/stream/', views.stream_code_with_ai, name='stream_ai'),
+    path('api/ai/edit/', views.edit_code_with_ai, name='edit_ai'),
+
+    # Code execution
+    path('api/execute/', views.execute_code, name='execute_code'),
+    path('api/judge/', views.judge_samples, name='judge_samples'),
+
+    # Runtime metrics
+    path('api/metrics/', views.metrics, name='metrics'),
 ]
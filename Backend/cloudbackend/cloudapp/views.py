@@ -1,7 +1,5 @@
-import cloudscraper
-from bs4 import BeautifulSoup
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.auth.models import User
@@ -9,17 +7,22 @@ from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.utils.encoding import force_bytes, force_str
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.core.mail import send_mail
+from django.http import JsonResponse, StreamingHttpResponse
+from channels.layers import get_channel_layer
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
-from .models import CollaborationSession
+from .models import CollaborationSession, SessionSnapshot
+from . import admission, ai, ai_edits, build_cache, codec, codeforces, edit_log, executor, fields, judge, ot, outbound, presence, problem_store, room_runs, room_sync, session_buffer
+from .consumers import load_session_state, save_room_fields, send_to_room
+from .jwt_auth import json_post
+from .room_cache import room_states
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from google import genai
 from django.conf import settings
+import asyncio
 import ssl
 import urllib3
-import os
 
 # 1. Disable the annoying terminal warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -45,17 +48,96 @@ def create_session(request):
         language=language,
         created_by=request.user
     )
+    # Revision 0, the base every later revision is rebuilt from
+    SessionSnapshot.objects.create(session=session, revision=0, code=initial_code)
     return Response({'token': session.token}, status=status.HTTP_201_CREATED)
 
-#Codeforces Fetcher
-@api_view(["POST"])
+#Session History
+# Ops a client missed since ?since=N (instead of refetching the whole file),
+# and the code as it was at any revision.
+def current_revision(token):
+    document = ot.get_document(token)
+    if document is not None:
+        return document.revision
+    pending = session_buffer.pending_fields(token)
+    if "revision" in pending:
+        return pending["revision"]
+    return CollaborationSession.objects.filter(token=token).values_list("revision", flat=True).first()
+
+
+@api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def fetch_codeforces_problem(request):
-    contest_id = request.data.get("contest_id")
-    problem_index = request.data.get("problem_index")
+def session_history(request, token):
+    token = str(token)
+    try:
+        since = int(request.query_params.get('since', 0))
+    except ValueError:
+        return Response({"error": "since must be an integer"}, status=400)
+
+    rev = current_revision(token)
+    if rev is None:
+        return Response({"error": "Session not found"}, status=404)
+    if since > rev:
+        return Response({"error": "since is ahead of the session"}, status=400)
+
+    entries = edit_log.ops_since(token, since, rev)
+    if entries is None:
+        return Response({"error": "History no longer reaches that revision"}, status=410)
+    return Response({"rev": rev, "entries": entries}, status=200)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def session_revision(request, token, revision):
+    token = str(token)
+    rev = current_revision(token)
+    if rev is None:
+        return Response({"error": "Session not found"}, status=404)
+    if revision > rev:
+        return Response({"error": "No such revision yet"}, status=404)
+
+    try:
+        code = edit_log.rebuild(token, revision)
+    except ValueError as e:
+        # A logged op doesn't fit the text it should apply to
+        print(f"Rebuilding {token}@{revision} failed: {e}")
+        return Response({"error": "History for that revision is inconsistent"}, status=409)
+    if code is None:
+        return Response({"error": "History no longer reaches that revision"}, status=410)
+    return Response({"rev": revision, "code": code}, status=200)
+
+#Runtime Metrics (staff only)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    channel_layer = get_channel_layer()
+    return Response({
+        'session_writes': session_buffer.get_stats(),
+        'room_cache': room_states.get_stats(),
+        'presence': presence.get_stats(),
+        'outbound': outbound.get_stats(),
+        'codeforces_cache': codeforces.get_stats(),
+        'execution': executor.get_stats(),
+        'build_cache': build_cache.get_stats(),
+        'judge': judge.get_stats(),
+        'room_runs': room_runs.get_stats(),
+        'ai': ai.get_stats(),
+        'edit_log': edit_log.get_stats(),
+        'room_sync': room_sync.get_stats(),
+        'storage': dict(fields.get_stats(), statements=problem_store.get_stats()),
+        'channel_layer': channel_layer.get_stats() if hasattr(channel_layer, 'get_stats') else None,
+    }, status=200)
+
+#Codeforces Fetcher
+# Plain async Django view (DRF views are sync): the upstream wait happens on
+# the event loop instead of tying up a threadpool worker.
+@json_post()
+async def fetch_codeforces_problem(request, user, body):
+    contest_id = body.get("contest_id")
+    problem_index = body.get("problem_index")
 
     if not contest_id or not problem_index:
-        return Response(
+        return JsonResponse(
             {"error": "contest_id and problem_index required"},
             status=400
         )
@@ -63,99 +145,122 @@ def fetch_codeforces_problem(request):
     contest_id = str(contest_id).strip()
     problem_index = str(problem_index).strip()
 
-    url = f"https://codeforces.com/problemset/problem/{contest_id}/{problem_index}"
-    print(f"Attempting to fetch: {url}")
-
     try:
-        scraper = cloudscraper.create_scraper() 
-        response = scraper.get(url, timeout=15)
-        
-        if response.status_code != 200:
-             return Response({"error": f"Codeforces returned status {response.status_code}"}, status=502)
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        #Codeforces images
-        for img in soup.find_all('img'):
-            src = img.get('src', '')
-            if src.startswith('//'):
-                img['src'] = f'https:{src}'
-            elif src.startswith('/'):
-                img['src'] = f'https://codeforces.com{src}'
-            
-            #Add styles to stablize large diagrams
-            img['style'] = 'max-width: 100%; height: auto; display: block; margin: 10px auto;'
-
-        #Extract Title
-        title_element = soup.select_one(".problem-statement .header .title")
-        if not title_element:
-            return Response({"error": "Failed to parse problem data."}, status=502)
-        title = title_element.get_text(strip=True)
-
-        #Extract HTML Statement (Story + Input + Output + Note)
-        statement_html_parts = []
-        problem_node = soup.select_one(".problem-statement")
-        
-        if problem_node:
-            #The Story
-            for child in problem_node.children:
-                if child.name == 'div':
-                    classes = child.get('class', [])
-                    # Skip header and specs sections
-                    if any(c in classes for c in ['header', 'input-specification', 'output-specification', 'sample-tests', 'note']):
-                        continue
-                
-                if child.name and child.name != 'script':
-                    # str(child) preserves HTML tags like <p>, <ul>, and <img>
-                    statement_html_parts.append(str(child))
-
-            #formatting sections
-            def add_section(cls_name, title_override=None):
-                section = problem_node.select_one(f".{cls_name}")
-                if section:
-                    #codeforces title
-                    section_title = section.select_one(".section-title")
-                    if section_title:
-                        section_title.name = "h4"
-                        section_title['style'] = "margin-top: 16px; margin-bottom: 8px; font-weight: bold; font-size: 1.1em; color: #90cdf4;"
-                    
-                    statement_html_parts.append(str(section))
-
-            #Sections
-            add_section("input-specification")
-            add_section("output-specification")
-            add_section("note")
-        
-        statement_html = "".join(statement_html_parts)
-
-        #Extract Samples testcases
-        samples = []
-        inputs = soup.select(".input pre")
-        outputs = soup.select(".output pre")
-        
-        count = min(len(inputs), len(outputs))
-        for i in range(count):
-            input_text = inputs[i].get_text(separator='\n', strip=True)
-            output_text = outputs[i].get_text(separator='\n', strip=True)
-            samples.append({
-                "input": input_text,
-                "output": output_text
-            })
-
-        data = {
-            "title": title,
-            "statement": statement_html, # Now sending HTML
-            "url": url,
-            "samples": samples
-        }
-        
-        print("Successfully fetched problem!")
-        return Response(data, status=200)
-
+        # Memory / DB cache first; concurrent misses share one upstream fetch
+        data = await codeforces.get_problem_async(contest_id, problem_index)
+        return JsonResponse(data, status=200)
+
+    except codeforces.UpstreamError as e:
+        return JsonResponse({"error": f"Codeforces returned status {e.status}"}, status=502)
+    except codeforces.ParseError:
+        return JsonResponse({"error": "Failed to parse problem data."}, status=502)
     except Exception as e:
         print(f"Scraping exception: {str(e)}")
-        return Response({"error": str(e)}, status=500)
+        return JsonResponse({"error": str(e)}, status=500)
     
+#Bulk Codeforces Prefetch
+# Takes {"contest_id": ...} and/or {"problems": ["1850A", ...]} and stores the
+# problems in the local table so a contest start doesn't hit Codeforces.
+# Staff only, like the metrics endpoint.
+@json_post(staff_only=True)
+async def prefetch_codeforces_problems(request, user, body):
+    try:
+        keys = [codeforces.parse_problem_code(code) for code in body.get("problems") or []]
+        if body.get("contest_id"):
+            keys += await codeforces.contest_problem_keys(str(body["contest_id"]).strip())
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except (codeforces.UpstreamError, codeforces.ParseError) as e:
+        return JsonResponse({"error": str(e)}, status=502)
+
+    if not keys:
+        return JsonResponse({"error": "contest_id or problems required"}, status=400)
+    if len(keys) > settings.CODEFORCES_PREFETCH_MAX:
+        return JsonResponse({"error": f"At most {settings.CODEFORCES_PREFETCH_MAX} problems per request"}, status=400)
+
+    results = await codeforces.prefetch_problems(keys)
+    return JsonResponse({"results": results}, status=200)
+
+#Code Execution
+# Same request/response shape as Piston's /execute, served from local
+# sandbox workers.
+@json_post()
+async def execute_code(request, user, body):
+    language = body.get("language")
+    code = body.get("code")
+    files = body.get("files")
+    if code is None and files is not None:
+        # Piston shape: {"files": [{"content": ...}, ...]}; the first file is the program
+        if not isinstance(files, list) or not files or not isinstance(files[0], dict):
+            return JsonResponse({"error": "files must be a list of {\"content\": ...}"}, status=400)
+        code = files[0].get("content")
+    if not language or not isinstance(code, str):
+        return JsonResponse({"error": "language and code required"}, status=400)
+
+    try:
+        result = await executor.execute(language, code, body.get("stdin") or "", user_id=user.pk)
+        return JsonResponse(result, status=200)
+
+    except executor.SandboxUnavailable as e:
+        return JsonResponse({"error": str(e)}, status=503)
+    except executor.ExecutionError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except executor.QueueTimeout:
+        return JsonResponse({"error": "Too many runs in progress, try again shortly."}, status=429)
+    except Exception as e:
+        print(f"Execution error: {e}")
+        return JsonResponse({"error": "Execution failed"}, status=500)
+
+#Sample Judge
+# Takes {"token": ...} to judge the room's current code against its stored
+# problem samples, or {"language", "code", "samples": [{"input", "output"}]}.
+# Streams one JSON object per line (compile, test..., done) as results land.
+@json_post()
+async def judge_samples(request, user, body):
+    if body.get("token"):
+        state = await room_states.get(str(body["token"]), load_session_state)
+        if state is None:
+            return JsonResponse({"error": "Session not found"}, status=404)
+        language, code = state["language"], state["code"]
+        samples = (state.get("problem_data") or {}).get("samples")
+    else:
+        language, code, samples = body.get("language"), body.get("code"), body.get("samples")
+
+    if language not in executor.LANGUAGES:
+        return JsonResponse({"error": f"Unsupported language: {language}"}, status=400)
+    if not isinstance(code, str):
+        return JsonResponse({"error": "language and code required"}, status=400)
+    if not isinstance(samples, list) or not samples or not all(
+        isinstance(s, dict) and isinstance(s.get("input"), str) and isinstance(s.get("output"), str)
+        for s in samples
+    ):
+        return JsonResponse({"error": "No samples to judge"}, status=400)
+    if len(samples) > settings.JUDGE_MAX_TESTS:
+        return JsonResponse({"error": f"At most {settings.JUDGE_MAX_TESTS} tests per request"}, status=400)
+    for field in ("time_limit", "memory_limit"):
+        value = body.get(field)
+        if value is not None and (
+            not isinstance(value, (int, float)) or isinstance(value, bool) or not 0 < value < float("inf")
+        ):
+            return JsonResponse({"error": f"{field} must be a positive number"}, status=400)
+
+    async def events():
+        try:
+            async for event in judge.judge(
+                language, code, samples, user_id=user.pk,
+                time_limit=body.get("time_limit"), memory_mb=body.get("memory_limit"),
+            ):
+                yield codec.dumps(event) + "\n"
+        except executor.QueueTimeout:
+            yield codec.dumps({"event": "error", "error": "Too many runs in progress, try again shortly."}) + "\n"
+        except executor.SandboxUnavailable as e:
+            yield codec.dumps({"event": "error", "error": str(e)}) + "\n"
+        except Exception as e:
+            print(f"Judge error: {e}")
+            yield codec.dumps({"event": "error", "error": "Judging failed"}) + "\n"
+
+    return StreamingHttpResponse(events(), content_type="application/x-ndjson")
+
 #Request Reset View Link
 class RequestPasswordResetEmail(APIView):
     permission_classes = [AllowAny] # Anyone can request a reset
@@ -218,57 +323,142 @@ class SetNewPassword(APIView):
 
 
 
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
-def generate_code_with_ai(request):
-    prompt = request.data.get('prompt')
-    current_code = request.data.get('code')
-    language = request.data.get('language')
-    problem_context = request.data.get('problem_context')
+@json_post()
+async def generate_code_with_ai(request, user, body):
+    prompt = body.get('prompt')
+    current_code = body.get('code')
+    language = body.get('language')
+    problem_context = body.get('problem_context')
 
     if not prompt:
-        return Response({"error": "Prompt is required"}, status=400)
+        return JsonResponse({"error": "Prompt is required"}, status=400)
 
     try:
-        # 1. Initialize the NEW GenAI Client
+        generated_code = await ai.generate_code(prompt, current_code, language, problem_context, user_id=user.pk)
+        return JsonResponse({'generated_code': generated_code}, status=200)
+
+    except admission.Rejected:
+        response = JsonResponse({"error": "The AI assistant is busy, try again shortly."}, status=429)
+        response["Retry-After"] = str(int(settings.AI_QUEUE_TIMEOUT))
+        return response
+    except ai.errors.APIError as e:
+        print(f"AI Error: {e}")
+        status_code = 503 if e.code in ai.RETRY_STATUSES else 502
+        return JsonResponse({"error": "Failed to generate code"}, status=status_code)
+    except Exception as e:
+        print(f"AI Error: {e}")
+        return JsonResponse({"error": "Failed to generate code"}, status=500)
 
-        client = genai.Client(api_key=os.getenv("GEMINI_API_KEY")) 
-        
-        # 2. Build the System Prompt
-        system_instruction = f"You are an expert coding assistant. The user is writing code in {language}.\n"
-        
-        if problem_context:
-            system_instruction += f"The user is solving this problem: {problem_context}\n\n"
-            
-        full_prompt = f"""
-        {system_instruction}
-        Here is their current code:
-        ```
-        {current_code}
-        ```
-        User Request: "{prompt}"
-        
-        Instructions:
-        1. Return ONLY the full, updated code. 
-        2. Do not include markdown backticks (```) or language names in the response.
-        3. Do not add conversational text like "Here is the code". Just the code.
-        """
-
-        # 3. Generate Content using the NEW syntax
-        response = client.models.generate_content(
-            model='gemini-2.5-flash', # Upgraded to the faster 2.5-flash model
-            contents=full_prompt,
-        )
-        
-        # 4. Clean up response
-        generated_code = response.text.strip()
-        if generated_code.startswith("```"):
-            generated_code = generated_code.split("\n", 1)[1] # Remove first line
-        if generated_code.endswith("```"):
-            generated_code = generated_code.rsplit("\n", 1)[0] # Remove last line
 
-        return Response({'generated_code': generated_code}, status=200)
+#Streaming AI Generation
+# Same inputs as /api/ai/generate/ (plus an optional room "token"); relays
+# the model's output as server-sent events while it is generated. With a
+# token, collaborators get the same chunks as ai_delta frames on the room
+# socket. The upstream generation is closed if the client disconnects.
+def sse(event, data):
+    return f"event: {event}\ndata: {codec.dumps(data)}\n\n"
+
+
+@json_post()
+async def stream_code_with_ai(request, user, body):
+    prompt = body.get('prompt')
+    if not prompt:
+        return JsonResponse({"error": "Prompt is required"}, status=400)
+    room = body.get('token')
+
+    async def events():
+        stream = ai.stream_code(
+            prompt, body.get('code'), body.get('language'), body.get('problem_context'), user_id=user.pk
+        )
+        parts = []
+        try:
+            if room:
+                await send_to_room(room, {"type": "ai_started", "prompt": prompt}, user.username)
+            async for text in stream:
+                parts.append(text)
+                yield sse("delta", {"text": text})
+                if room:
+                    await send_to_room(room, {"type": "ai_delta", "text": text}, user.username)
+
+            generated_code = ai.clean_code("".join(parts))
+            yield sse("done", {"generated_code": generated_code})
+            if room:
+                await send_to_room(room, {"type": "ai_finished", "generated_code": generated_code}, user.username)
+
+        except asyncio.CancelledError:
+            # Requester went away; tell the room the rewrite won't finish
+            if room:
+                await send_to_room(room, {"type": "ai_finished", "error": "cancelled"}, user.username)
+            raise
+        except admission.Rejected:
+            yield sse("error", {"error": "The AI assistant is busy, try again shortly."})
+            if room:
+                await send_to_room(room, {"type": "ai_finished", "error": "busy"}, user.username)
+        except Exception as e:
+            print(f"AI Error: {e}")
+            yield sse("error", {"error": "Failed to generate code"})
+            if room:
+                await send_to_room(room, {"type": "ai_finished", "error": "failed"}, user.username)
+        finally:
+            await stream.aclose()
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # let proxies pass chunks straight through
+    return response
+
+
+#AI Edits
+# Takes {"token", "prompt", "problem_context"?}. The model answers with an
+# edit list for the room's current code instead of the whole file; the edits
+# become editor ops that are rebased onto anything typed meanwhile, saved and
+# broadcast to the room as a normal code_ops frame. Returns {"mode": "ops"}
+# then, or {"mode": "full", "generated_code"} when the edits don't apply
+# cleanly or the room isn't live in this process.
+@json_post()
+async def edit_code_with_ai(request, user, body):
+    prompt = body.get('prompt')
+    room = str(body.get('token') or '')
+    problem_context = body.get('problem_context')
+    if not prompt or not room:
+        return JsonResponse({"error": "Prompt and token are required"}, status=400)
+
+    state = await room_states.get(room, load_session_state)
+    if state is None:
+        return JsonResponse({"error": "Session not found"}, status=404)
+
+    document = ot.get_document(room)
+    if document is not None:
+        await room_sync.catch_up(room, document)
+    code = document.code if document is not None else state["code"]
+    base_rev = document.revision if document is not None else None
+    language = state["language"]
 
+    try:
+        try:
+            if document is None:
+                raise ai_edits.PatchError("room is not live in this process")
+            answer = await ai.generate_edits(prompt, code, language, problem_context, user_id=user.pk)
+            ops = ai_edits.edits_to_ops(code, ai_edits.parse_edits(answer))
+            rev, ops = await room_sync.commit(room, document, base_rev, ops)
+        except (ai_edits.PatchError, ValueError, ot.StaleRevision, room_sync.Unavailable) as e:
+            print(f"AI edits fell back to full file: {e}")
+            generated_code = await ai.generate_code(prompt, code, language, problem_context, user_id=user.pk)
+            return JsonResponse({'mode': 'full', 'generated_code': generated_code}, status=200)
+
+        edit_log.record(room, rev, ops, document.code, user.username)
+        save_room_fields(room, code=document.code, revision=rev)
+        await send_to_room(room, {"type": "code_ops", "rev": rev, "ops": ops}, user.username)
+        return JsonResponse({'mode': 'ops', 'rev': rev, 'ops': ops}, status=200)
+
+    except admission.Rejected:
+        response = JsonResponse({"error": "The AI assistant is busy, try again shortly."}, status=429)
+        response["Retry-After"] = str(int(settings.AI_QUEUE_TIMEOUT))
+        return response
+    except ai.errors.APIError as e:
+        print(f"AI Error: {e}")
+        status_code = 503 if e.code in ai.RETRY_STATUSES else 502
+        return JsonResponse({"error": "Failed to generate code"}, status=status_code)
     except Exception as e:
         print(f"AI Error: {e}")
-        return Response({"error": "Failed to generate code"}, status=500)
\ No newline at end of file
+        return JsonResponse({"error": "Failed to generate code"}, status=500)
@@ -85,17 +85,124 @@ ASGI_APPLICATION = "cloudbackend.asgi.application"
 #         # ----------------------------------------------------
 #     }
 # }
+# Room groups are spread over the Redis hosts in CHANNEL_REDIS_URLS
+# (comma-separated) by consistent hashing; one host behaves like the plain
+# RedisChannelLayer. Members in the same process skip Redis entirely.
+# See cloudapp/channel_layers.py.
+CHANNEL_REDIS_URLS = [
+    url.strip()
+    for url in os.getenv("CHANNEL_REDIS_URLS", os.getenv("UPSTASH_REDIS_URL") or "").split(",")
+    if url.strip()
+]
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "cloudapp.channel_layers.HybridChannelLayer",
         "CONFIG": {
-            # In local dev, this points to your local Redis.
-            # In production, you will change this to your Cloud Redis URL!
-            "hosts": [os.getenv("UPSTASH_REDIS_URL")], 
+            "inner": {
+                "BACKEND": "cloudapp.channel_layers.ShardedChannelLayer",
+                "CONFIG": {
+                    # In local dev, this points to your local Redis.
+                    # In production, you will change this to your Cloud Redis URL(s)!
+                    "shards": [{"hosts": [url]} for url in CHANNEL_REDIS_URLS] or [{"hosts": [None]}],
+                    # A node channel carries every room the process hosts
+                    "channel_capacity": {"hybrid.*": 1000},
+                },
+            },
         },
     },
 }
 
+# Seconds the websocket consumer buffers session writes before flushing them
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "2.0"))
+EDIT_SNAPSHOT_EVERY = int(os.getenv("EDIT_SNAPSHOT_EVERY", "100"))        # revisions between full-code snapshots
+STORAGE_COMPRESS_MIN_BYTES = int(os.getenv("STORAGE_COMPRESS_MIN_BYTES", "1024"))  # compress code/problem columns above this
+STATEMENT_CACHE_MAX = int(os.getenv("STATEMENT_CACHE_MAX", "256"))         # problem statements kept in memory
+
+# Redis hosts holding each room's shared revision log (cloudapp/room_sync.py),
+# sharded like the channel layer. Defaults to the channel layer's hosts; with
+# none, every process assigns revisions on its own (single process only).
+ROOM_SYNC_REDIS_URLS = [
+    url.strip()
+    for url in os.getenv("ROOM_SYNC_REDIS_URLS", ",".join(CHANNEL_REDIS_URLS)).split(",")
+    if url.strip()
+]
+ROOM_SYNC_TTL = int(os.getenv("ROOM_SYNC_TTL", "86400"))   # seconds a room's log outlives its last edit
+
+# Snapshot cache for rooms joining over the websocket
+ROOM_CACHE_MAX_ROOMS = int(os.getenv("ROOM_CACHE_MAX_ROOMS", "1000"))
+ROOM_CACHE_TTL = float(os.getenv("ROOM_CACHE_TTL", "300"))
+
+# Seconds between aggregated presence (cursor/selection/typing) frames
+PRESENCE_TICK = float(os.getenv("PRESENCE_TICK", "0.075"))
+
+# Accept the msgpack websocket subprotocol (codec.BINARY_SUBPROTOCOL) from
+# clients that offer it. The bundled editor only speaks JSON, so this is off
+# unless a binary client is deployed alongside it.
+EDITOR_BINARY_PROTOCOL = os.getenv("EDITOR_BINARY_PROTOCOL") == "True"
+
+# Websocket auth: how long a JWT-authenticated user stays cached per user id
+WS_USER_CACHE_TTL = float(os.getenv("WS_USER_CACHE_TTL", "60"))
+WS_USER_CACHE_MAX = int(os.getenv("WS_USER_CACHE_MAX", "10000"))
+
+# Codeforces problem cache: served as-is while fresh, served + refreshed in the
+# background while stale, refetched after that. The fetcher is pluggable so it
+# can point at a local fixture server.
+CODEFORCES_BASE_URL = os.getenv("CODEFORCES_BASE_URL", "https://codeforces.com")
+CODEFORCES_ASYNC_FETCHER = os.getenv("CODEFORCES_ASYNC_FETCHER", "cloudapp.codeforces.fetch_problem_html_async")
+# Max concurrent upstream requests per host from the async fetch path
+CODEFORCES_HOST_CONCURRENCY = int(os.getenv("CODEFORCES_HOST_CONCURRENCY", "4"))
+CODEFORCES_FRESH_TTL = float(os.getenv("CODEFORCES_FRESH_TTL", str(24 * 3600)))
+CODEFORCES_STALE_TTL = float(os.getenv("CODEFORCES_STALE_TTL", str(30 * 24 * 3600)))
+CODEFORCES_CACHE_MAX = int(os.getenv("CODEFORCES_CACHE_MAX", "512"))
+# Statement parser engine: "auto" (lxml when installed), "lxml" or "bs4"
+CODEFORCES_PARSER = os.getenv("CODEFORCES_PARSER", "auto")
+# Max problems per /api/codeforces/prefetch/ request
+CODEFORCES_PREFETCH_MAX = int(os.getenv("CODEFORCES_PREFETCH_MAX", "50"))
+
+# Local code execution (cloudapp/executor.py)
+EXECUTION_POOL_SIZE = int(os.getenv("EXECUTION_POOL_SIZE", "2"))           # warm workers per language
+EXECUTION_MAX_CONCURRENCY = int(os.getenv("EXECUTION_MAX_CONCURRENCY", "4"))
+EXECUTION_PER_USER = int(os.getenv("EXECUTION_PER_USER", "2"))             # concurrent runs per user
+EXECUTION_QUEUE_TIMEOUT = float(os.getenv("EXECUTION_QUEUE_TIMEOUT", "10"))
+EXECUTION_TIME_LIMIT = int(os.getenv("EXECUTION_TIME_LIMIT", "5"))          # CPU seconds per run
+EXECUTION_MEMORY_MB = int(os.getenv("EXECUTION_MEMORY_MB", "256"))
+EXECUTION_OUTPUT_LIMIT = int(os.getenv("EXECUTION_OUTPUT_LIMIT", str(64 * 1024)))
+EXECUTION_ROOT = os.getenv("EXECUTION_ROOT") or None                       # scratch dirs; system temp if unset
+# The sandbox launcher starts as root, sets up namespaces and a read-only
+# root, then runs programs as this otherwise unused uid/gid. Prefix the
+# launcher command (e.g. "sudo -n") when the server itself isn't root.
+EXECUTION_LAUNCHER_PREFIX = os.getenv("EXECUTION_LAUNCHER_PREFIX", "").split()
+EXECUTION_SANDBOX_UID = int(os.getenv("EXECUTION_SANDBOX_UID", "61000"))
+EXECUTION_SANDBOX_GID = int(os.getenv("EXECUTION_SANDBOX_GID", "61000"))
+EXECUTION_SANDBOX_NPROC = int(os.getenv("EXECUTION_SANDBOX_NPROC", "256"))  # processes/threads across all sandboxed runs
+EXECUTION_SANDBOX_BINDS = os.getenv("EXECUTION_SANDBOX_BINDS", "/usr,/bin,/sbin,/lib,/lib32,/lib64,/etc").split(",")  # mounted read-only
+EXECUTION_BUILD_CACHE_DIR = os.getenv("EXECUTION_BUILD_CACHE_DIR") or None  # compiled programs, private to the server; ~/.cache/codemate-builds if unset
+EXECUTION_BUILD_CACHE_MB = int(os.getenv("EXECUTION_BUILD_CACHE_MB", "256"))
+JUDGE_MAX_TESTS = int(os.getenv("JUDGE_MAX_TESTS", "20"))                 # tests per judge request
+RUN_FLUSH_INTERVAL = float(os.getenv("RUN_FLUSH_INTERVAL", "0.05"))        # seconds between streamed output frames
+RUN_CHUNK_BYTES = int(os.getenv("RUN_CHUNK_BYTES", "8192"))               # flush early once this much is waiting
+
+# Per-socket send queues (cloudapp/outbound.py)
+OUTBOUND_HIGH_WATER = int(os.getenv("OUTBOUND_HIGH_WATER", "200"))        # queued frames before a socket's edits collapse to a room_state
+OUTBOUND_MAX_BYTES = int(os.getenv("OUTBOUND_MAX_BYTES", "4194304"))      # queued bytes before a socket is dropped
+OUTBOUND_SLOW_TIMEOUT = float(os.getenv("OUTBOUND_SLOW_TIMEOUT", "15"))   # seconds a socket may stay lagging
+OUTBOUND_WINDOW = int(os.getenv("OUTBOUND_WINDOW", "100"))               # revisions sent ahead of what the client reports applied
+OUTBOUND_CLOSE_GRACE = float(os.getenv("OUTBOUND_CLOSE_GRACE", "1.0"))    # wait for queued frames before a server-side close
+
+# Gemini (cloudapp/ai.py)
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL") or None                     # e.g. a local fake model server
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "600"))                     # seconds a generated answer is reused
+AI_CACHE_MAX = int(os.getenv("AI_CACHE_MAX", "256"))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))            # model calls in flight per process
+AI_PER_USER = int(os.getenv("AI_PER_USER", "2"))
+AI_MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", "32"))                        # waiting calls beyond that get a 429
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "20"))
+AI_RETRIES = int(os.getenv("AI_RETRIES", "3"))                             # on upstream 429/503
+AI_RETRY_BASE = float(os.getenv("AI_RETRY_BASE", "0.5"))
+AI_RETRY_CAP = float(os.getenv("AI_RETRY_CAP", "8"))
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -1,11 +1,178 @@
-from playwright.async_api import async_playwright
+import asyncio
+import time
+
+# Optional: only needed when this fetcher is configured
+try:
+    from playwright.async_api import async_playwright
+except ImportError:
+    async_playwright = None
+
+# Warm pool of headless Firefox instances shared by every fetch in the process.
+# Each fetch gets a fresh context (cookies/storage isolated) on a pooled browser;
+# browsers are health-checked on checkout and relaunched after MAX_PAGES pages.
+# Launches made for a request count against that request's deadline, so a
+# hung Firefox start surfaces as PoolTimeout instead of blocking the caller.
+# A slot freed while requests are waiting for a browser is relaunched in the
+# background; the waiters stay bounded by their own deadlines.
+POOL_SIZE = 2
+MAX_PAGES = 50
+QUEUE_TIMEOUT = 30
+
+
+class PoolTimeout(Exception):
+    """No browser became free before the request's deadline."""
+
+
+class _PooledBrowser:
+    def __init__(self, browser):
+        self.browser = browser
+        self.pages = 0
+
+
+class BrowserPool:
+    def __init__(self, size=POOL_SIZE, max_pages=MAX_PAGES):
+        self.size = size
+        self.max_pages = max_pages
+        self._playwright = None
+        self._idle = asyncio.Queue()
+        self._launched = 0
+        self._waiting = 0       # acquire() calls waiting for an idle browser
+        self._refills = set()   # background _fill() tasks
+        self._lock = asyncio.Lock()
+        self.stats = {"launches": 0, "recycled": 0, "unhealthy": 0, "timeouts": 0}
+
+    async def start(self, deadline=None):
+        """Launch the whole pool up front so the first requests don't pay for it."""
+        if deadline is None:
+            await self._fill()
+        else:
+            await self._until(self._fill(), deadline)
+
+    async def _fill(self):
+        async with self._lock:
+            if self._playwright is None:
+                if async_playwright is None:
+                    raise RuntimeError("playwright is required for the browser fetcher")
+                self._playwright = await async_playwright().start()
+            while self._launched < self.size:
+                pooled = await self._launch()
+                self._launched += 1
+                self._idle.put_nowait(pooled)
+
+    async def _launch(self):
+        self.stats["launches"] += 1
+        browser = await self._playwright.firefox.launch(headless=True)
+        return _PooledBrowser(browser)
+
+    def _free_slot(self):
+        self._launched -= 1
+        if self._waiting:
+            task = asyncio.ensure_future(self._refill())
+            self._refills.add(task)
+            task.add_done_callback(self._refills.discard)
+
+    async def _refill(self):
+        try:
+            await self._fill()
+        except Exception as e:
+            print(f"Browser pool refill failed: {e}")
+
+    async def _replace(self, pooled):
+        try:
+            await pooled.browser.close()
+        except Exception:
+            pass
+        return await self._launch()
+
+    async def _until(self, awaitable, deadline):
+        try:
+            return await asyncio.wait_for(awaitable, timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise PoolTimeout()
+
+    async def acquire(self, deadline):
+        if self._launched < self.size and self._idle.empty():
+            # Fill the pool (first use, or slots given back by release)
+            await self.start(deadline)
+
+        self._waiting += 1
+        try:
+            pooled = await self._until(self._idle.get(), deadline)
+        finally:
+            self._waiting -= 1
+
+        if not pooled.browser.is_connected():
+            self.stats["unhealthy"] += 1
+            try:
+                pooled = await self._until(self._replace(pooled), deadline)
+            except BaseException:
+                # Give the slot back so the pool doesn't shrink on a failed relaunch
+                self._free_slot()
+                raise
+        return pooled
+
+    async def release(self, pooled):
+        pooled.pages += 1
+        if pooled.pages >= self.max_pages:
+            # Retire it; relaunched now if someone is waiting, else by the next acquire
+            self.stats["recycled"] += 1
+            self._free_slot()
+            try:
+                await pooled.browser.close()
+            except Exception:
+                pass
+            return
+        self._idle.put_nowait(pooled)
+
+    async def run(self, fn, timeout=QUEUE_TIMEOUT):
+        """Run `await fn(page)` on a fresh page from a pooled browser."""
+        pooled = await self.acquire(time.monotonic() + timeout)
+        try:
+            context = await pooled.browser.new_context()
+            try:
+                page = await context.new_page()
+                return await fn(page)
+            finally:
+                await context.close()
+        finally:
+            await self.release(pooled)
+
+    async def close(self):
+        for task in list(self._refills):
+            task.cancel()
+        while not self._idle.empty():
+            pooled = self._idle.get_nowait()
+            await pooled.browser.close()
+        self._launched = 0
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = BrowserPool()
+    return _pool
+
+
+async def fetch_problem_html(url):
+    """Rendered page HTML; usable as settings.CODEFORCES_ASYNC_FETCHER when cloudscraper is blocked."""
+    async def render(page):
+        await page.goto(url, timeout=60000)
+        return await page.content()
+
+    return await get_pool().run(render)
+
 
 async def fetch_codeforces_problem_async(contest_id, problem_index):
     url = f"https://codeforces.com/problemset/problem/{contest_id}/{problem_index}"
 
-    async with async_playwright() as p:
-        browser = await p.firefox.launch(headless=True)
-        page = await browser.new_page()
+    async def scrape(page):
         await page.goto(url, timeout=60000)
 
         title = await page.locator(
@@ -22,10 +189,10 @@ async def fetch_codeforces_problem_async(contest_id, problem_index):
                 "output": outputs[i].strip(),
             })
 
-        await browser.close()
-
         return {
             "title": title,
             "url": url,
             "samples": samples,
         }
+
+    return await get_pool().run(scrape)
@@ -28,6 +28,7 @@ import { FiPlay, FiUsers, FiLink2, FiCpu, FiLogOut } from "react-icons/fi"; // F
 import Output from "./Output";
 import LanguageSelector from "./LanguageSelector";
 import CodeforcesLoader from "./CodeforcesLoader";
+import { DocumentSync, changesToOps, toUtf16 } from "./ot";
 
 // --- Remote Cursor CSS & Classes (Kept exactly as you had them) ---
 const cursorStyles = `
@@ -129,6 +130,9 @@ const CodeEditor = () => {
   const editorRef = useRef(null);
   const wsRef = useRef(null);
   const remoteCursorsRef = useRef(new Map());
+  const syncRef = useRef(null);            // revision bookkeeping for this room's edits
+  const textRef = useRef("");              // editor text before the change being handled
+  const applyingRemoteRef = useRef(false); // set while server ops are written into the editor
   const monaco = useMonaco();
 
   const [value, setValue] = useState("");
@@ -160,6 +164,32 @@ const CodeEditor = () => {
     const ws = new WebSocket(WS_URL);
     wsRef.current = ws;
 
+    // Server ops go straight into the model; handleEditorChange sees the flag
+    // and doesn't send them back
+    const applyRemoteOps = (ops) => {
+      const model = editorRef.current?.getModel();
+      if (!model) return;
+      applyingRemoteRef.current = true;
+      try {
+        ops.forEach((op) => {
+          const text = model.getValue();
+          const start = model.getPositionAt(toUtf16(text, op.pos));
+          const end = op.op === "delete" ? model.getPositionAt(toUtf16(text, op.pos + op.length)) : start;
+          model.applyEdits([{
+            range: new monaco.Range(start.lineNumber, start.column, end.lineNumber, end.column),
+            text: op.op === "insert" ? op.text : "",
+          }]);
+        });
+      } finally {
+        applyingRemoteRef.current = false;
+      }
+    };
+
+    const sync = new DocumentSync((message) => {
+      if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify(message));
+    }, applyRemoteOps);
+    syncRef.current = sync;
+
     ws.onmessage = (event) => {
       if (typeof event.data !== "string") return;
 
@@ -172,18 +202,34 @@ const CodeEditor = () => {
         if (!editor || !username || !monaco) return;
 
         // Create a cursor for the user if they don't have one yet
-        if (!remoteCursorsRef.current.has(username) && payload.type !== "user_left") {
-          remoteCursorsRef.current.set(
-            username,
-            new RemoteCursorManager(editor, monaco, username, getUserColor(username))
-          );
-        }
-
-        const cursorManager = remoteCursorsRef.current.get(username);
+        const getCursorManager = (name) => {
+          if (!remoteCursorsRef.current.has(name)) {
+            remoteCursorsRef.current.set(
+              name,
+              new RemoteCursorManager(editor, monaco, name, getUserColor(name))
+            );
+          }
+          return remoteCursorsRef.current.get(name);
+        };
+
+        // Server frames (room_state, presence, ...) come from "System", which has no cursor
+        const isSystem = username === "System";
+        const cursorManager = isSystem || payload.type === "user_left"
+          ? remoteCursorsRef.current.get(username)
+          : getCursorManager(username);
 
         switch (payload.type) {
-          case "code_change": // MATCHES BACKEND
-            setValue(payload.code);
+          // Edits arrive as ops against a revision (see ./ot.js)
+          case "code_ops":
+            sync.remote(payload.rev, payload.ops);
+            break;
+
+          case "ops_ack":
+            sync.ack(payload.rev);
+            break;
+
+          case "ops_since":
+            (payload.entries || []).forEach((entry) => sync.remote(entry.rev, entry.ops));
             break;
 
           case "language_change": // MATCHES BACKEND
@@ -205,6 +251,17 @@ const CodeEditor = () => {
             }
             break;
 
+          case "presence":
+            // One frame per tick with every member whose cursor/selection changed
+            if (!isSystem) break;
+            (payload.members || []).forEach((member) => {
+              if (!member.username || member.username === "System") return;
+              const manager = getCursorManager(member.username);
+              if (member.selection) manager.updateSelection(member.selection);
+              if (member.position) manager.updateCursor(member.position);
+            });
+            break;
+
           case "user_left":
             if (cursorManager) {
               cursorManager.remove();
@@ -212,12 +269,22 @@ const CodeEditor = () => {
             }
             break;
 
-          case "room_state":
-            // Late joiner magic
+          case "room_state": {
+            // Late joiner magic; also how the server resyncs us
+            const model = editor.getModel();
+            applyingRemoteRef.current = true;
+            try {
+              model.setValue(payload.code || "");
+            } finally {
+              applyingRemoteRef.current = false;
+            }
+            textRef.current = payload.code || "";
             setValue(payload.code || "");
+            sync.reset(payload.rev || 0);
             setLanguage(payload.language || "cpp");
             if (payload.problem) setProblem(payload.problem);
             break;
+          }
 
           case "session_terminated":
             toast({
@@ -240,6 +307,8 @@ const CodeEditor = () => {
     };
     return () => {
       ws.close();
+      sync.close();
+      syncRef.current = null;
       remoteCursorsRef.current.forEach((manager) => manager.remove());
       remoteCursorsRef.current.clear();
     };
@@ -264,7 +333,7 @@ const CodeEditor = () => {
       setAiPrompt("");
 
       // 2. Clear the editor to prepare for the AI typing
-      setValue("");
+      replaceCode("");
 
       // 3. The Typewriter Effect Logic
       let currentIndex = 0;
@@ -274,14 +343,8 @@ const CodeEditor = () => {
           // Grab 3 characters at a time for realistic typing speed
           const chunk = newCode.slice(currentIndex, currentIndex + 3);
 
-          setValue(prev => {
-            const nextValue = prev + chunk;
-            // Broadcast every keystroke over WebSocket! Collaborators see it live!
-            if (isCollaborating && wsRef.current?.readyState === WebSocket.OPEN) {
-              wsRef.current.send(JSON.stringify({ type: "code_update", code: nextValue }));
-            }
-            return nextValue;
-          });
+          // Typed into the editor, so collaborators see every chunk as an edit
+          replaceCode((editorRef.current?.getValue() ?? "") + chunk);
 
           currentIndex += 3;
         } else {
@@ -366,11 +429,41 @@ const CodeEditor = () => {
     });
   };
 
-  const handleEditorChange = (newValue) => {
+  const handleEditorChange = (newValue, event) => {
+    const before = textRef.current;
+    textRef.current = newValue ?? "";
     setValue(newValue);
-    if (isCollaborating && wsRef.current?.readyState === WebSocket.OPEN) {
-      wsRef.current.send(JSON.stringify({ type: "code_change", code: newValue }));
+    // Only what changed goes out, as ops against the last revision we know
+    if (isCollaborating && !applyingRemoteRef.current && event && syncRef.current) {
+      syncRef.current.local(changesToOps(event.changes, before));
+    }
+  };
+
+  // Programmatic edits (language snippets, AI typing) go through the editor
+  // like typing does, so they reach collaborators as ops too
+  const replaceCode = (newCode) => {
+    const editor = editorRef.current;
+    const model = editor?.getModel();
+    if (!model || !monaco) {
+      setValue(newCode);
+      return;
     }
+    const old = model.getValue();
+    const limit = Math.min(old.length, newCode.length);
+    let prefix = 0;
+    while (prefix < limit && old[prefix] === newCode[prefix]) prefix++;
+    let suffix = 0;
+    while (suffix < limit - prefix && old[old.length - 1 - suffix] === newCode[newCode.length - 1 - suffix]) suffix++;
+    // Never cut a surrogate pair in half
+    if (prefix && /[\uD800-\uDBFF]/.test(old[prefix - 1])) prefix--;
+    if (suffix && /[\uDC00-\uDFFF]/.test(old[old.length - suffix])) suffix--;
+
+    const start = model.getPositionAt(prefix);
+    const end = model.getPositionAt(old.length - suffix);
+    editor.executeEdits("codemate", [{
+      range: new monaco.Range(start.lineNumber, start.column, end.lineNumber, end.column),
+      text: newCode.slice(prefix, newCode.length - suffix),
+    }]);
   };
 
   const handleStdinChange = (newValue) => {
@@ -381,7 +474,7 @@ const CodeEditor = () => {
   };
 
   const onSelect = (newLang) => {
-    setLanguage(newLang); setValue(CODE_SNIPPETS[newLang] || "");
+    setLanguage(newLang); replaceCode(CODE_SNIPPETS[newLang] || "");
     if (isCollaborating && wsRef.current?.readyState === WebSocket.OPEN) wsRef.current.send(JSON.stringify({ type: "language_change", language: newLang }));
   };
 
@@ -0,0 +1,215 @@
+// Editor ops in the backend's format (cloudapp/ot.py):
+//   { op: "insert", pos: 10, text: "abc" }
+//   { op: "delete", pos: 10, length: 3 }
+// A list of ops is applied in order, each against the text the previous one
+// left. transform() is a port of the server's, so both sides resolve
+// concurrent edits the same way (on an insert tie the server's op goes first).
+
+const insert = (pos, text) => ({ op: "insert", pos, text });
+const del = (pos, length) => ({ op: "delete", pos, length });
+
+// --- POSITIONS ---
+// The server counts code points, Monaco counts UTF-16 code units; they only
+// differ once the text has characters outside the BMP (emoji and the like).
+const SURROGATE = /[\uD800-\uDFFF]/;
+
+export const toCodePoints = (text, offset) =>
+  SURROGATE.test(text) ? Array.from(text.slice(0, offset)).length : offset;
+
+export const toUtf16 = (text, pos) => {
+  if (!SURROGATE.test(text)) return pos;
+  let offset = 0;
+  for (const ch of text) {
+    if (pos-- <= 0) break;
+    offset += ch.length;
+  }
+  return offset;
+};
+
+// Monaco reports all changes of one edit against the text before it; applied
+// back to front, every op's position is still valid when its turn comes.
+export const changesToOps = (changes, before) => {
+  const ops = [];
+  [...changes]
+    .sort((a, b) => b.rangeOffset - a.rangeOffset)
+    .forEach(({ rangeOffset, rangeLength, text }) => {
+      const pos = toCodePoints(before, rangeOffset);
+      const length = toCodePoints(before, rangeOffset + rangeLength) - pos;
+      if (length) ops.push(del(pos, length));
+      if (text) ops.push(insert(pos, text));
+    });
+  return ops;
+};
+
+// --- TRANSFORM ---
+const shrinkDelete = (a, b) => {
+  // Delete a, rewritten to apply after delete b already removed its range
+  const aEnd = a.pos + a.length;
+  const bEnd = b.pos + b.length;
+  if (aEnd <= b.pos) return [a];
+  if (a.pos >= bEnd) return [del(a.pos - b.length, a.length)];
+
+  const overlap = Math.min(aEnd, bEnd) - Math.max(a.pos, b.pos);
+  const remaining = a.length - overlap;
+  return remaining > 0 ? [del(Math.min(a.pos, b.pos), remaining)] : [];
+};
+
+const transformInsertDelete = (ins, d) => {
+  const insLen = Array.from(ins.text).length;
+  const delEnd = d.pos + d.length;
+
+  if (ins.pos <= d.pos) return [[ins], [del(d.pos + insLen, d.length)]];
+  if (ins.pos >= delEnd) return [[insert(ins.pos - d.length, ins.text)], [d]];
+
+  // Insert landed inside the deleted range: keep it and split the delete around it
+  const head = ins.pos - d.pos;
+  return [[insert(d.pos, ins.text)], [del(d.pos, head), del(d.pos + insLen, d.length - head)]];
+};
+
+const transformPair = (a, b) => {
+  if (a.op === "insert" && b.op === "insert") {
+    if (a.pos < b.pos) return [[a], [insert(b.pos + Array.from(a.text).length, b.text)]];
+    return [[insert(a.pos + Array.from(b.text).length, a.text)], [b]];
+  }
+  if (a.op === "insert") return transformInsertDelete(a, b);
+  if (b.op === "insert") {
+    const [bPrime, aPrime] = transformInsertDelete(b, a);
+    return [aPrime, bPrime];
+  }
+  return [shrinkDelete(a, b), shrinkDelete(b, a)];
+};
+
+// Returns [a', b'] for two op lists made against the same text:
+// apply(apply(text, b), a') === apply(apply(text, a), b'). b is the server's.
+export const transform = (a, b) => {
+  if (!a.length || !b.length) return [a, b];
+  if (a.length === 1 && b.length === 1) return transformPair(a[0], b[0]);
+
+  if (a.length > 1) {
+    const [first, b1] = transform(a.slice(0, 1), b);
+    const [rest, b2] = transform(a.slice(1), b1);
+    return [first.concat(rest), b2];
+  }
+  const [a1, first] = transform(a, b.slice(0, 1));
+  const [a2, rest] = transform(a1, b.slice(1));
+  return [a2, first.concat(rest)];
+};
+
+// --- CLIENT STATE ---
+// One code_ops message in flight at a time; edits made meanwhile are
+// buffered and sent once the server acks it. Remote revisions are applied
+// strictly in order: frames can arrive out of order (the ack goes straight
+// back to us, other members' edits go through the channel layer), so early
+// ones wait, and a gap that doesn't close on its own is filled with a sync.
+const GAP_TIMEOUT = 1000;
+
+// How far we've applied is reported back ("applied"), at least every
+// APPLIED_EVERY revisions and otherwise APPLIED_DELAY ms after a change;
+// the server holds further edits for a client that falls too far behind.
+const APPLIED_EVERY = 20;
+const APPLIED_DELAY = 200;
+
+export class DocumentSync {
+  constructor(send, applyRemote) {
+    this.send = send;               // (message) => void
+    this.applyRemote = applyRemote; // (ops) => void, applies server ops to the editor
+    this.gapTimer = null;
+    this.reported = -1;
+    this.reportTimer = null;
+    this.reset(0);
+  }
+
+  reset(rev) {
+    // Fresh room_state: whatever we had unacknowledged is part of it or lost
+    this.rev = rev;
+    this.inflight = null;
+    this.buffer = [];
+    this.ackRev = null;
+    this.early = new Map();
+    clearTimeout(this.gapTimer);
+    this.gapTimer = null;
+    this.report();
+  }
+
+  local(ops) {
+    if (!ops.length) return;
+    if (this.inflight) {
+      this.buffer = this.buffer.concat(ops);
+      return;
+    }
+    this.inflight = ops;
+    this.send({ type: "code_ops", rev: this.rev, ops });
+  }
+
+  ack(rev) {
+    this.ackRev = rev;
+    this.drain();
+  }
+
+  remote(rev, ops) {
+    if (rev <= this.rev) return;
+    this.early.set(rev, ops);
+    this.drain();
+  }
+
+  drain() {
+    for (;;) {
+      const next = this.rev + 1;
+      if (this.ackRev === next) {
+        // Our own edit; everything before it has been applied
+        this.rev = next;
+        this.ackRev = null;
+        this.inflight = null;
+        this.early.delete(next);
+        const buffered = this.buffer;
+        this.buffer = [];
+        this.local(buffered);
+        continue;
+      }
+
+      let ops = this.early.get(next);
+      if (!ops) break;
+      this.early.delete(next);
+      this.rev = next;
+      if (this.inflight) [this.inflight, ops] = transform(this.inflight, ops);
+      if (this.buffer.length) [this.buffer, ops] = transform(this.buffer, ops);
+      this.applyRemote(ops);
+    }
+
+    this.report();
+
+    const waiting = this.early.size > 0 || this.ackRev !== null;
+    if (!waiting) {
+      clearTimeout(this.gapTimer);
+      this.gapTimer = null;
+    } else if (this.gapTimer === null) {
+      this.gapTimer = setTimeout(() => {
+        this.gapTimer = null;
+        this.send({ type: "sync", rev: this.rev });
+      }, GAP_TIMEOUT);
+    }
+  }
+
+  report() {
+    if (this.rev === this.reported) return;
+    if (Math.abs(this.rev - this.reported) >= APPLIED_EVERY) {
+      this.sendReport();
+    } else if (this.reportTimer === null) {
+      this.reportTimer = setTimeout(() => this.sendReport(), APPLIED_DELAY);
+    }
+  }
+
+  sendReport() {
+    clearTimeout(this.reportTimer);
+    this.reportTimer = null;
+    this.reported = this.rev;
+    this.send({ type: "applied", rev: this.rev });
+  }
+
+  close() {
+    clearTimeout(this.gapTimer);
+    clearTimeout(this.reportTimer);
+    this.gapTimer = null;
+    this.reportTimer = null;
+  }
+}